@@ -1,11 +1,12 @@
 import os
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
-from flask_caching import Cache
 from flask_compress import Compress
 from routes.routes import register_routes
-from routes.rag_core import initialize_rag_system
+from routes import warmup
 from routes.config import SECRET_KEY, SQLALCHEMY_DATABASE_URI, SQLALCHEMY_TRACK_MODIFICATIONS
+from routes.config import CACHE_TYPE, CACHE_DEFAULT_TIMEOUT, CACHE_L1_SIZE, CACHE_L1_TTL
+from routes.app_cache import cache
 from routes.routes import UPLOAD_FOLDER
 
 # --- Inisialisasi Aplikasi ---
@@ -18,11 +19,16 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = SQLALCHEMY_TRACK_MODIFICATIONS
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
 # --- Konfigurasi Cache ---
-app.config['CACHE_TYPE'] = 'simple'  # Use Redis in production
-app.config['CACHE_DEFAULT_TIMEOUT'] = 300  # 5 minutes
-cache = Cache(app)
+# Satu instance bersama (routes memakai yang sama); entri di tabel app_cache terlihat oleh semua worker
+app.config['CACHE_TYPE'] = CACHE_TYPE
+app.config['CACHE_DEFAULT_TIMEOUT'] = CACHE_DEFAULT_TIMEOUT  # 5 minutes
+app.config['CACHE_L1_SIZE'] = CACHE_L1_SIZE
+app.config['CACHE_L1_TTL'] = CACHE_L1_TTL
+cache.init_app(app)
 
 # --- Konfigurasi Compression ---
+# Jangan kompres respons streaming (SSE /chat/stream) agar token langsung terkirim
+app.config['COMPRESS_STREAMS'] = False
 Compress(app)
 
 # --- Inisialisasi SQLAlchemy ---
@@ -36,17 +42,10 @@ if not os.path.exists(UPLOAD_FOLDER):
 # --- Registrasi Routes ---
 with app.app_context():
     register_routes(app)  # Hanya mengoper app, bukan db
-    try:
-        db.create_all()
-    except Exception as e:
-        print("⚠️ Gagal membuat tabel:", e)
-
-    # --- Inisialisasi Sistem RAG ---
-    try:
-        initialize_rag_system()
-        print("✅ RAG system berhasil diinisialisasi.")
-    except Exception as e:
-        print("⚠️ Gagal inisialisasi RAG system:", e)
+
+# --- Warm-up di background: db.create_all() dan indeks RAG (dibangun terpisah dengan build_index.py) ---
+# Halaman non-chat langsung dilayani; /readyz bernilai 200 setelah indeks termuat
+warmup.start(app)
 
 # --- Jalankan Aplikasi ---
 if __name__ == '__main__':
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Compare FAISS index types against the IndexFlatL2 baseline.
+
+Reports recall@k versus exact search, p50/p99 single-query latency, build
+time and serialized index size for every type in routes.ann_index, either
+on the vectors of the published corpus or on a synthetic clustered set.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import faiss
+import numpy as np
+from routes.ann_index import INDEX_TYPES, build_ann_index
+from routes.rag_core import (
+    current_index_dir, CHUNK_STORE_PREFIX, ChunkStore, embedding_store, embedding_client, EmbeddingStore,
+)
+
+def load_corpus_vectors():
+    """Vectors of the published index, read from the embedding cache (no API calls)"""
+    version_dir = current_index_dir()
+    if version_dir is None:
+        return None
+    chunk_store = ChunkStore.open(os.path.join(version_dir, CHUNK_STORE_PREFIX))
+    keys = [EmbeddingStore.make_key(embedding_client.model, "retrieval_document", text)
+            for _, text, _, _, _ in chunk_store.items()]
+    found = embedding_store.get_many(keys)
+    vectors = [found[key] for key in keys if key in found]
+    return np.array(vectors, dtype='float32') if vectors else None
+
+def synthetic_vectors(num_vectors, dimension, num_topics=50, seed=0):
+    """Clustered, normalized vectors roughly shaped like topic embeddings"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(num_topics, dimension)).astype('float32')
+    labels = rng.integers(0, num_topics, size=num_vectors)
+    vectors = centers[labels] + 0.6 * rng.normal(size=(num_vectors, dimension)).astype('float32')
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+def search_latencies_ms(index, queries, k):
+    """Per-query latency of single-row searches, as /chat issues them"""
+    latencies = np.empty(len(queries))
+    results = np.empty((len(queries), k), dtype='int64')
+    for i, query in enumerate(queries):
+        start = time.perf_counter()
+        _, ids = index.search(query.reshape(1, -1), k)
+        latencies[i] = (time.perf_counter() - start) * 1000
+        results[i] = ids[0]
+    return latencies, results
+
+def recall_at_k(approx, exact, k):
+    hits = sum(len(set(a[:k]) & set(e[:k]) - {-1}) for a, e in zip(approx, exact))
+    return hits / (len(exact) * k)
+
+def run(vectors, num_queries, k, index_types):
+    rng = np.random.default_rng(1)
+    order = rng.permutation(len(vectors))
+    # Query diambil dari vektor yang tidak dimasukkan ke indeks
+    queries = vectors[order[:num_queries]]
+    base = vectors[order[num_queries:]]
+    ids = np.arange(len(base), dtype='int64')
+
+    results, exact = [], None
+    for index_type in index_types:
+        start = time.perf_counter()
+        index = build_ann_index(index_type, base, ids)
+        build_s = time.perf_counter() - start
+        latencies, found = search_latencies_ms(index, queries, k)
+        if exact is None:
+            exact = found  # 'flat' selalu dijalankan pertama sebagai baseline
+        results.append({
+            'index_type': index_type,
+            'recall_at_k': round(recall_at_k(found, exact, k), 4),
+            'p50_ms': round(float(np.percentile(latencies, 50)), 4),
+            'p99_ms': round(float(np.percentile(latencies, 99)), 4),
+            'build_s': round(build_s, 3),
+            'index_bytes': int(faiss.serialize_index(index).nbytes),
+        })
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark jenis indeks FAISS terhadap IndexFlatL2")
+    parser.add_argument('--synthetic', type=int, metavar='N',
+                        help="Pakai N vektor sintetis alih-alih korpus yang dipublikasikan")
+    parser.add_argument('--dim', type=int, default=768, help="Dimensi vektor sintetis (default: 768)")
+    parser.add_argument('--queries', type=int, default=500, help="Jumlah query (default: 500)")
+    parser.add_argument('-k', type=int, default=5, help="Recall@k (default: 5)")
+    parser.add_argument('--types', nargs='+', choices=INDEX_TYPES, default=list(INDEX_TYPES))
+    parser.add_argument('--json', metavar='PATH', help="Tulis hasil sebagai JSON ke PATH")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        vectors = synthetic_vectors(args.synthetic, args.dim)
+    else:
+        vectors = load_corpus_vectors()
+        if vectors is None:
+            print("❌ Tidak ada indeks/embedding korpus. Jalankan build_index.py atau pakai --synthetic N.")
+            sys.exit(1)
+    if len(vectors) <= args.queries:
+        print(f"❌ Butuh lebih dari {args.queries} vektor, hanya ada {len(vectors)}.")
+        sys.exit(1)
+
+    index_types = ['flat'] + [t for t in args.types if t != 'flat']
+    print(f"📐 {len(vectors) - args.queries} vektor x {vectors.shape[1]} dimensi, {args.queries} query, k={args.k}\n")
+    results = run(vectors, args.queries, args.k, index_types)
+
+    print(f"{'type':<10} {'recall@' + str(args.k):>9} {'p50 ms':>9} {'p99 ms':>9} {'build s':>9} {'MB':>9}")
+    for r in results:
+        print(f"{r['index_type']:<10} {r['recall_at_k']:>9.4f} {r['p50_ms']:>9.3f} {r['p99_ms']:>9.3f} "
+              f"{r['build_s']:>9.2f} {r['index_bytes'] / 1e6:>9.2f}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'num_vectors': len(vectors) - args.queries, 'dimension': int(vectors.shape[1]),
+                       'queries': args.queries, 'k': args.k, 'results': results}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
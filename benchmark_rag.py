@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark of the RAG pipeline, one stage at a time.
+
+Generates a deterministic synthetic PDF corpus (or uses --corpus DIR), then
+times PDF extraction, chunking, embedding through the local hash backend,
+FAISS and BM25 index build and search, chunk store open, prompt assembly
+and the full /chat handler with a stub LLM. No network access is needed.
+
+Results can be written as JSON and compared against a stored baseline; the
+script exits with status 1 when a stage's p50 regresses past the tolerance:
+
+    python benchmark_rag.py --json bench_rag.json --baseline bench_rag_baseline.json
+    python benchmark_rag.py --baseline bench_rag_baseline.json --update-baseline
+"""
+
+import os
+
+# Harus di-set sebelum routes.* diimpor: config dibaca saat impor
+os.environ['EMBEDDING_BACKEND'] = 'local'
+os.environ['SEMANTIC_CACHE_ENABLED'] = '0'
+
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import fitz
+import numpy as np
+from flask import Flask
+from langchain.text_splitter import CharacterTextSplitter
+
+import routes.rag_core as rag_core
+from routes.models import db
+from routes.routes import register_routes
+from routes import warmup
+from routes.ann_index import INDEX_TYPES, build_ann_index
+from routes.chunk_store import ChunkStore
+from routes.lexical_index import LexicalIndex
+from routes.embedding_store import EmbeddingStore
+from routes.embedding_client import EmbeddingClient, LocalHashBackend
+from routes.index_builder import CHUNK_SIZE, CHUNK_OVERLAP
+from routes.prompt_builder import build_prompt
+from routes.config import EMBEDDING_BATCH_SIZE
+
+# Regresi di bawah selisih ini dianggap noise pengukuran
+MIN_REGRESSION_MS = 0.05
+
+WORDS = """
+padi jagung kedelai cabai bawang tomat wereng coklat hijau penggerek batang ulat grayak tikus
+blas hawar daun kresek tungro busuk pelepah layu bakteri fusarium pupuk urea npk sp36 kcl organik
+kompos pestisida insektisida fungisida imidakloprid mankozeb karbofuran abamektin dosis ml liter
+hektar varietas inpari ciherang mekongga tahan rentan tanam panen irigasi sawah lahan kering musim
+hujan kemarau benih persemaian jarak legowo gulma herbisida penyemprotan pengamatan ambang ekonomi
+musuh alami predator parasitoid trichoderma beauveria metarhizium produktivitas ton gabah kering
+""".split()
+
+class StubModel:
+    """Deterministic stand-in for the Gemini model"""
+
+    class _Response:
+        text = "Gunakan varietas tahan dan lakukan pengamatan rutin sesuai ambang ekonomi."
+
+    def generate_content(self, prompt, stream=False):
+        if stream:
+            return iter([self._Response()])
+        return self._Response()
+
+def generate_corpus(folder, num_pdfs, pages, seed=0):
+    """Write num_pdfs synthetic journal PDFs with a large-font title on page one"""
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    for n in range(num_pdfs):
+        doc = fitz.open()
+        for page_num in range(pages):
+            page = doc.new_page()
+            if page_num == 0:
+                page.insert_text((50, 60), f"Pengendalian Hama Terpadu pada Padi Sawah Jilid {n}", fontsize=18)
+            y = 100
+            for _ in range(45):
+                line = " ".join(rng.choice(WORDS) for _ in range(14))
+                page.insert_text((50, y), line, fontsize=9)
+                y += 15
+        doc.save(os.path.join(folder, f"jurnal_{n:04d}.pdf"))
+        doc.close()
+
+def generate_questions(count, seed=1):
+    rng = random.Random(seed)
+    return [f"bagaimana cara {' '.join(rng.choice(WORDS) for _ in range(5))} nomor {i}" for i in range(count)]
+
+def summarize(samples_ms):
+    samples = np.asarray(samples_ms)
+    return {
+        'n': int(len(samples)),
+        'p50_ms': round(float(np.percentile(samples, 50)), 4),
+        'p95_ms': round(float(np.percentile(samples, 95)), 4),
+        'total_ms': round(float(samples.sum()), 3),
+    }
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, (time.perf_counter() - start) * 1000
+
+def run(corpus_dir, work_dir, repeat, num_queries, index_type):
+    stages = {}
+    pdfs = sorted(os.path.join(corpus_dir, f) for f in os.listdir(corpus_dir) if f.lower().endswith('.pdf'))
+    hashes = {path: rag_core.file_sha256(path) for path in pdfs}
+
+    # Ekstraksi: cache LRU dan cache disk dikosongkan tiap putaran
+    samples = []
+    for round_num in range(repeat):
+        rag_core.CACHE_FOLDER = os.path.join(work_dir, f"extract_{round_num}")
+        os.makedirs(rag_core.CACHE_FOLDER)
+        rag_core.extract_text_from_pdf.cache_clear()
+        for path in pdfs:
+            pages, ms = timed(rag_core.extract_text_from_pdf, path, hashes[path])
+            samples.append(ms)
+    stages['extract_pdf'] = summarize(samples)
+    pages_by_pdf = [rag_core.extract_text_from_pdf(path, hashes[path]) for path in pdfs]
+
+    splitter = CharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    samples, chunks = [], []
+    for pages in pages_by_pdf:
+        file_chunks, ms = timed(splitter.split_documents, pages)
+        samples.append(ms)
+        chunks.extend(file_chunks)
+    stages['chunk_pdf'] = summarize(samples)
+    doc_chunks = dict(enumerate(chunks))
+    texts = [chunk.page_content for chunk in chunks]
+    chunk_ids = np.arange(len(chunks), dtype='int64')
+
+    client = EmbeddingClient(LocalHashBackend(), batch_size=EMBEDDING_BATCH_SIZE)
+    samples = []
+    for _ in range(repeat):
+        vectors, ms = timed(client.embed, texts, "retrieval_document")
+        samples.append(ms)
+    stages['embed_corpus'] = summarize(samples)
+    vectors = np.asarray(vectors, dtype='float32')
+
+    samples = []
+    for _ in range(repeat):
+        faiss_index, ms = timed(build_ann_index, index_type, vectors, chunk_ids)
+        samples.append(ms)
+    stages['index_build'] = summarize(samples)
+
+    samples = []
+    for _ in range(repeat):
+        lexical_index, ms = timed(LexicalIndex.build, chunk_ids, texts)
+        samples.append(ms)
+    stages['bm25_build'] = summarize(samples)
+
+    store_prefix = os.path.join(work_dir, 'chunks')
+    ChunkStore.write(store_prefix, doc_chunks)
+    samples = []
+    for _ in range(repeat):
+        chunk_store, ms = timed(ChunkStore.open, store_prefix)
+        samples.append(ms)
+    stages['chunk_store_open'] = summarize(samples)
+
+    questions = generate_questions(num_queries)
+    query_vectors = client.embed(questions, "retrieval_query")
+    samples = []
+    for query in query_vectors:
+        _, ms = timed(faiss_index.search, np.asarray([query], dtype='float32'), rag_core.RETRIEVAL_CANDIDATES)
+        samples.append(ms)
+    stages['faiss_search'] = summarize(samples)
+
+    samples = []
+    for question in questions:
+        _, ms = timed(lexical_index.search, question, rag_core.RETRIEVAL_CANDIDATES)
+        samples.append(ms)
+    stages['bm25_search'] = summarize(samples)
+
+    rag = rag_core.RAGSystem(faiss_index, chunk_store, StubModel(), 'benchmark', lexical_index)
+    history = [{'user': question, 'bot': StubModel._Response.text * 4} for question in questions[:6]]
+    samples = []
+    for query, question in zip(query_vectors, questions):
+        _, ids = faiss_index.search(np.asarray([query], dtype='float32'), rag_core.RETRIEVAL_TOP_K)
+        context_chunks, _ = rag_core.context_from_ids(rag, ids[0])
+        _, ms = timed(build_prompt, question, history, context_chunks)
+        samples.append(ms)
+    stages['prompt_build'] = summarize(samples)
+
+    rag_core.embedding_store = EmbeddingStore(os.path.join(work_dir, 'embeddings.sqlite3'))
+    warmup.mark_ready(rag)
+    app = Flask(__name__)
+    app.config.update(SECRET_KEY='benchmark', SQLALCHEMY_DATABASE_URI='sqlite://', CACHE_TYPE='NullCache')
+    db.init_app(app)
+    register_routes(app)
+    client = app.test_client()
+    samples = []
+    for question in generate_questions(num_queries, seed=2):
+        response, ms = timed(client.post, '/chat', json={'message': question, 'history': history})
+        if response.status_code != 200 or 'sources' not in response.get_json():
+            raise RuntimeError(f"/chat gagal: {response.status_code} {response.get_data(as_text=True)}")
+        samples.append(ms)
+    stages['chat_handler'] = summarize(samples)
+
+    return stages, {'pdfs': len(pdfs), 'chunks': len(chunks)}
+
+def compare(results, baseline, tolerance):
+    """Return a list of (stage, baseline p50, current p50) that regressed"""
+    regressions = []
+    for stage, current in results['stages'].items():
+        previous = baseline.get('stages', {}).get(stage)
+        if previous is None:
+            continue
+        limit = max(previous['p50_ms'] * (1 + tolerance), previous['p50_ms'] + MIN_REGRESSION_MS)
+        if current['p50_ms'] > limit:
+            regressions.append((stage, previous['p50_ms'], current['p50_ms']))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark tahapan pipeline RAG secara offline")
+    parser.add_argument('--corpus', metavar='DIR', help="Folder PDF fixture (default: korpus sintetis)")
+    parser.add_argument('--pdfs', type=int, default=20, help="Jumlah PDF sintetis (default: 20)")
+    parser.add_argument('--pages', type=int, default=5, help="Halaman per PDF sintetis (default: 5)")
+    parser.add_argument('--queries', type=int, default=200, help="Jumlah query (default: 200)")
+    parser.add_argument('--repeat', type=int, default=3, help="Ulangan tahap build (default: 3)")
+    parser.add_argument('--index-type', choices=INDEX_TYPES, default='flat')
+    parser.add_argument('--json', metavar='PATH', help="Tulis hasil sebagai JSON ke PATH")
+    parser.add_argument('--baseline', metavar='PATH', help="Bandingkan p50 tiap tahap dengan baseline di PATH")
+    parser.add_argument('--update-baseline', action='store_true', help="Simpan hasil sebagai baseline baru")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="Kenaikan p50 yang masih diterima, relatif (default: 0.25)")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='bench_rag_')
+    try:
+        corpus_dir = args.corpus
+        if corpus_dir is None:
+            corpus_dir = os.path.join(work_dir, 'corpus')
+            generate_corpus(corpus_dir, args.pdfs, args.pages)
+        stages, sizes = run(corpus_dir, work_dir, args.repeat, args.queries, args.index_type)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    params = {'corpus': args.corpus or f"synthetic:{args.pdfs}x{args.pages}", 'queries': args.queries,
+              'index_type': args.index_type, **sizes}
+    results = {'params': params, 'stages': stages}
+
+    print(f"📐 {sizes['pdfs']} PDF, {sizes['chunks']} chunk, {args.queries} query, indeks {args.index_type}\n")
+    print(f"{'stage':<18} {'n':>6} {'p50 ms':>10} {'p95 ms':>10} {'total ms':>11}")
+    for stage, r in stages.items():
+        print(f"{stage:<18} {r['n']:>6} {r['p50_ms']:>10.3f} {r['p95_ms']:>10.3f} {r['total_ms']:>11.1f}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline and args.update_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"\n✅ Baseline disimpan ke {args.baseline}")
+    elif args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('params') != params:
+            print(f"\n⚠️ Parameter baseline berbeda ({baseline.get('params')}), hasil mungkin tidak sebanding.")
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n❌ Regresi (> {args.tolerance:.0%} dari baseline):")
+            for stage, before, after in regressions:
+                print(f"  {stage}: p50 {before:.3f} ms -> {after:.3f} ms")
+            sys.exit(1)
+        print("\n✅ Tidak ada regresi terhadap baseline.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+Build or update the RAG index outside the web process
+"""
+
+import os
+import sys
+import argparse
+from routes.index_builder import build_index
+from routes.ann_index import INDEX_TYPES
+from routes.config import RAG_INDEX_TYPE
+
+def main():
+    parser = argparse.ArgumentParser(description="Bangun indeks RAG dari jurnal PDF")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help="Jumlah proses untuk ekstraksi PDF (default: jumlah core)")
+    parser.add_argument('--keep', type=int, default=3,
+                        help="Jumlah versi indeks yang disimpan (default: 3)")
+    parser.add_argument('--full', action='store_true',
+                        help="Abaikan indeks yang ada dan bangun ulang dari awal")
+    parser.add_argument('--index-type', choices=INDEX_TYPES, default=RAG_INDEX_TYPE,
+                        help=f"Jenis indeks FAISS (default: {RAG_INDEX_TYPE})")
+    args = parser.parse_args()
+
+    print("🚀 AgroLLM Index Builder")
+    print("=" * 50)
+    try:
+        build_index(workers=args.workers, keep_versions=max(1, args.keep), full=args.full,
+                    index_type=args.index_type)
+    except KeyboardInterrupt:
+        print("\n⏸️ Build dihentikan. Jalankan lagi untuk melanjutkan; embedding yang sudah ada tidak dihitung ulang.")
+        sys.exit(130)
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,7 @@ Database migration script for performance optimizations
 
 import os
 import sys
+from datetime import datetime
 from sqlalchemy import create_engine, text
 from routes.config import SQLALCHEMY_DATABASE_URI
 
@@ -46,6 +47,7 @@ def run_migration():
                 ("CREATE INDEX IF NOT EXISTS idx_pengaduan_incident_date ON pengaduan(incident_date)", "Pengaduan incident_date index"),
                 ("CREATE INDEX IF NOT EXISTS idx_pengaduan_region_status ON pengaduan(region, status)", "Pengaduan region_status composite index"),
                 ("CREATE INDEX IF NOT EXISTS idx_pengaduan_user_created ON pengaduan(user_id, created_at)", "Pengaduan user_created composite index"),
+                ("CREATE INDEX IF NOT EXISTS idx_pengaduan_region_created ON pengaduan(region, created_at)", "Pengaduan region_created composite index"),
             ]
             
             # Create indexes
@@ -115,65 +117,295 @@ def optimize_database():
         print(f"⚠️ Could not optimize database settings: {e}")
 
 def create_cache_table():
-    """Create cache table for application-level caching"""
+    """Create the UNLOGGED app_cache table used by the shared cache backend (routes/app_cache.py)"""
     
     print("\n🗄️ Creating cache table...")
     
+    from routes.app_cache import create_table
+    engine = create_engine(SQLALCHEMY_DATABASE_URI)
+    
+    try:
+        with engine.begin() as conn:
+            existing = conn.execute(text("""
+                SELECT c.relpersistence, format_type(a.atttypid, a.atttypmod)
+                FROM pg_class c
+                JOIN pg_attribute a ON a.attrelid = c.oid AND a.attname = 'cache_value'
+                WHERE c.oid = to_regclass('app_cache')
+            """)).first()
+            if existing is not None and existing[1] != 'bytea':
+                # Skema lama (TEXT, TIMESTAMP) tidak pernah dipakai: aman dibuat ulang
+                conn.execute(text("DROP TABLE app_cache"))
+                print("   Old app_cache schema replaced")
+            elif existing is not None and existing[0] == 'p':
+                conn.execute(text("ALTER TABLE app_cache SET UNLOGGED"))
+                print("   app_cache switched to UNLOGGED")
+            create_table(conn)
+            print("✅ Cache table created")
+            
+    except Exception as e:
+        print(f"⚠️ Could not create cache table: {e}")
+
+def create_stats_tables():
+    """Create counter tables read by the monitoring pages"""
+    
+    print("\n📊 Creating statistics tables...")
+    
     engine = create_engine(SQLALCHEMY_DATABASE_URI)
     
     try:
         with engine.connect() as conn:
-            # Create cache table
             conn.execute(text("""
-                CREATE TABLE IF NOT EXISTS app_cache (
-                    cache_key VARCHAR(255) PRIMARY KEY,
-                    cache_value TEXT,
-                    expires_at TIMESTAMP,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                CREATE TABLE IF NOT EXISTS pengaduan_stats (
+                    region VARCHAR(100) NOT NULL,
+                    status VARCHAR(20) NOT NULL,
+                    category VARCHAR(50) NOT NULL,
+                    count BIGINT NOT NULL DEFAULT 0,
+                    PRIMARY KEY (region, status, category)
                 )
             """))
-            
-            # Create index on expires_at for cleanup
             conn.execute(text("""
-                CREATE INDEX IF NOT EXISTS idx_cache_expires 
-                ON app_cache(expires_at)
+                CREATE TABLE IF NOT EXISTS user_stats (
+                    role VARCHAR(20) PRIMARY KEY,
+                    count BIGINT NOT NULL DEFAULT 0
+                )
             """))
+            conn.commit()
+            print("✅ Statistics tables created")
             
+    except Exception as e:
+        print(f"⚠️ Could not create statistics tables: {e}")
+
+def create_upload_table():
+    """Create the table tracking uploaded images and their variants"""
+    
+    print("\n🖼️ Creating upload table...")
+    
+    engine = create_engine(SQLALCHEMY_DATABASE_URI)
+    
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS upload (
+                    id SERIAL PRIMARY KEY,
+                    filename VARCHAR(255) NOT NULL UNIQUE,
+                    kind VARCHAR(20) NOT NULL,
+                    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+                    size_bytes BIGINT NOT NULL,
+                    ref_count INTEGER NOT NULL DEFAULT 1,
+                    width INTEGER,
+                    height INTEGER,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """))
+            conn.execute(text("ALTER TABLE upload ADD COLUMN IF NOT EXISTS ref_count INTEGER NOT NULL DEFAULT 1"))
             conn.commit()
-            print("✅ Cache table created")
+            print("✅ Upload table created")
             
     except Exception as e:
-        print(f"⚠️ Could not create cache table: {e}")
+        print(f"⚠️ Could not create upload table: {e}")
 
-def cleanup_old_data():
-    """Clean up old data for better performance"""
+def create_ingest_table():
+    """Create the idempotency key table used by batch complaint sync"""
     
-    print("\n🧹 Cleaning up old data...")
+    print("\n🔑 Creating ingest key table...")
     
     engine = create_engine(SQLALCHEMY_DATABASE_URI)
     
     try:
         with engine.connect() as conn:
-            # Clean up expired cache entries
             conn.execute(text("""
-                DELETE FROM app_cache 
-                WHERE expires_at < CURRENT_TIMESTAMP
+                CREATE TABLE IF NOT EXISTS ingest_key (
+                    user_id INTEGER NOT NULL REFERENCES "user"(id) ON DELETE CASCADE,
+                    key VARCHAR(64) NOT NULL,
+                    pengaduan_id INTEGER,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (user_id, key)
+                )
             """))
+            conn.commit()
+            print("✅ Ingest key table created")
             
-            # Clean up old file uploads (older than 1 year)
+    except Exception as e:
+        print(f"⚠️ Could not create ingest key table: {e}")
+
+def create_search_index():
+    """Add the full-text search column on pengaduan and its GIN index"""
+    
+    print("\n🔎 Creating full-text search index...")
+    
+    from routes.search import ts_config, search_vector_sql
+    engine = create_engine(SQLALCHEMY_DATABASE_URI)
+    
+    try:
+        with engine.connect() as conn:
+            config = ts_config(conn)
+            # Kolom generated STORED: menulis ulang tabel sekali, jalankan di luar jam sibuk
+            conn.execute(text(f"""
+                ALTER TABLE pengaduan ADD COLUMN IF NOT EXISTS search_vector tsvector
+                GENERATED ALWAYS AS ({search_vector_sql(config)}) STORED
+            """))
             conn.execute(text("""
-                DELETE FROM pengaduan 
-                WHERE created_at < CURRENT_TIMESTAMP - INTERVAL '1 year'
-                AND status = 'processed'
+                CREATE INDEX IF NOT EXISTS idx_pengaduan_search
+                ON pengaduan USING GIN (search_vector)
             """))
+            conn.commit()
+            print(f"✅ Full-text search index created (config: {config})")
             
+    except Exception as e:
+        print(f"⚠️ Could not create full-text search index: {e}")
+
+def reconcile_stats_tables():
+    """Recount statistics tables and repair drift (safe to run from cron)"""
+    
+    print("\n🔁 Reconciling statistics tables...")
+    
+    from routes.stats import reconcile_stats
+    engine = create_engine(SQLALCHEMY_DATABASE_URI)
+    
+    try:
+        with engine.begin() as conn:
+            repaired = reconcile_stats(conn)
+        print(f"✅ Statistics reconciled, {repaired} rows repaired")
+            
+    except Exception as e:
+        print(f"⚠️ Could not reconcile statistics: {e}")
+
+def partition_pengaduan_table():
+    """Convert pengaduan into a table range-partitioned by month on created_at.
+
+    The existing table is attached as the partition pengaduan_legacy without
+    copying rows. Steps that scan it (bound check, unique index) run first
+    without blocking writes; the swap holds an exclusive lock only for
+    catalog changes. Foreign keys pointing at pengaduan are dropped, since a
+    partitioned table's primary key must include created_at.
+    """
+    
+    print("\n🧱 Partitioning pengaduan by month...")
+    
+    from routes.retention import is_partitioned, ensure_partitions, add_months, LEGACY_PARTITION
+    engine = create_engine(SQLALCHEMY_DATABASE_URI)
+    
+    try:
+        with engine.connect() as conn:
+            if is_partitioned(conn):
+                created = ensure_partitions(conn)
+                conn.commit()
+                print(f"✅ pengaduan already partitioned, {len(created)} partitions added")
+                return
+            # Batas legacy dua bulan ke depan: insert selama migrasi tetap lolos CHECK
+            cutover = add_months(datetime.utcnow(), 2)
+            conn.execute(text("UPDATE pengaduan SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL"))
+            conn.execute(text(f"""
+                ALTER TABLE pengaduan ADD CONSTRAINT pengaduan_legacy_bound
+                CHECK (created_at IS NOT NULL AND created_at < '{cutover:%Y-%m-%d}') NOT VALID
+            """))
+            conn.commit()
+            # VALIDATE hanya mengambil SHARE UPDATE EXCLUSIVE: insert/update tetap jalan
+            conn.execute(text("ALTER TABLE pengaduan VALIDATE CONSTRAINT pengaduan_legacy_bound"))
             conn.commit()
-            print("✅ Old data cleaned up")
+        
+        with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            conn.execute(text("""
+                CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS pengaduan_id_created_key
+                ON pengaduan (id, created_at)
+            """))
+        
+        with engine.begin() as conn:
+            conn.execute(text("SET LOCAL lock_timeout = '10s'"))
+            conn.execute(text("LOCK TABLE pengaduan IN ACCESS EXCLUSIVE MODE"))
+            indexes = conn.execute(text("""
+                SELECT c.relname, pg_get_indexdef(c.oid), x.indisunique
+                FROM pg_index x JOIN pg_class c ON c.oid = x.indexrelid
+                WHERE x.indrelid = 'pengaduan'::regclass
+            """)).all()
+            references = conn.execute(text("""
+                SELECT conname, conrelid::regclass::text FROM pg_constraint
+                WHERE confrelid = 'pengaduan'::regclass AND contype = 'f'
+            """)).all()
+            for name, table in references:
+                conn.execute(text(f'ALTER TABLE {table} DROP CONSTRAINT "{name}"'))
+            
+            conn.execute(text(f"ALTER TABLE pengaduan RENAME TO {LEGACY_PARTITION}"))
+            for name, _, _ in indexes:
+                conn.execute(text(f'ALTER INDEX "{name}" RENAME TO "{name[:56]}_legacy"'))
+            # Tidak memindai tabel: CHECK yang sudah tervalidasi membuktikan NOT NULL
+            conn.execute(text(f"ALTER TABLE {LEGACY_PARTITION} ALTER COLUMN created_at SET NOT NULL"))
+            conn.execute(text(f"""
+                CREATE TABLE pengaduan (
+                    LIKE {LEGACY_PARTITION} INCLUDING DEFAULTS INCLUDING GENERATED INCLUDING STORAGE
+                ) PARTITION BY RANGE (created_at)
+            """))
+            conn.execute(text("ALTER TABLE pengaduan ADD CONSTRAINT pengaduan_pkey PRIMARY KEY (id, created_at)"))
+            conn.execute(text("ALTER SEQUENCE pengaduan_id_seq OWNED BY pengaduan.id"))
+            # Memakai CHECK dan indeks unik (id, created_at) yang sudah ada, tanpa scan
+            conn.execute(text(f"""
+                ALTER TABLE pengaduan ATTACH PARTITION {LEGACY_PARTITION}
+                FOR VALUES FROM (MINVALUE) TO ('{cutover:%Y-%m-%d}')
+            """))
+            conn.execute(text(f"ALTER TABLE {LEGACY_PARTITION} DROP CONSTRAINT pengaduan_legacy_bound"))
+            conn.execute(text('ALTER TABLE pengaduan ADD FOREIGN KEY (user_id) REFERENCES "user"(id) ON DELETE CASCADE'))
+            # Indeks di tabel induk memakai ulang indeks legacy yang setara
+            for _, definition, unique in indexes:
+                if not unique:
+                    conn.execute(text(definition))
+            created = ensure_partitions(conn)
+        print(f"✅ pengaduan partitioned, legacy rows until {cutover:%Y-%m-%d}, {len(created)} monthly partitions")
+            
+    except Exception as e:
+        print(f"⚠️ Could not partition pengaduan: {e}")
+
+def purge_expired_cache(batch_size=5000):
+    """Delete expired app_cache rows in small batches, each its own transaction"""
+    
+    print("\n🧽 Purging expired cache entries...")
+    
+    from routes.app_cache import sweep_expired
+    engine = create_engine(SQLALCHEMY_DATABASE_URI)
+    
+    try:
+        purged = 0
+        while True:
+            with engine.begin() as conn:
+                count = sweep_expired(conn, batch_size)
+            purged += count
+            if count < batch_size:
+                break
+        print(f"✅ {purged} expired cache entries purged")
+            
+    except Exception as e:
+        print(f"⚠️ Could not purge cache: {e}")
+
+def cleanup_old_data(archive=False):
+    """Apply complaint retention and delete their unused upload files (see routes/retention.py)"""
+    
+    print("\n🧹 Cleaning up old data...")
+    
+    from routes.retention import run_retention
+    from routes.config import RETENTION_DAYS, UPLOAD_FOLDER
+    engine = create_engine(SQLALCHEMY_DATABASE_URI)
+    
+    try:
+        summary = run_retention(engine, UPLOAD_FOLDER, RETENTION_DAYS, archive)
+        print(f"✅ Old data cleaned up: {len(summary['partitions_retired'])} partitions "
+              f"{'archived' if archive else 'dropped'}, {summary['rows_deleted']} rows deleted, "
+              f"{len(summary['partitions_created'])} partitions created")
             
     except Exception as e:
         print(f"⚠️ Could not clean up old data: {e}")
 
 if __name__ == "__main__":
+    if '--reconcile-stats' in sys.argv:
+        reconcile_stats_tables()
+        sys.exit(0)
+    if '--retention' in sys.argv:
+        # Aman dijalankan di jam kerja, mis. setiap malam dari cron
+        purge_expired_cache()
+        cleanup_old_data(archive='--archive' in sys.argv)
+        sys.exit(0)
+    if '--partition' in sys.argv:
+        partition_pengaduan_table()
+        sys.exit(0)
+
     print("🚀 AgroLLM Database Migration Tool")
     print("=" * 50)
     
@@ -181,7 +413,14 @@ if __name__ == "__main__":
     run_migration()
     optimize_database()
     create_cache_table()
+    create_stats_tables()
+    create_upload_table()
+    create_ingest_table()
+    create_search_index()
+    purge_expired_cache()
     cleanup_old_data()
+    # Juga mengisi tabel statistik pertama kali dan mengoreksi hapus massal di atas
+    reconcile_stats_tables()
     
     print("\n🎉 All optimizations completed successfully!")
     print("\n📝 Next steps:")
@@ -0,0 +1,90 @@
+"""
+FAISS index factory for the RAG corpus.
+
+The index type is chosen at build time (RAG_INDEX_TYPE or
+``build_index.py --index-type``). Every type is wrapped in IndexIDMap2 so
+vectors stay addressable by chunk ID. Use benchmark_index.py to compare
+recall, latency and memory of the options on the real corpus.
+"""
+
+import math
+import faiss
+import numpy as np
+
+INDEX_TYPES = ('flat', 'ivf_flat', 'ivf_pq', 'hnsw', 'sq8', 'sq_fp16')
+
+# Parameter pencarian, ikut tersimpan di file indeks
+IVF_NPROBE = 16
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 80
+HNSW_EF_SEARCH = 64
+PQ_MAX_SUBQUANTIZERS = 64
+PQ_NBITS = 8
+
+# faiss butuh ~39 titik latih per centroid IVF dan 2^nbits titik untuk PQ
+_MIN_POINTS_PER_CENTROID = 39
+
+def _ivf_nlist(num_vectors):
+    nlist = int(4 * math.sqrt(num_vectors))
+    return max(1, min(nlist, num_vectors // _MIN_POINTS_PER_CENTROID))
+
+def _pq_subquantizers(dimension):
+    """Largest divisor of dimension not above PQ_MAX_SUBQUANTIZERS"""
+    for m in range(min(PQ_MAX_SUBQUANTIZERS, dimension), 0, -1):
+        if dimension % m == 0:
+            return m
+    return 1
+
+def factory_string(index_type, dimension, num_vectors):
+    """Translate an index type into a faiss.index_factory description.
+
+    Falls back to 'Flat' when there are too few vectors to train the
+    requested quantizer.
+    """
+    if index_type == 'flat':
+        return 'Flat'
+    if index_type == 'sq8':
+        return 'SQ8'
+    if index_type == 'sq_fp16':
+        return 'SQfp16'
+    if index_type == 'hnsw':
+        return f'HNSW{HNSW_M}'
+    if index_type in ('ivf_flat', 'ivf_pq'):
+        nlist = _ivf_nlist(num_vectors)
+        if nlist < 2 or (index_type == 'ivf_pq' and num_vectors < 2 ** PQ_NBITS):
+            print(f"⚠️ Hanya {num_vectors} vektor, terlalu sedikit untuk {index_type}; memakai Flat.")
+            return 'Flat'
+        if index_type == 'ivf_flat':
+            return f'IVF{nlist},Flat'
+        return f'IVF{nlist},PQ{_pq_subquantizers(dimension)}x{PQ_NBITS}'
+    raise ValueError(f"Unknown index type: {index_type} (pilih dari {', '.join(INDEX_TYPES)})")
+
+def supports_remove(index_type):
+    """HNSW graphs cannot delete vectors; changing them requires a rebuild"""
+    return index_type != 'hnsw'
+
+def is_ivf(index_type):
+    return index_type.startswith('ivf')
+
+def build_ann_index(index_type, vectors, ids):
+    """Create, train if needed and fill an ID-mapped index of the given type"""
+    vectors = np.ascontiguousarray(vectors, dtype='float32')
+    dimension = vectors.shape[1]
+    base = faiss.index_factory(dimension, factory_string(index_type, dimension, len(vectors)), faiss.METRIC_L2)
+    if not base.is_trained:
+        base.train(vectors)
+    if isinstance(base, faiss.IndexHNSW):
+        base.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+    index = faiss.IndexIDMap2(base)
+    index.add_with_ids(vectors, np.asarray(ids, dtype='int64'))
+    configure_search(index)
+    return index
+
+def configure_search(index):
+    """Apply search-time parameters (nprobe, efSearch) to an index"""
+    base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    if isinstance(base, faiss.IndexIVF):
+        base.nprobe = min(IVF_NPROBE, base.nlist)
+    elif isinstance(base, faiss.IndexHNSW):
+        base.hnsw.efSearch = HNSW_EF_SEARCH
+    return index
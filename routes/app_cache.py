@@ -0,0 +1,281 @@
+"""
+Flask-Caching backend on the app_cache table, shared by every worker.
+
+With CACHE_TYPE='simple' each gunicorn worker had its own dict: a cold cache
+per worker, and an invalidation in one worker never reached the others. Here
+every entry lives in one PostgreSQL table, so a set or delete in any worker
+is seen by all of them at once. The table is UNLOGGED (no WAL, emptied after
+a crash, which is fine for a cache) and values are pickled into BYTEA,
+zlib-compressed when that makes them smaller.
+
+Expired rows are never returned. They are removed in small batches by the
+worker that writes after the sweep interval has passed, and by
+migrate_db.py --retention.
+
+An optional per-process L1 tier (CACHE_L1_SIZE entries for CACHE_L1_TTL
+seconds) avoids the round trip for hot keys. A delete in another worker can
+then be missed for up to CACHE_L1_TTL seconds, so it is off by default.
+"""
+
+import os
+import time
+import zlib
+import pickle
+import random
+import threading
+from cachetools import TTLCache
+from flask_caching import Cache
+from flask_caching.backends.base import BaseCache
+from sqlalchemy import MetaData, Table, Column, Text, LargeBinary, Float, Index
+from sqlalchemy import create_engine, select, delete, or_, text
+from sqlalchemy.exc import SQLAlchemyError
+
+from .models import dialect_insert
+from .config import CACHE_SWEEP_INTERVAL, CACHE_SWEEP_BATCH
+
+# Satu instance untuk seluruh aplikasi; di-init di app.py (atau register_routes)
+cache = Cache()
+
+metadata = MetaData()
+app_cache = Table(
+    'app_cache', metadata,
+    Column('cache_key', Text, primary_key=True),
+    Column('cache_value', LargeBinary, nullable=False),
+    Column('expires_at', Float),  # epoch detik; NULL = tidak kedaluwarsa
+    Index('idx_cache_expires', 'expires_at'),
+)
+
+COMPRESS_MIN_BYTES = 1024
+RAW, ZLIB = b'\x00', b'\x01'
+WARNING_INTERVAL = 60
+_MISSING = object()
+
+def dumps(value):
+    """Pickle a value, compressed if large enough to gain from it, behind a one-byte tag"""
+    data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    if len(data) >= COMPRESS_MIN_BYTES:
+        packed = zlib.compress(data, 1)
+        if len(packed) < len(data):
+            return ZLIB + packed
+    return RAW + data
+
+def loads(blob):
+    blob = bytes(blob)  # psycopg2 mengembalikan memoryview untuk BYTEA
+    data = zlib.decompress(blob[1:]) if blob[:1] == ZLIB else blob[1:]
+    return pickle.loads(data)
+
+def create_table(connection):
+    """Create app_cache if missing (UNLOGGED on PostgreSQL)"""
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text("""
+            CREATE UNLOGGED TABLE IF NOT EXISTS app_cache (
+                cache_key TEXT PRIMARY KEY,
+                cache_value BYTEA NOT NULL,
+                expires_at DOUBLE PRECISION
+            )
+        """))
+        connection.execute(text("CREATE INDEX IF NOT EXISTS idx_cache_expires ON app_cache (expires_at)"))
+    else:
+        metadata.create_all(connection, checkfirst=True)
+
+def sweep_expired(connection, batch_size=CACHE_SWEEP_BATCH, now=None):
+    """Delete one batch of expired entries; returns how many were removed"""
+    expired = (select(app_cache.c.cache_key)
+               .where(app_cache.c.expires_at <= (now or time.time()))
+               .limit(batch_size).with_for_update(skip_locked=True))
+    return connection.execute(delete(app_cache).where(app_cache.c.cache_key.in_(expired))).rowcount
+
+def _live(now):
+    return or_(app_cache.c.expires_at.is_(None), app_cache.c.expires_at > now)
+
+class AppCache(BaseCache):
+    """Cache entries in the app_cache table, optionally fronted by a small per-process L1"""
+
+    def __init__(self, url, default_timeout=300, key_prefix='', l1_size=0, l1_ttl=0,
+                 sweep_interval=CACHE_SWEEP_INTERVAL, sweep_batch=CACHE_SWEEP_BATCH, engine_options=None):
+        super().__init__(default_timeout=default_timeout)
+        self.url = url
+        self.key_prefix = key_prefix
+        self.sweep_interval = sweep_interval
+        self.sweep_batch = sweep_batch
+        self.engine_options = engine_options or {}
+        # L1 menyimpan bytes hasil dumps: tiap get mendapat salinan sendiri seperti dari database
+        self._l1 = TTLCache(maxsize=l1_size, ttl=l1_ttl) if l1_size > 0 and l1_ttl > 0 else None
+        self._l1_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._engine = None
+        self._pid = None
+        # Diacak agar worker tidak menyapu bersamaan
+        self._next_sweep = time.time() + random.uniform(0, sweep_interval)
+        self._last_warning = 0.0
+
+    @classmethod
+    def factory(cls, app, config, args, kwargs):
+        kwargs.update(
+            url=config.get('CACHE_DATABASE_URL') or app.config['SQLALCHEMY_DATABASE_URI'],
+            key_prefix=config.get('CACHE_KEY_PREFIX') or '',
+            l1_size=config.get('CACHE_L1_SIZE', 0),
+            l1_ttl=config.get('CACHE_L1_TTL', 0),
+        )
+        return cls(*args, **kwargs)
+
+    def _get_engine(self):
+        if self._engine is None or self._pid != os.getpid():
+            with self._lock:
+                if self._engine is None:
+                    engine = create_engine(self.url, pool_pre_ping=True, **self.engine_options)
+                    with engine.begin() as connection:
+                        create_table(connection)
+                    self._engine = engine
+                elif self._pid != os.getpid():
+                    # Koneksi milik proses induk tidak boleh dipakai setelah fork
+                    self._engine.dispose(close=False)
+                self._pid = os.getpid()
+        return self._engine
+
+    def _run(self, operation, default):
+        """Run operation(connection) in its own transaction; a database error counts as a miss"""
+        try:
+            with self._get_engine().begin() as connection:
+                return operation(connection)
+        except SQLAlchemyError as e:
+            now = time.time()
+            if now - self._last_warning >= WARNING_INTERVAL:
+                self._last_warning = now
+                print(f"⚠️ Cache app_cache tidak tersedia: {e}")
+            return default
+
+    def _expires_at(self, timeout):
+        timeout = self._normalize_timeout(timeout)
+        return None if timeout == 0 else time.time() + timeout
+
+    # --- L1 ---
+
+    def _l1_get(self, key):
+        if self._l1 is None:
+            return _MISSING
+        with self._l1_lock:
+            entry = self._l1.get(key)
+        if entry is None or (entry[0] is not None and entry[0] <= time.time()):
+            return _MISSING
+        return entry[1]
+
+    def _l1_put(self, key, blob, expires_at):
+        if self._l1 is not None:
+            with self._l1_lock:
+                self._l1[key] = (expires_at, bytes(blob))
+
+    def _l1_drop(self, keys):
+        if self._l1 is not None:
+            with self._l1_lock:
+                for key in keys:
+                    self._l1.pop(key, None)
+
+    # --- Penulisan ---
+
+    def _upsert(self, rows, only_if_missing=False):
+        def operation(connection):
+            insert = dialect_insert(connection.dialect.name)(app_cache)
+            statement = insert.on_conflict_do_update(
+                index_elements=[app_cache.c.cache_key],
+                set_={'cache_value': insert.excluded.cache_value, 'expires_at': insert.excluded.expires_at},
+                # add(): hanya menimpa entri yang sudah kedaluwarsa
+                where=~_live(time.time()) if only_if_missing else None)
+            return connection.execute(statement, rows).rowcount
+        written = self._run(operation, None)
+        if written is not None:
+            self._maybe_sweep()
+        return written
+
+    def _maybe_sweep(self):
+        now = time.time()
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.sweep_interval
+        removed = self._run(lambda connection: sweep_expired(connection, self.sweep_batch, now), 0)
+        if removed >= self.sweep_batch:
+            # Masih ada sisa: batch berikutnya pada penulisan berikutnya
+            self._next_sweep = now
+
+    def set(self, key, value, timeout=None):
+        key = self.key_prefix + key
+        self._l1_drop([key])
+        row = {'cache_key': key, 'cache_value': dumps(value), 'expires_at': self._expires_at(timeout)}
+        return self._upsert([row]) is not None
+
+    def add(self, key, value, timeout=None):
+        key = self.key_prefix + key
+        row = {'cache_key': key, 'cache_value': dumps(value), 'expires_at': self._expires_at(timeout)}
+        if not self._upsert([row], only_if_missing=True):
+            return False
+        self._l1_drop([key])
+        return True
+
+    def set_many(self, mapping, timeout=None):
+        expires_at = self._expires_at(timeout)
+        rows = [{'cache_key': self.key_prefix + key, 'cache_value': dumps(value), 'expires_at': expires_at}
+                for key, value in mapping.items()]
+        if not rows:
+            return []
+        self._l1_drop([row['cache_key'] for row in rows])
+        return list(mapping) if self._upsert(rows) is not None else []
+
+    def delete(self, key):
+        return bool(self.delete_many(key))
+
+    def delete_many(self, *keys):
+        if not keys:
+            return []
+        prefixed = {self.key_prefix + key: key for key in keys}
+        self._l1_drop(prefixed)
+        deleted = self._run(lambda connection: connection.execute(
+            delete(app_cache).where(app_cache.c.cache_key.in_(list(prefixed)))
+            .returning(app_cache.c.cache_key)).scalars().all(), [])
+        return [prefixed[key] for key in deleted]
+
+    def clear(self):
+        self._l1_drop(list(self._l1.keys()) if self._l1 is not None else [])
+        statement = delete(app_cache)
+        if self.key_prefix:
+            statement = statement.where(app_cache.c.cache_key.startswith(self.key_prefix, autoescape=True))
+        return self._run(lambda connection: connection.execute(statement) is not None, False)
+
+    # --- Pembacaan ---
+
+    def _decode(self, key, blob):
+        try:
+            return loads(blob)
+        except Exception as e:
+            # Entri dari versi kode lama yang tidak bisa di-unpickle dianggap miss
+            print(f"⚠️ Entri cache {key} tidak dapat dibaca: {e}")
+            return None
+
+    def get_many(self, *keys):
+        prefixed = [self.key_prefix + key for key in keys]
+        found = {}
+        for key in prefixed:
+            blob = self._l1_get(key)
+            if blob is not _MISSING:
+                found[key] = blob
+        missing = [key for key in prefixed if key not in found]
+        if missing:
+            now = time.time()
+            rows = self._run(lambda connection: connection.execute(
+                select(app_cache.c.cache_key, app_cache.c.cache_value, app_cache.c.expires_at)
+                .where(app_cache.c.cache_key.in_(missing), _live(now))).all(), [])
+            for key, blob, expires_at in rows:
+                found[key] = blob
+                self._l1_put(key, blob, expires_at)
+        return [self._decode(key, found[key]) if key in found else None for key in prefixed]
+
+    def get(self, key):
+        return self.get_many(key)[0]
+
+    def has(self, key):
+        key = self.key_prefix + key
+        if self._l1_get(key) is not _MISSING:
+            return True
+        now = time.time()
+        return self._run(lambda connection: connection.execute(
+            select(app_cache.c.cache_key).where(app_cache.c.cache_key == key, _live(now))
+        ).first() is not None, False)
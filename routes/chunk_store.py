@@ -0,0 +1,114 @@
+"""
+Columnar, memory-mapped store for the RAG chunks.
+
+Replaces the pickled dict of LangChain Documents. Each artifact version
+holds three files sharing one prefix:
+
+    {prefix}.text          UTF-8 chunk texts concatenated into one blob
+    {prefix}.rows.npy      one row per chunk, sorted by chunk id:
+                           id, start, end (byte range in the blob),
+                           source (index into the sources table), page
+    {prefix}.sources.json  interned [title, filename] pairs
+
+Opening a store maps both binary files read-only, so it takes milliseconds,
+costs no unpickling and every worker shares the pages through the OS cache.
+Fetching a chunk is a binary search on the id column plus one slice decode.
+"""
+
+import os
+import mmap
+import json
+import numpy as np
+
+ROW_DTYPE = np.dtype([
+    ('id', '<i8'),
+    ('start', '<i8'),
+    ('end', '<i8'),
+    ('source', '<i4'),
+    ('page', '<i4'),
+])
+
+def _atomic_write(path, write):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+class ChunkStore:
+    """Read-only view over a chunk store written by ChunkStore.write"""
+
+    def __init__(self, rows, text, sources):
+        self.rows = rows
+        self.ids = rows['id']
+        self._text = text
+        self.sources = sources
+
+    @staticmethod
+    def write(path_prefix, doc_chunks):
+        """Serialize a {chunk_id: Document} mapping"""
+        source_index, sources = {}, []
+        rows = np.zeros(len(doc_chunks), dtype=ROW_DTYPE)
+        offset = 0
+
+        def write_text(f):
+            nonlocal offset
+            for row, chunk_id in enumerate(sorted(doc_chunks)):
+                chunk = doc_chunks[chunk_id]
+                source = (chunk.metadata['title'], chunk.metadata['filename'])
+                if source not in source_index:
+                    source_index[source] = len(sources)
+                    sources.append(list(source))
+                data = chunk.page_content.encode('utf-8')
+                f.write(data)
+                rows[row] = (chunk_id, offset, offset + len(data),
+                             source_index[source], chunk.metadata.get('page', 0))
+                offset += len(data)
+
+        _atomic_write(f"{path_prefix}.text", write_text)
+        _atomic_write(f"{path_prefix}.rows.npy", lambda f: np.save(f, rows))
+        _atomic_write(f"{path_prefix}.sources.json",
+                      lambda f: f.write(json.dumps(sources, ensure_ascii=False).encode('utf-8')))
+
+    @classmethod
+    def open(cls, path_prefix):
+        rows = np.load(f"{path_prefix}.rows.npy", mmap_mode='r')
+        with open(f"{path_prefix}.text", 'rb') as f:
+            # mmap menolak file kosong (indeks tanpa chunk)
+            text = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b''
+        with open(f"{path_prefix}.sources.json", 'r', encoding='utf-8') as f:
+            sources = [tuple(source) for source in json.load(f)]
+        return cls(rows, text, sources)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _row(self, chunk_id):
+        row = int(np.searchsorted(self.ids, chunk_id))
+        if row == len(self.ids) or self.ids[row] != chunk_id:
+            raise KeyError(chunk_id)
+        return row
+
+    def __contains__(self, chunk_id):
+        try:
+            self._row(chunk_id)
+        except KeyError:
+            return False
+        return True
+
+    def text(self, chunk_id):
+        row = self.rows[self._row(chunk_id)]
+        return self._text[int(row['start']):int(row['end'])].decode('utf-8')
+
+    def source(self, chunk_id):
+        """(title, filename) of the paper the chunk came from"""
+        return self.sources[int(self.rows[self._row(chunk_id)]['source'])]
+
+    def page(self, chunk_id):
+        return int(self.rows[self._row(chunk_id)]['page'])
+
+    def items(self):
+        """Yield (chunk_id, text, title, filename, page) in chunk id order"""
+        for row in self.rows:
+            title, filename = self.sources[int(row['source'])]
+            yield (int(row['id']), self._text[int(row['start']):int(row['end'])].decode('utf-8'),
+                   title, filename, int(row['page']))
@@ -0,0 +1,229 @@
+"""
+Batched, concurrent embedding client with pluggable backends.
+
+Several batches are kept in flight under a request/token budget. HTTP 429
+responses shrink the budget and back off exponentially; failed batches are
+retried, never dropped, so the returned matrix row i always belongs to
+input text i. A deterministic local backend allows tests and benchmarks to
+run without network access.
+"""
+
+import re
+import time
+import random
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+class EmbeddingError(Exception):
+    """Raised when a batch still fails after all retries"""
+
+class RateLimitError(EmbeddingError):
+    """Raised by a backend when the provider answers HTTP 429 / quota exceeded"""
+
+def estimate_tokens(text):
+    """Rough token estimate (~4 characters per token), used only for budgeting"""
+    return max(1, len(text) // 4)
+
+# --- Backends ---
+
+class EmbeddingBackend:
+    """Interface for embedding providers.
+
+    ``model`` identifies the vector space and is part of the embedding cache
+    key, so vectors from different backends never mix.
+    """
+    model = None
+    dimension = None
+
+    def embed(self, texts, task_type):
+        """Return a float32 array of shape (len(texts), dimension)"""
+        raise NotImplementedError
+
+class GeminiBackend(EmbeddingBackend):
+    """Google Generative AI embeddings (models/embedding-001 by default)"""
+
+    def __init__(self, model="models/embedding-001"):
+        self.model = model
+
+    def embed(self, texts, task_type):
+        import google.generativeai as genai
+        try:
+            result = genai.embed_content(model=self.model, content=list(texts), task_type=task_type)
+        except Exception as e:
+            message = str(e)
+            if type(e).__name__ in ('ResourceExhausted', 'TooManyRequests') or '429' in message or 'quota' in message.lower():
+                raise RateLimitError(message) from e
+            raise
+        vectors = np.asarray(result['embedding'], dtype='float32')
+        if vectors.ndim != 2 or vectors.shape[0] != len(texts):
+            raise EmbeddingError(f"Expected {len(texts)} embeddings, got shape {vectors.shape}")
+        return vectors
+
+class LocalHashBackend(EmbeddingBackend):
+    """Deterministic, network-free stand-in based on hashed word features.
+
+    Texts sharing words get nearby vectors, which is enough for tests and
+    benchmarks; it is not a semantic model.
+    """
+
+    def __init__(self, dimension=768):
+        self.dimension = dimension
+        self.model = f"local-hash-{dimension}"
+
+    def embed(self, texts, task_type):
+        vectors = np.zeros((len(texts), self.dimension), dtype='float32')
+        for row, text in enumerate(texts):
+            for word in re.findall(r'\w+', text.lower()):
+                digest = hashlib.blake2b(word.encode('utf-8'), digest_size=8).digest()
+                bucket = int.from_bytes(digest[:4], 'little') % self.dimension
+                vectors[row, bucket] += 1.0 if digest[4] & 1 else -1.0
+            norm = np.linalg.norm(vectors[row])
+            if norm > 0:
+                vectors[row] /= norm
+        return vectors
+
+def create_backend(name):
+    """Build a backend from its config name ('gemini' or 'local')"""
+    if name == 'local':
+        return LocalHashBackend()
+    if name == 'gemini':
+        return GeminiBackend()
+    raise ValueError(f"Unknown embedding backend: {name}")
+
+# --- Rate limiting ---
+
+class AdaptiveRateLimiter:
+    """Token bucket over requests/minute and tokens/minute.
+
+    A rate-limited response halves the effective rate; every success
+    recovers it additively (AIMD), so the client settles just under the
+    provider's real quota.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.scale = 1.0
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._last
+        self._last = now
+        self._requests = min(self.requests_per_minute,
+                             self._requests + elapsed * self.requests_per_minute * self.scale / 60.0)
+        self._tokens = min(self.tokens_per_minute,
+                           self._tokens + elapsed * self.tokens_per_minute * self.scale / 60.0)
+
+    def acquire(self, tokens):
+        """Block until one request carrying ``tokens`` tokens fits the budget"""
+        # Batch yang lebih besar dari kapasitas bucket tetap harus bisa lewat
+        tokens = min(tokens, self.tokens_per_minute)
+        while True:
+            with self._lock:
+                self._refill()
+                if self._requests >= 1 and self._tokens >= tokens:
+                    self._requests -= 1
+                    self._tokens -= tokens
+                    return
+                req_wait = (1 - self._requests) * 60.0 / (self.requests_per_minute * self.scale)
+                tok_wait = (tokens - self._tokens) * 60.0 / (self.tokens_per_minute * self.scale)
+                wait = max(req_wait, tok_wait, 0.01)
+            time.sleep(min(wait, 5.0))
+
+    def on_rate_limited(self):
+        with self._lock:
+            self.scale = max(0.05, self.scale * 0.5)
+            self._requests = 0.0
+
+    def on_success(self):
+        with self._lock:
+            self.scale = min(1.0, self.scale + 0.02)
+
+# --- Client ---
+
+class EmbeddingClient:
+    """Embed many texts with bounded concurrency, rate limiting and retries"""
+
+    def __init__(self, backend, batch_size=10, max_in_flight=4, requests_per_minute=600,
+                 tokens_per_minute=1_000_000, max_retries=5, backoff_base=1.0, backoff_max=60.0):
+        self.backend = backend
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.limiter = AdaptiveRateLimiter(requests_per_minute, tokens_per_minute)
+        self._pool = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='embed')
+        self._stats_lock = threading.Lock()
+        self.stats = {'requests': 0, 'rate_limited': 0, 'retries': 0}
+
+    @property
+    def model(self):
+        return self.backend.model
+
+    def _count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def _sleep_backoff(self, attempt):
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        time.sleep(delay * random.uniform(0.5, 1.0))
+
+    def _embed_batch(self, texts, task_type, max_retries):
+        tokens = sum(estimate_tokens(text) for text in texts)
+        attempt = 0
+        while True:
+            self.limiter.acquire(tokens)
+            self._count('requests')
+            try:
+                vectors = self.backend.embed(texts, task_type)
+                if vectors.shape[0] != len(texts):
+                    raise EmbeddingError(f"Expected {len(texts)} embeddings, got {vectors.shape[0]}")
+                self.limiter.on_success()
+                return vectors
+            except Exception as e:
+                if isinstance(e, RateLimitError):
+                    self._count('rate_limited')
+                    self.limiter.on_rate_limited()
+                if attempt >= max_retries:
+                    raise EmbeddingError(f"Embedding batch failed after {attempt + 1} attempts: {e}") from e
+                self._count('retries')
+                self._sleep_backoff(attempt)
+                attempt += 1
+
+    def embed(self, texts, task_type, on_batch=None, max_retries=None):
+        """Embed texts; row i of the result always belongs to texts[i].
+
+        ``on_batch(start, vectors)`` is called as each batch completes so
+        callers can persist progress. Raises EmbeddingError if any batch
+        still fails after retrying.
+        """
+        texts = list(texts)
+        if not texts:
+            return np.zeros((0, self.backend.dimension or 0), dtype='float32')
+        retries = self.max_retries if max_retries is None else max_retries
+
+        def run(start):
+            vectors = self._embed_batch(texts[start:start + self.batch_size], task_type, retries)
+            if on_batch is not None:
+                on_batch(start, vectors)
+            return vectors
+
+        starts = range(0, len(texts), self.batch_size)
+        if len(starts) == 1:
+            return run(0)
+        futures = [self._pool.submit(run, start) for start in starts]
+        results, error = [], None
+        for future in futures:
+            try:
+                results.append(future.result())
+            except EmbeddingError as e:
+                error = error or e
+        if error is not None:
+            raise error
+        return np.vstack(results)
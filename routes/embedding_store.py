@@ -0,0 +1,139 @@
+"""
+Persistent, content-addressed embedding cache.
+
+Vectors are stored in SQLite keyed by sha256(model, task_type, text), so the
+same chunk text is embedded once no matter which batch, paper or build it
+shows up in, and the cache survives restarts and rebuilds. Only document
+embeddings belong here: user questions would grow the file without bound, so
+their vectors go to the bounded in-memory QueryEmbeddingCache instead.
+"""
+
+import os
+import sqlite3
+import hashlib
+import threading
+import numpy as np
+from cachetools import TTLCache
+
+# Batas variabel SQLite per query (default lama 999)
+_SQLITE_MAX_VARS = 900
+
+class EmbeddingStore:
+    """Thread-safe SQLite store of float32 embedding vectors with hit/miss counters"""
+
+    def __init__(self, path):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+
+    @staticmethod
+    def make_key(model, task_type, text):
+        """Content address of one embedding"""
+        return hashlib.sha256(f"{model}\x00{task_type}\x00{text}".encode('utf-8')).digest()
+
+    def _connection(self):
+        # Koneksi SQLite tidak boleh dipakai bersama setelah fork (gunicorn, process pool)
+        if self._conn is None or self._pid != os.getpid():
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    key BLOB PRIMARY KEY,
+                    dim INTEGER NOT NULL,
+                    vector BLOB NOT NULL
+                ) WITHOUT ROWID
+            """)
+            conn.commit()
+            self._conn = conn
+            self._pid = os.getpid()
+        return self._conn
+
+    def get_many(self, keys):
+        """Return {key: vector} for the keys present in the store"""
+        found = {}
+        unique_keys = list(dict.fromkeys(keys))
+        with self._lock:
+            conn = self._connection()
+            for i in range(0, len(unique_keys), _SQLITE_MAX_VARS):
+                batch = unique_keys[i:i + _SQLITE_MAX_VARS]
+                placeholders = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype='float32')
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def put_many(self, items):
+        """Store (key, vector) pairs; existing keys are left untouched"""
+        rows = [(key, int(vector.shape[0]), np.asarray(vector, dtype='float32').tobytes())
+                for key, vector in items]
+        if not rows:
+            return
+        with self._lock:
+            conn = self._connection()
+            conn.executemany("INSERT OR IGNORE INTO embeddings (key, dim, vector) VALUES (?, ?, ?)", rows)
+            conn.commit()
+
+    def count(self):
+        with self._lock:
+            return self._connection().execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def stats(self):
+        """Hit/miss counters for this process"""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+class QueryEmbeddingCache:
+    """Per-process LRU/TTL cache of query vectors with the same interface as EmbeddingStore"""
+
+    def __init__(self, maxsize, ttl):
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    def get_many(self, keys):
+        """Return {key: vector} for the keys still cached"""
+        found = {}
+        with self._lock:
+            for key in keys:
+                vector = self._cache.get(key)
+                if vector is not None:
+                    found[key] = vector
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def put_many(self, items):
+        """Cache (key, vector) pairs, evicting the least recently used beyond maxsize"""
+        with self._lock:
+            for key, vector in items:
+                self._cache[key] = np.asarray(vector, dtype='float32')
+
+    def count(self):
+        with self._lock:
+            return len(self._cache)
+
+    def stats(self):
+        """Hit/miss counters and size for this process"""
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'size': self.count(),
+        }
@@ -0,0 +1,94 @@
+"""
+Streaming export of complaints as CSV or NDJSON.
+
+Rows are read from a server-side cursor (psycopg2 named cursor via
+yield_per) in batches of EXPORT_BATCH_ROWS and encoded batch by batch, so a
+worker holds one batch at a time whatever the size of the export. The first
+bytes leave as soon as the first batch is fetched. With gzip, the output is
+compressed incrementally and flushed after every batch.
+"""
+
+import io
+import csv
+import json
+import zlib
+from datetime import datetime, timedelta
+from sqlalchemy import select
+
+from .models import db, Pengaduan
+
+EXPORT_BATCH_ROWS = 1000
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+FILTER_COLUMNS = ('region', 'status', 'category')
+
+def export_query(filters, date_from=None, date_to=None):
+    """Select all Pengaduan columns matching filters, oldest first.
+
+    filters maps column names from FILTER_COLUMNS to values; date_from and
+    date_to are inclusive dates on created_at.
+    """
+    table = Pengaduan.__table__
+    query = select(table)
+    for name, value in filters.items():
+        query = query.where(table.c[name] == value)
+    if date_from is not None:
+        query = query.where(table.c.created_at >= date_from)
+    if date_to is not None:
+        query = query.where(table.c.created_at < date_to + timedelta(days=1))
+    return query.order_by(table.c.created_at, table.c.id)
+
+def parse_date(value):
+    """YYYY-MM-DD to datetime, None when empty; raises ValueError otherwise"""
+    return datetime.strptime(value, '%Y-%m-%d') if value else None
+
+def _csv_value(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+def _encode_csv(columns):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def encode(rows):
+        for row in rows:
+            writer.writerow([_csv_value(value) for value in row])
+        data = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return data
+
+    writer.writerow(columns)
+    return encode, encode([])
+
+def _encode_ndjson(columns):
+    def encode(rows):
+        return "".join(json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=_csv_value) + "\n"
+                       for row in rows)
+    return encode, ""
+
+def stream_export(query, fmt, compress=False, on_rows=None):
+    """Yield the export of query as bytes; on_rows(n) is called per batch"""
+    columns = list(query.selected_columns.keys())
+    encode, header = (_encode_csv if fmt == 'csv' else _encode_ndjson)(columns)
+    # wbits=31: header dan trailer gzip, bukan zlib mentah
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None
+
+    def output(text, flush=False):
+        data = text.encode('utf-8')
+        if compressor is None:
+            return data
+        data = compressor.compress(data)
+        return data + compressor.flush(zlib.Z_SYNC_FLUSH) if flush else data
+
+    # Koneksi sendiri, bukan sesi request: cursor tetap terbuka selama respons dikirim
+    with db.engine.connect() as connection:
+        result = connection.execution_options(yield_per=EXPORT_BATCH_ROWS).execute(query)
+        yield output(header, flush=True)
+        for rows in result.partitions():
+            if on_rows is not None:
+                on_rows(len(rows))
+            yield output(encode(rows), flush=True)
+    if compressor is not None:
+        yield compressor.flush()
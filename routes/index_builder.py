@@ -0,0 +1,308 @@
+"""
+Offline index builder for the RAG system.
+
+Runs outside the web process (see build_index.py). PDFs are extracted and
+chunked in a process pool, embeddings go through the persistent embedding
+store so an interrupted build resumes where it stopped, and every successful
+build is published as a new versioned artifact under cache/index/.
+"""
+
+import os
+import json
+import time
+import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import faiss
+import numpy as np
+from langchain.text_splitter import CharacterTextSplitter
+from langchain.schema import Document
+
+from .rag_core import (
+    DOWNLOAD_FOLDER, INDEX_ROOT, CURRENT_POINTER, ARTIFACT_FORMAT,
+    FAISS_INDEX_FILE, CHUNK_STORE_PREFIX, MANIFEST_FILE, META_FILE, LEXICAL_INDEX_PREFIX,
+    get_cache_path, file_sha256, extract_text_from_pdf, get_doc_embeddings,
+    get_embedding_cache_stats, save_faiss_index, current_index_dir, embedding_client,
+    LEGACY_EMBEDDING_MODEL,
+)
+from .embedding_client import EmbeddingError
+from .ann_index import build_ann_index, supports_remove
+from .lexical_index import LexicalIndex
+from .chunk_store import ChunkStore
+from .config import RAG_INDEX_TYPE
+
+MANIFEST_VERSION = 1
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 100
+
+def _empty_manifest():
+    return {'version': MANIFEST_VERSION, 'embedding_model': embedding_client.model,
+            'next_chunk_id': 0, 'files': {}}
+
+def load_manifest(version_dir):
+    """Load the corpus manifest: per-PDF hash, size, mtime and chunk IDs.
+
+    Returns None if the manifest is missing or from another version.
+    """
+    path = os.path.join(version_dir, MANIFEST_FILE)
+    if os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get('version') == MANIFEST_VERSION:
+                return manifest
+        except Exception as e:
+            print(f"Failed to load manifest: {e}")
+    return None
+
+def scan_corpus(manifest):
+    """Compare DOWNLOAD_FOLDER against the manifest.
+
+    Returns (changed, removed, touched): changed is a list of (path, stat,
+    sha256) for new or modified PDFs, removed is a list of filenames no longer
+    on disk and touched is True if only mtimes in the manifest were refreshed.
+    Files whose size and mtime match the manifest are not re-hashed.
+    """
+    known = manifest['files']
+    changed, seen, touched = [], set(), False
+    if not os.path.isdir(DOWNLOAD_FOLDER):
+        # Folder jurnal tidak tersedia (mis. belum di-mount): pertahankan indeks yang ada
+        print(f"⚠️ Folder {DOWNLOAD_FOLDER} tidak ditemukan.")
+        return changed, [], touched
+    for filename in sorted(os.listdir(DOWNLOAD_FOLDER)):
+        if not filename.lower().endswith('.pdf'):
+            continue
+        seen.add(filename)
+        path = os.path.join(DOWNLOAD_FOLDER, filename)
+        stat = os.stat(path)
+        entry = known.get(filename)
+        if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+            continue
+        file_hash = file_sha256(path)
+        if entry and entry['sha256'] == file_hash:
+            # Hanya timestamp yang berubah, isi file sama
+            entry['mtime'] = stat.st_mtime
+            touched = True
+            continue
+        changed.append((path, stat, file_hash))
+    removed = [filename for filename in known if filename not in seen]
+    return changed, removed, touched
+
+def _artifact_format(version_dir):
+    try:
+        with open(os.path.join(version_dir, META_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f).get('format')
+    except (OSError, ValueError):
+        return None
+
+def _load_chunks(version_dir):
+    """Read a published chunk store back into {chunk_id: Document}"""
+    store = ChunkStore.open(os.path.join(version_dir, CHUNK_STORE_PREFIX))
+    return {chunk_id: Document(page_content=text, metadata={"title": title, "filename": filename, "page": page})
+            for chunk_id, text, title, filename, page in store.items()}
+
+def _load_previous_version():
+    """Load the published manifest, index and chunks fully into memory for update"""
+    version_dir = current_index_dir()
+    manifest = load_manifest(version_dir) if version_dir else None
+    if manifest is not None and _artifact_format(version_dir) != ARTIFACT_FORMAT:
+        # Format artefak lama: ekstraksi ulang dari cache PDF, embedding dari cache
+        print("Format indeks lama, membangun ulang indeks.")
+        manifest = None
+    elif manifest is not None and manifest.get('embedding_model', LEGACY_EMBEDDING_MODEL) != embedding_client.model:
+        # Ruang vektor berbeda, semua chunk harus di-embed ulang
+        print(f"Backend embedding berubah ke {embedding_client.model}, membangun ulang indeks.")
+        manifest = None
+    elif manifest is not None:
+        manifest['embedding_model'] = embedding_client.model
+    if manifest is not None:
+        try:
+            faiss_index = faiss.read_index(os.path.join(version_dir, FAISS_INDEX_FILE))
+            doc_chunks = _load_chunks(version_dir)
+            return manifest, faiss_index, doc_chunks
+        except Exception as e:
+            print(f"Failed to load index {version_dir}: {e}")
+    return _empty_manifest(), None, {}
+
+def _drop_file(manifest, faiss_index, doc_chunks, filename):
+    """Remove every chunk of one PDF from the index, chunk map and extraction cache"""
+    entry = manifest['files'].pop(filename)
+    chunk_ids = entry['chunk_ids']
+    if chunk_ids and faiss_index is not None:
+        faiss_index.remove_ids(np.array(chunk_ids, dtype='int64'))
+    for chunk_id in chunk_ids:
+        doc_chunks.pop(chunk_id, None)
+    stale_cache = get_cache_path(filename, entry['sha256'])
+    if os.path.exists(stale_cache):
+        os.remove(stale_cache)
+
+def extract_and_chunk(path, file_hash):
+    """Extract and split one PDF; runs inside a worker process"""
+    docs = extract_text_from_pdf(path, file_hash)
+    if not docs:
+        return []
+    text_splitter = CharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    return text_splitter.split_documents(docs)
+
+def _embed_chunks(file_chunks):
+    """Embed all chunks of one PDF.
+
+    Every completed batch lands in the persistent embedding store, so an
+    interrupted build resumes without paying the API again. Returns a float32
+    array aligned with file_chunks, or None if a batch failed after retries.
+    """
+    try:
+        return get_doc_embeddings([chunk.page_content for chunk in file_chunks])
+    except EmbeddingError as e:
+        print(f"⚠️ {e}")
+        return None
+
+def _write_json(path, data):
+    """Write JSON atomically"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+def _publish(manifest, faiss_index, doc_chunks, keep_versions):
+    """Write a new artifact version and atomically point CURRENT at it"""
+    version = base_version = f"v{time.strftime('%Y%m%d-%H%M%S')}"
+    suffix = 0
+    while os.path.exists(os.path.join(INDEX_ROOT, version)):
+        suffix += 1
+        version = f"{base_version}-{suffix}"
+    version_dir = os.path.join(INDEX_ROOT, version)
+    tmp_dir = f"{version_dir}.tmp"
+    # Sisa build yang terhenti di tengah penulisan
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    save_faiss_index(faiss_index, os.path.join(tmp_dir, FAISS_INDEX_FILE))
+    ChunkStore.write(os.path.join(tmp_dir, CHUNK_STORE_PREFIX), doc_chunks)
+    # BM25 dibangun ulang penuh: murah dibanding embedding dan tanpa panggilan API
+    chunk_ids = sorted(doc_chunks)
+    LexicalIndex.build(chunk_ids, [doc_chunks[i].page_content for i in chunk_ids]).save(
+        os.path.join(tmp_dir, LEXICAL_INDEX_PREFIX))
+    _write_json(os.path.join(tmp_dir, MANIFEST_FILE), manifest)
+    _write_json(os.path.join(tmp_dir, META_FILE), {
+        'format': ARTIFACT_FORMAT,
+        'version': version,
+        'built_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'num_files': len(manifest['files']),
+        'num_chunks': int(faiss_index.ntotal),
+        'dimension': int(faiss_index.d),
+        'embedding_model': manifest['embedding_model'],
+        'index_type': manifest['index_type'],
+    })
+    os.replace(tmp_dir, version_dir)
+
+    tmp_pointer = f"{CURRENT_POINTER}.tmp"
+    with open(tmp_pointer, 'w', encoding='utf-8') as f:
+        f.write(version)
+    os.replace(tmp_pointer, CURRENT_POINTER)
+
+    _prune_versions(keep_versions)
+    return version
+
+def _prune_versions(keep_versions):
+    """Delete all but the newest keep_versions artifact versions"""
+    versions = sorted(d for d in os.listdir(INDEX_ROOT)
+                      if d.startswith('v') and not d.endswith('.tmp')
+                      and os.path.isdir(os.path.join(INDEX_ROOT, d)))
+    for old in versions[:-keep_versions]:
+        # Worker yang masih me-mmap versi lama tetap aman di POSIX; di Windows bisa gagal
+        shutil.rmtree(os.path.join(INDEX_ROOT, old), ignore_errors=True)
+
+def build_index(workers=None, keep_versions=3, full=False, index_type=None):
+    """Bring the index in line with DOWNLOAD_FOLDER and publish a new version.
+
+    Only PDFs that were added, changed or removed since the published
+    version are processed; vectors of changed or removed PDFs are deleted
+    by chunk ID. The whole index is rebuilt from cached embeddings (no API
+    calls) when it is new, when index_type changes, or when the index type
+    cannot delete vectors. Returns the published version name, or None if
+    nothing changed or the build failed.
+    """
+    os.makedirs(INDEX_ROOT, exist_ok=True)
+    index_type = index_type or RAG_INDEX_TYPE
+
+    if full:
+        manifest, faiss_index, doc_chunks = _empty_manifest(), None, {}
+    else:
+        manifest, faiss_index, doc_chunks = _load_previous_version()
+    changed, removed, touched = scan_corpus(manifest)
+    type_changed = manifest.get('index_type', 'flat') != index_type
+    manifest['index_type'] = index_type
+    if not changed and not removed and not type_changed and faiss_index is not None:
+        if touched:
+            # Hanya mtime yang berubah: perbarui manifest versi aktif di tempat
+            _write_json(os.path.join(current_index_dir(), MANIFEST_FILE), manifest)
+        print("✅ Indeks sudah mutakhir, tidak ada perubahan.")
+        return None
+
+    replaces = removed or any(os.path.basename(path) in manifest['files'] for path, _, _ in changed)
+    rebuild = faiss_index is None or type_changed or (replaces and not supports_remove(index_type))
+    if rebuild:
+        # Indeks lama dibuang, dibangun ulang dari embedding di cache setelah semua PDF diproses
+        faiss_index = None
+
+    print(f"Memperbarui indeks ({index_type}): {len(changed)} PDF baru/berubah, {len(removed)} PDF dihapus")
+    for filename in removed:
+        _drop_file(manifest, faiss_index, doc_chunks, filename)
+
+    failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(extract_and_chunk, path, file_hash): (path, stat, file_hash)
+                   for path, stat, file_hash in changed}
+        for future in as_completed(futures):
+            path, stat, file_hash = futures[future]
+            filename = os.path.basename(path)
+            try:
+                file_chunks = future.result()
+            except Exception as e:
+                print(f"⚠️ Gagal memproses {filename}: {e}")
+                failed += 1
+                continue
+
+            vectors = _embed_chunks(file_chunks) if file_chunks else None
+            if file_chunks and vectors is None:
+                # Jangan catat di manifest agar PDF ini dicoba lagi pada build berikutnya
+                print(f"⚠️ Embedding gagal untuk {filename}, akan dicoba lagi nanti.")
+                failed += 1
+                continue
+
+            if filename in manifest['files']:
+                _drop_file(manifest, faiss_index, doc_chunks, filename)
+
+            start_id = manifest['next_chunk_id']
+            chunk_ids = list(range(start_id, start_id + len(file_chunks)))
+            manifest['next_chunk_id'] = start_id + len(file_chunks)
+            if file_chunks:
+                if faiss_index is not None:
+                    faiss_index.add_with_ids(vectors, np.array(chunk_ids, dtype='int64'))
+                doc_chunks.update(zip(chunk_ids, file_chunks))
+                print(f"  -> Berhasil memproses: {file_chunks[0].metadata['title']}")
+
+            manifest['files'][filename] = {
+                'sha256': file_hash,
+                'size': stat.st_size,
+                'mtime': stat.st_mtime,
+                'chunk_ids': chunk_ids,
+            }
+
+    if rebuild and doc_chunks:
+        chunk_ids = sorted(doc_chunks)
+        vectors = _embed_chunks([doc_chunks[chunk_id] for chunk_id in chunk_ids])
+        if vectors is not None:
+            faiss_index = build_ann_index(index_type, vectors, chunk_ids)
+
+    if faiss_index is None:
+        print("❌ Gagal membuat embedding.")
+        return None
+
+    version = _publish(manifest, faiss_index, doc_chunks, keep_versions)
+    stats = get_embedding_cache_stats()
+    print(f"Cache embedding: {stats['hits']} hit, {stats['misses']} miss")
+    print(f"✅ Indeks {version} dipublikasikan: {faiss_index.ntotal} chunk dari {len(manifest['files'])} PDF"
+          + (f", {failed} PDF gagal" if failed else ""))
+    return version
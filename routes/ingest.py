@@ -0,0 +1,130 @@
+"""
+Batch ingestion of complaints collected offline.
+
+A batch is NDJSON, either as the request body or as the 'items' field of a
+multipart request whose other parts are attachments; an item names its
+attachment part in 'attachment'. Every item carries an idempotency_key
+chosen by the client. All items are validated first, keys already synced by
+the same user are answered from ingest_key, and the new complaints go in
+with one multi-row INSERT ... RETURNING plus one INSERT for their keys, in
+the caller's transaction. The result lists one entry per item, in order.
+"""
+
+import json
+from collections import Counter
+from datetime import datetime
+from sqlalchemy import insert, select
+
+from .models import db, Pengaduan, IngestKey
+from .stats import apply_deltas
+
+TEXT_FIELDS = ('name', 'email', 'phone', 'address', 'region', 'category', 'problem_description',
+               'severity', 'actions_taken', 'follow_up_request')
+MAX_KEY_LENGTH = IngestKey.__table__.c.key.type.length
+TRUE_VALUES = (True, 1, 'on', 'true', '1')
+
+class BatchError(ValueError):
+    pass
+
+def parse_batch(text, max_items):
+    """Parse NDJSON into a list of items; raises BatchError for a malformed batch"""
+    items = []
+    for number, line in enumerate(text.splitlines(), 1):
+        if not line.strip():
+            continue
+        try:
+            items.append(json.loads(line))
+        except ValueError as e:
+            raise BatchError(f"Baris {number} bukan JSON yang valid.") from e
+        if len(items) > max_items:
+            raise BatchError(f"Maksimal {max_items} pengaduan per batch.")
+    if not items:
+        raise BatchError("Batch kosong.")
+    return items
+
+def validate_item(item):
+    """Return (column values, idempotency key, errors) for one item"""
+    if not isinstance(item, dict):
+        return None, None, ['Item harus berupa objek JSON.']
+    values, errors = {}, []
+    for name in TEXT_FIELDS:
+        value = item.get(name)
+        if not isinstance(value, str) or not value.strip():
+            errors.append(f"{name} wajib diisi.")
+            continue
+        length = Pengaduan.__table__.c[name].type.length
+        if length and len(value) > length:
+            errors.append(f"{name} maksimal {length} karakter.")
+        values[name] = value
+    try:
+        values['incident_date'] = datetime.strptime(str(item.get('incident_date')), '%Y-%m-%d').date()
+    except ValueError:
+        errors.append("incident_date harus berformat YYYY-MM-DD.")
+    values['data_consent'] = item.get('data_consent') in TRUE_VALUES
+    values['data_accuracy'] = item.get('data_accuracy') in TRUE_VALUES
+
+    key = item.get('idempotency_key')
+    if not isinstance(key, str) or not 0 < len(key) <= MAX_KEY_LENGTH:
+        errors.append(f"idempotency_key wajib diisi, maksimal {MAX_KEY_LENGTH} karakter.")
+        key = None
+    return values, key, errors
+
+def ingest(user_id, items, attachments, store_attachment):
+    """Validate and insert a batch for user_id in the current transaction.
+
+    attachments maps part names to uploaded files; store_attachment(file)
+    saves one and returns its filename, raising ValueError to reject it.
+    Returns (results, regions) where regions are those that got new rows.
+    A concurrent sync of the same key makes the key INSERT raise
+    IntegrityError; the caller rolls back and the client retries.
+    """
+    results, accepted, seen = [], [], set()
+    for index, item in enumerate(items):
+        values, key, errors = validate_item(item)
+        if key is not None and key in seen:
+            errors.append("idempotency_key ganda dalam batch.")
+        elif key is not None:
+            seen.add(key)
+        attachment = item.get('attachment') if isinstance(item, dict) else None
+        if attachment and attachment not in attachments:
+            errors.append(f"Lampiran '{attachment}' tidak ditemukan.")
+        result = {'index': index, 'idempotency_key': key}
+        results.append(result)
+        if errors:
+            result.update(status='invalid', errors=errors)
+        else:
+            accepted.append((result, values, key, attachment))
+
+    # Satu query untuk semua kunci yang mungkin sudah pernah disinkronkan
+    synced = dict(db.session.execute(
+        select(IngestKey.key, IngestKey.pengaduan_id)
+        .where(IngestKey.user_id == user_id, IngestKey.key.in_([key for _, _, key, _ in accepted]))
+    ).all()) if accepted else {}
+
+    rows, new = [], []
+    for result, values, key, attachment in accepted:
+        if key in synced:
+            result.update(status='duplicate', id=synced[key])
+            continue
+        if attachment:
+            try:
+                values['file_upload'] = store_attachment(attachments[attachment])
+            except ValueError as e:
+                result.update(status='invalid', errors=[str(e)])
+                continue
+        rows.append(dict(values, user_id=user_id))
+        new.append((result, key))
+    if not rows:
+        return results, set()
+
+    ids = db.session.execute(
+        insert(Pengaduan).returning(Pengaduan.id, sort_by_parameter_order=True), rows).scalars().all()
+    db.session.execute(insert(IngestKey), [{'user_id': user_id, 'key': key, 'pengaduan_id': complaint_id}
+                                           for (_, key), complaint_id in zip(new, ids)])
+    for (result, _), complaint_id in zip(new, ids):
+        result.update(status='created', id=complaint_id)
+
+    # Bulk insert melewati listener sesi: delta statistik diterapkan sendiri
+    apply_deltas(db.session.connection(),
+                 Counter((row['region'], 'pending', row['category']) for row in rows))
+    return results, {row['region'] for row in rows}
@@ -0,0 +1,147 @@
+"""
+BM25 inverted index over the RAG chunks.
+
+Built next to the FAISS index by build_index.py and persisted in the same
+artifact version. Tokenization is tuned for Indonesian agronomy text:
+stopwords are dropped and common particles, possessives and affixes are
+stripped, while tokens containing digits (dosages, product codes) are kept
+verbatim. Search needs no network and runs in well under a millisecond.
+"""
+
+import re
+import json
+from functools import lru_cache
+import numpy as np
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+RRF_K = 60
+
+STOPWORDS = frozenset("""
+ada adalah agar akan aku anda antara apa apabila atas atau bagaimana bagi bahwa banyak beberapa
+belum berapa bisa boleh dalam dan dapat dari daripada demikian dengan di dia ialah ini itu jadi
+jika juga kalau kami kamu karena ke kepada ketika kita lagi lain maka mana masih mereka namun
+oleh pada para saat saja sama sampai sangat saya se sebagai sebelum secara sedang sehingga
+sejak seperti serta setelah sudah supaya tak tanpa tapi telah tentang terhadap tetapi tidak untuk
+yaitu yakni yang cara bagaimanakah apakah mengapa kenapa kapan dimana
+""".split())
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:-[a-z0-9]+)*")
+_PARTICLES = ('lah', 'kah', 'tah', 'pun')
+_POSSESSIVES = ('nya', 'ku', 'mu')
+_SUFFIXES = ('kan', 'an')
+_PREFIXES = ('meng', 'mem', 'men', 'me', 'ber', 'ter', 'di')
+_MIN_STEM = 4
+
+def _strip_suffix(word, suffixes):
+    for suffix in suffixes:
+        if word.endswith(suffix) and len(word) - len(suffix) >= _MIN_STEM:
+            return word[:-len(suffix)]
+    return word
+
+@lru_cache(maxsize=200_000)
+def stem(word):
+    """Light Indonesian stemmer: one particle, possessive, suffix and prefix at most"""
+    if any(ch.isdigit() for ch in word):
+        return word
+    word = _strip_suffix(word, _PARTICLES)
+    word = _strip_suffix(word, _POSSESSIVES)
+    word = _strip_suffix(word, _SUFFIXES)
+    for prefix in _PREFIXES:
+        if word.startswith(prefix) and len(word) - len(prefix) >= _MIN_STEM:
+            return word[len(prefix):]
+    return word
+
+def tokenize(text):
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower()):
+        parts = token.split('-')
+        # Kata ulang (hama-hama, sayur-sayuran) dihitung sebagai kata dasarnya
+        if len(parts) == 2 and parts[1].startswith(parts[0]):
+            token = parts[0]
+        if token in STOPWORDS or len(token) < 2:
+            continue
+        tokens.append(stem(token))
+    return tokens
+
+class LexicalIndex:
+    """BM25 index stored as CSR postings with precomputed per-posting weights"""
+
+    def __init__(self, vocabulary, indptr, postings, weights, chunk_ids, num_docs):
+        self.vocabulary = vocabulary      # term -> term id
+        self.indptr = indptr              # term id -> slice of postings/weights
+        self.postings = postings          # row (position in chunk_ids)
+        self.weights = weights            # BM25 tf component per posting
+        self.chunk_ids = chunk_ids        # row -> chunk id
+        self.num_docs = num_docs
+        df = np.diff(indptr).astype('float32')
+        self.idf = np.log1p((num_docs - df + 0.5) / (df + 0.5)).astype('float32')
+
+    @classmethod
+    def build(cls, chunk_ids, texts, k1=BM25_K1, b=BM25_B):
+        vocabulary, rows, terms, counts = {}, [], [], []
+        doc_lengths = np.zeros(len(texts), dtype='float32')
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths[row] = len(tokens)
+            term_counts = {}
+            for token in tokens:
+                term_id = vocabulary.setdefault(token, len(vocabulary))
+                term_counts[term_id] = term_counts.get(term_id, 0) + 1
+            for term_id, count in term_counts.items():
+                rows.append(row)
+                terms.append(term_id)
+                counts.append(count)
+
+        rows = np.asarray(rows, dtype='int32')
+        terms = np.asarray(terms, dtype='int32')
+        tf = np.asarray(counts, dtype='float32')
+        avgdl = float(doc_lengths.mean()) if len(texts) else 0.0
+        norm = k1 * (1 - b + b * doc_lengths[rows] / avgdl) if avgdl else np.full(len(rows), k1, dtype='float32')
+        weights = (tf * (k1 + 1) / (tf + norm)).astype('float32')
+
+        order = np.argsort(terms, kind='stable')
+        indptr = np.zeros(len(vocabulary) + 1, dtype='int64')
+        np.cumsum(np.bincount(terms, minlength=len(vocabulary)), out=indptr[1:])
+        return cls(vocabulary, indptr, rows[order], weights[order],
+                   np.asarray(chunk_ids, dtype='int64'), len(texts))
+
+    def search(self, query, k):
+        """Return up to k chunk ids ranked by BM25 score"""
+        term_ids = {self.vocabulary[token] for token in tokenize(query) if token in self.vocabulary}
+        if not term_ids:
+            return []
+        scores = np.zeros(self.num_docs, dtype='float32')
+        for term_id in term_ids:
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            scores[self.postings[start:end]] += self.idf[term_id] * self.weights[start:end]
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        ranked = candidates[np.argsort(-scores[candidates], kind='stable')]
+        return self.chunk_ids[ranked].tolist()
+
+    def save(self, path_prefix):
+        np.savez(f"{path_prefix}.npz", indptr=self.indptr, postings=self.postings,
+                 weights=self.weights, chunk_ids=self.chunk_ids)
+        with open(f"{path_prefix}.vocab.json", 'w', encoding='utf-8') as f:
+            json.dump(self.vocabulary, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path_prefix):
+        with np.load(f"{path_prefix}.npz") as data:
+            arrays = {name: data[name] for name in data.files}
+        with open(f"{path_prefix}.vocab.json", 'r', encoding='utf-8') as f:
+            vocabulary = json.load(f)
+        return cls(vocabulary, arrays['indptr'], arrays['postings'], arrays['weights'],
+                   arrays['chunk_ids'], len(arrays['chunk_ids']))
+
+def reciprocal_rank_fusion(rankings, limit, k=RRF_K):
+    """Merge several ranked id lists; ids ranked high in any list come first"""
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            if item == -1:
+                continue
+            scores[int(item)] = scores.get(int(item), 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=scores.get, reverse=True)[:limit]
@@ -0,0 +1,257 @@
+"""
+Upload handling for complaint and profile photos.
+
+The request path only streams the upload to disk under a size cap, makes it
+durable and records an Upload row. Resizing runs in a background pool: a
+small thumbnail and a web-sized variant are written as WebP without EXIF
+(orientation applied first), and the dimensions are stored on the row.
+Until a variant is ready, or if processing fails, the original is served.
+?size=original always serves the original, e.g. for admins reviewing
+complaint evidence at full resolution.
+
+Files are content-addressed: an upload is named by the SHA-256 of its bytes
+and stored under UPLOAD_FOLDER/ab/cd/, so identical photos are kept once and
+clients can never overwrite each other. Upload.ref_count counts the
+complaints and profiles pointing at a file; it is removed with its variants
+only when the last reference goes. Placing a file and taking a reference
+(acquire) and removing an unreferenced one (collect) hold the same
+per-filename lock, so an identical upload can never be left pointing at a
+file that a concurrent delete just removed. Names from before this scheme
+stay in the flat folder and are still served.
+"""
+
+import os
+import re
+import uuid
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import send_from_directory
+from PIL import Image, ImageOps
+from sqlalchemy import select, delete, text
+from sqlalchemy.exc import IntegrityError
+
+from .models import db, Upload
+from .config import MEDIA_WORKERS, UPLOAD_MAX_BYTES
+
+THUMB_SIZE = 320
+WEB_SIZE = 1280
+WEBP_QUALITY = 80
+STREAM_CHUNK_BYTES = 64 * 1024
+# Foto ponsel ~12-50 MP; di atas ini dianggap decompression bomb
+Image.MAX_IMAGE_PIXELS = 60_000_000
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+CONTENT_NAME = re.compile(r'^[0-9a-f]{64}\.')
+
+class UploadTooLarge(Exception):
+    pass
+
+def _content_addressed(name):
+    return CONTENT_NAME.match(name) is not None
+
+def storage_dir(folder, name):
+    """Directory holding name: two shard levels for hashed names, flat for legacy ones"""
+    if _content_addressed(name):
+        return os.path.join(folder, name[:2], name[2:4])
+    return folder
+
+def storage_path(folder, name):
+    return os.path.join(storage_dir(folder, name), name)
+
+def stage_upload(file_storage, folder, extension):
+    """Stream an upload to a temporary file; returns (filename, size, tmp_path).
+
+    The bytes are hashed while streaming and fsynced, so the file is durable
+    once this returns. MediaProcessor.acquire() moves it into place. Raises
+    UploadTooLarge past UPLOAD_MAX_BYTES.
+    """
+    tmp_path = os.path.join(folder, f"{uuid.uuid4().hex}.part")
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, 'wb') as f:
+            while True:
+                chunk = file_storage.stream.read(STREAM_CHUNK_BYTES)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > UPLOAD_MAX_BYTES:
+                    raise UploadTooLarge(f"Upload exceeds {UPLOAD_MAX_BYTES} bytes")
+                digest.update(chunk)
+                f.write(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return f"{digest.hexdigest()}.{'jpg' if extension == 'jpeg' else extension}", size, tmp_path
+
+def variant_name(filename, variant):
+    return f"{os.path.splitext(filename)[0]}.{variant}.webp"
+
+def remove_stored(folder, filename):
+    """Delete a stored file and its variants, ignoring missing ones"""
+    for name in (filename, variant_name(filename, 'web'), variant_name(filename, 'thumb')):
+        try:
+            os.remove(storage_path(folder, name))
+        except OSError:
+            pass
+
+def lock_file(connection, filename):
+    """Hold the per-filename lock until the transaction ends (PostgreSQL only)"""
+    # SQLite hanya mengizinkan satu penulis: penguncian tambahan tidak perlu
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text("SELECT pg_advisory_xact_lock(hashtext(:name))"), {'name': filename})
+
+def remove_unused(connection, folder, filename):
+    """Delete a file, its variants and its Upload row if nothing references it; returns True if removed.
+
+    Runs under the filename lock and unlinks before the caller commits, so a
+    concurrent acquire() either sees the row still referenced or places the
+    file again after this transaction.
+    """
+    lock_file(connection, filename)
+    upload = Upload.__table__
+    row = connection.execute(select(upload.c.ref_count).where(upload.c.filename == filename)).first()
+    if row is not None:
+        if row.ref_count > 0:
+            return False
+        connection.execute(delete(upload).where(upload.c.filename == filename))
+    # Tanpa baris: nama lama, atau file dari transaksi yang di-rollback
+    remove_stored(folder, filename)
+    return True
+
+def _write_variant(image, max_side, path):
+    variant = image.copy()
+    variant.thumbnail((max_side, max_side), Image.LANCZOS)
+    tmp_path = f"{path}.part"
+    # Tanpa argumen exif: metadata (termasuk GPS) tidak ikut tersimpan
+    variant.save(tmp_path, 'WEBP', quality=WEBP_QUALITY, method=4)
+    os.replace(tmp_path, path)
+
+def process_image(folder, filename):
+    """Write thumbnail and web variants; returns the displayed (width, height) of the original"""
+    with Image.open(storage_path(folder, filename)) as image:
+        width, height = image.size
+        # Orientasi 5-8 memutar 90°: simpan dimensi seperti yang ditampilkan
+        if image.getexif().get(0x0112) in (5, 6, 7, 8):
+            width, height = height, width
+        # JPEG: decode langsung pada skala 1/2..1/8 yang cukup untuk varian terbesar
+        image.draft('RGB', (WEB_SIZE, WEB_SIZE))
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+        _write_variant(image, WEB_SIZE, storage_path(folder, variant_name(filename, 'web')))
+        _write_variant(image, THUMB_SIZE, storage_path(folder, variant_name(filename, 'thumb')))
+    return width, height
+
+class MediaProcessor:
+    """Per-process pool that turns pending Upload rows into resized variants"""
+
+    def __init__(self, folder, max_workers=MEDIA_WORKERS):
+        self.folder = folder
+        self.max_workers = max_workers
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _executor(self):
+        # Pool dibuat ulang setelah fork (gunicorn --preload)
+        if self._pool is None or self._pid != os.getpid():
+            with self._lock:
+                if self._pool is None or self._pid != os.getpid():
+                    self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='media')
+                    self._pid = os.getpid()
+        return self._pool
+
+    def submit(self, app, upload_id):
+        """Queue processing; call after the Upload row is committed"""
+        return self._executor().submit(self._process, app, upload_id)
+
+    def _process(self, app, upload_id):
+        with app.app_context():
+            upload = db.session.get(Upload, upload_id)
+            if upload is None or upload.status != 'pending':
+                return
+            try:
+                upload.width, upload.height = process_image(self.folder, upload.filename)
+                upload.status = 'ready'
+            except Exception as e:
+                print(f"⚠️ Gagal memproses gambar {upload.filename}: {e}")
+                upload.status = 'failed'
+            db.session.commit()
+
+    def acquire(self, filename, kind, size_bytes, tmp_path):
+        """Move a staged upload into place and take a reference in the caller's transaction.
+
+        Returns (upload, created); only a created row needs processing. The
+        filename lock is held until the caller commits or rolls back.
+        """
+        try:
+            lock_file(db.session.connection(), filename)
+            path = storage_path(self.folder, filename)
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        upload = Upload.query.filter_by(filename=filename).first()
+        if upload is None:
+            try:
+                # Savepoint: upload identik yang bersamaan boleh kalah balapan insert
+                with db.session.begin_nested():
+                    upload = Upload(filename=filename, kind=kind, size_bytes=size_bytes, ref_count=1)
+                    db.session.add(upload)
+                return upload, True
+            except IntegrityError:
+                upload = Upload.query.filter_by(filename=filename).one()
+        upload.ref_count = Upload.ref_count + 1
+        return upload, False
+
+    def retain(self, filename):
+        """Take another reference on a file already acquired in this transaction"""
+        Upload.query.filter_by(filename=filename).update(
+            {Upload.ref_count: Upload.ref_count + 1}, synchronize_session=False)
+
+    def release(self, filename):
+        """Drop a reference in the caller's transaction; call collect() after commit"""
+        Upload.query.filter_by(filename=filename).update(
+            {Upload.ref_count: Upload.ref_count - 1}, synchronize_session=False)
+
+    def collect(self, filename):
+        """Remove the file and its variants once nothing references it"""
+        remove_unused(db.session.connection(), self.folder, filename)
+        db.session.commit()
+
+    def send(self, filename, size=None):
+        """Serve an upload with validators and Range support.
+
+        size is 'thumb', 'original', or anything else for the web variant;
+        the original is also served while no variant is ready.
+
+        Content-addressed files get a strong ETag from their hash; once the
+        upload is ready or failed the response for this URL never changes, so
+        it is marked immutable. Pending uploads and legacy names are revalidated.
+        """
+        upload = Upload.query.filter_by(filename=filename).first()
+        name = filename
+        if upload is not None and upload.status == 'ready' and size != 'original':
+            name = variant_name(filename, 'thumb' if size == 'thumb' else 'web')
+        if not _content_addressed(name):
+            return send_from_directory(self.folder, name)
+
+        final = upload is not None and upload.status != 'pending'
+        response = send_from_directory(storage_dir(self.folder, name), name,
+                                       etag=os.path.splitext(name)[0],
+                                       max_age=IMMUTABLE_MAX_AGE if final else 0)
+        if final:
+            # Foto pengaduan bersifat pribadi: hanya cache browser, bukan proxy
+            response.cache_control.public = False
+            response.cache_control.private = True
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.no_cache = True
+        return response
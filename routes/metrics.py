@@ -0,0 +1,227 @@
+"""
+Lightweight in-process metrics.
+
+Histograms, counters and callback gauges live in REGISTRY and are rendered
+in the Prometheus text format by /metrics. Recording is a perf_counter call
+and a short lock, cheap enough to leave on in production. Values are per
+process: with several gunicorn workers each scrape sees one worker.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Detik; dari lookup cache (~ms) sampai generate_content (puluhan detik)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SQL_QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+class Histogram:
+    """Thread-safe histogram with fixed upper bounds (Prometheus 'le' semantics)"""
+
+    def __init__(self, buckets):
+        self.buckets = sorted(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[position] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self):
+        """Cumulative bucket counts keyed by upper bound ('le' label), plus sum and count"""
+        with self._lock:
+            counts, total, count = list(self._counts), self._sum, self._count
+        cumulative, running = {}, 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            running += bucket_count
+            cumulative[f"{bound:g}"] = running
+        cumulative['+Inf'] = count
+        return {'buckets': cumulative, 'sum': total, 'count': count}
+
+class Counter:
+    """Thread-safe monotonically increasing counter"""
+
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def value(self):
+        with self._lock:
+            return self._value
+
+class MetricFamily:
+    """A metric split by label values; children are created on first use"""
+
+    def __init__(self, factory, labelnames):
+        self._factory = factory
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._factory())
+        return child
+
+    def children(self):
+        with self._lock:
+            return list(self._children.items())
+
+def _format_labels(pairs):
+    if not pairs:
+        return ""
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+class Registry:
+    """Named metrics rendered together in the Prometheus text exposition format"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, name, kind, help_text, create):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = (kind, help_text, create(), None)
+            return self._metrics[name][2]
+
+    def counter(self, name, help_text, labelnames=()):
+        if labelnames:
+            return self._get_or_create(name, 'counter', help_text, lambda: MetricFamily(Counter, labelnames))
+        return self._get_or_create(name, 'counter', help_text, Counter)
+
+    def histogram(self, name, help_text, buckets, labelnames=()):
+        if labelnames:
+            return self._get_or_create(name, 'histogram', help_text,
+                                       lambda: MetricFamily(lambda: Histogram(buckets), labelnames))
+        return self._get_or_create(name, 'histogram', help_text, lambda: Histogram(buckets))
+
+    def register(self, name, help_text, metric, kind='histogram', labelname=None):
+        """Expose an existing Histogram, or a callable as a gauge/counter.
+
+        A callable returns a number, or a dict mapping values of labelname
+        to numbers. Registering a name again replaces the previous metric.
+        """
+        with self._lock:
+            self._metrics[name] = (kind, help_text, metric, labelname)
+
+    def render(self):
+        with self._lock:
+            metrics = sorted(self._metrics.items())
+        lines = []
+        for name, (kind, help_text, metric, labelname) in metrics:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if callable(metric):
+                try:
+                    value = metric()
+                except Exception:
+                    continue
+                if isinstance(value, dict):
+                    for label_value, number in value.items():
+                        lines.append(f"{name}{_format_labels([(labelname, label_value)])} {float(number):g}")
+                elif value is not None:
+                    lines.append(f"{name} {float(value):g}")
+                continue
+            children = (metric.children() if isinstance(metric, MetricFamily) else [((), metric)])
+            labelnames = metric.labelnames if isinstance(metric, MetricFamily) else ()
+            for key, child in children:
+                pairs = list(zip(labelnames, key))
+                if isinstance(child, Counter):
+                    lines.append(f"{name}{_format_labels(pairs)} {child.value():g}")
+                    continue
+                snapshot = child.snapshot()
+                for bound, count in snapshot['buckets'].items():
+                    lines.append(f"{name}_bucket{_format_labels(pairs + [('le', bound)])} {count}")
+                lines.append(f"{name}_sum{_format_labels(pairs)} {snapshot['sum']:g}")
+                lines.append(f"{name}_count{_format_labels(pairs)} {snapshot['count']}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+@contextmanager
+def span(metric, **labels):
+    """Observe the duration of the block, in seconds, into a histogram"""
+    histogram = metric.labels(**labels) if labels else metric
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - start)
+
+# --- Instrumentasi request dan SQL ---
+
+request_seconds = REGISTRY.histogram('agrollm_http_request_seconds', "Request latency by endpoint",
+                                     LATENCY_BUCKETS, labelnames=('endpoint',))
+sql_queries = REGISTRY.histogram('agrollm_http_sql_queries', "SQL statements executed per request",
+                                 SQL_QUERY_BUCKETS, labelnames=('endpoint',))
+sql_seconds = REGISTRY.histogram('agrollm_http_sql_seconds', "Time spent in SQL per request",
+                                 LATENCY_BUCKETS, labelnames=('endpoint',))
+
+_sql_listeners_installed = False
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('metrics_query_start', []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    starts = conn.info.get('metrics_query_start')
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    if has_request_context() and 'metrics_sql_count' in g:
+        g.metrics_sql_count += 1
+        g.metrics_sql_seconds += elapsed
+
+def instrument_app(app):
+    """Record latency and SQL count/time per request for every endpoint of app"""
+    global _sql_listeners_installed
+    if not _sql_listeners_installed:
+        # Berlaku untuk semua Engine, termasuk engine Flask-SQLAlchemy yang dibuat belakangan
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        _sql_listeners_installed = True
+
+    @app.before_request
+    def _start_request_metrics():
+        g.metrics_start = time.perf_counter()
+        g.metrics_sql_count = 0
+        g.metrics_sql_seconds = 0.0
+
+    @app.after_request
+    def _record_request_metrics(response):
+        if 'metrics_start' not in g:
+            return response
+        # Endpoint tak dikenal (404) digabung agar kardinalitas label tetap kecil
+        endpoint = request.endpoint or 'unmatched'
+        # Objek g sendiri: SQL selama streaming (stream_with_context) tetap masuk ke sini
+        state = g._get_current_object()
+
+        def record():
+            request_seconds.labels(endpoint=endpoint).observe(time.perf_counter() - state.metrics_start)
+            sql_queries.labels(endpoint=endpoint).observe(state.metrics_sql_count)
+            sql_seconds.labels(endpoint=endpoint).observe(state.metrics_sql_seconds)
+
+        if response.is_streamed:
+            # after_request jalan sebelum body dikirim: SSE dan ekspor diukur sampai selesai
+            response.call_on_close(record)
+        else:
+            record()
+        return response
@@ -4,6 +4,14 @@ from sqlalchemy import Index
 
 db = SQLAlchemy()
 
+def dialect_insert(dialect_name):
+    """insert() with on_conflict_do_update for PostgreSQL, or SQLite in development"""
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert
+
 class User(db.Model):
     __tablename__ = 'user'
     id = db.Column(db.Integer, primary_key=True)
@@ -62,4 +70,46 @@ class Pengaduan(db.Model):
         Index('idx_pengaduan_incident_date', 'incident_date'),
         Index('idx_pengaduan_region_status', 'region', 'status'),
         Index('idx_pengaduan_user_created', 'user_id', 'created_at'),
+        Index('idx_pengaduan_region_created', 'region', 'created_at'),
     )
+
+class PengaduanStats(db.Model):
+    """Complaint counts per region x status x category, kept current by routes/stats.py"""
+    __tablename__ = 'pengaduan_stats'
+
+    region = db.Column(db.String(100), primary_key=True)
+    status = db.Column(db.String(20), primary_key=True)
+    category = db.Column(db.String(50), primary_key=True)
+    count = db.Column(db.BigInteger, nullable=False, default=0)
+
+class UserStats(db.Model):
+    """User counts per role, kept current by routes/stats.py"""
+    __tablename__ = 'user_stats'
+
+    role = db.Column(db.String(20), primary_key=True)
+    count = db.Column(db.BigInteger, nullable=False, default=0)
+
+class Upload(db.Model):
+    """An uploaded image and the state of its resized variants (routes/media.py)"""
+    __tablename__ = 'upload'
+
+    id = db.Column(db.Integer, primary_key=True)
+    filename = db.Column(db.String(255), nullable=False, unique=True)
+    kind = db.Column(db.String(20), nullable=False)  # complaint / profile
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending / ready / failed
+    size_bytes = db.Column(db.BigInteger, nullable=False)
+    ref_count = db.Column(db.Integer, nullable=False, default=1)  # pengaduan/profil yang memakai file ini
+    width = db.Column(db.Integer)
+    height = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class IngestKey(db.Model):
+    """Client idempotency key of a complaint synced through /api/pengaduan/batch"""
+    __tablename__ = 'ingest_key'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'), primary_key=True)
+    key = db.Column(db.String(64), primary_key=True)
+    # Tanpa foreign key: pengaduan yang dipartisi tidak bisa dirujuk lewat id saja.
+    # Kunci tetap disimpan walau pengaduannya dihapus, agar retry tidak membuatnya lagi
+    pengaduan_id = db.Column(db.Integer)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
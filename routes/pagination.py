@@ -0,0 +1,52 @@
+"""
+Keyset (cursor) pagination over (created_at, id), newest first.
+
+Each page is a range scan that starts right after the last row of the
+previous page, so page N costs the same as page 1 and no COUNT is needed.
+The cursor is an opaque URL-safe token encoding that last (created_at, id).
+"""
+
+import base64
+from collections import namedtuple
+from datetime import datetime
+from sqlalchemy import tuple_
+
+DEFAULT_PAGE_SIZE = 10
+MAX_PAGE_SIZE = 100
+
+KeysetPage = namedtuple('KeysetPage', ['items', 'next_cursor'])
+
+def encode_cursor(created_at, row_id):
+    raw = f"{created_at.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(token):
+    """Return (created_at, id); raises ValueError for a malformed token"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        created_at, row_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {token!r}") from e
+
+def page_size(value, default=DEFAULT_PAGE_SIZE):
+    """Clamp a client-supplied page size"""
+    try:
+        return max(1, min(int(value), MAX_PAGE_SIZE))
+    except (TypeError, ValueError):
+        return default
+
+def keyset_page(query, model, cursor=None, per_page=DEFAULT_PAGE_SIZE):
+    """Fetch one page of query ordered by (created_at, id) descending.
+
+    query must already carry its filters (user_id, region, ...) so that the
+    matching (filter, created_at) index serves the range scan.
+    """
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        query = query.filter(tuple_(model.created_at, model.id) < (created_at, row_id))
+    # Satu baris ekstra untuk tahu apakah masih ada halaman berikutnya
+    rows = query.order_by(model.created_at.desc(), model.id.desc()).limit(per_page + 1).all()
+    items = rows[:per_page]
+    next_cursor = encode_cursor(items[-1].created_at, items[-1].id) if len(rows) > per_page else None
+    return KeysetPage(items, next_cursor)
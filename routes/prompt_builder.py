@@ -0,0 +1,152 @@
+"""
+Token-budgeted prompt assembly for /chat.
+
+Retrieved chunks that are neighbours in the same paper and page are merged
+and their CharacterTextSplitter overlap removed, the most recent turns of
+the conversation are kept verbatim while older ones are shortened, and the
+whole prompt is held under PROMPT_TOKEN_BUDGET. Every build reports how many
+tokens were saved compared to sending everything as-is.
+"""
+
+from collections import namedtuple
+from .embedding_client import estimate_tokens
+from .metrics import REGISTRY
+from .config import PROMPT_TOKEN_BUDGET, PROMPT_HISTORY_BUDGET, PROMPT_HISTORY_VERBATIM_TURNS
+
+ContextChunk = namedtuple('ContextChunk', ['chunk_id', 'text', 'filename', 'page'])
+
+CONTEXT_SEPARATOR = "\n\n---\n\n"
+# Overlap splitter 100 karakter; di bawah ini dianggap kebetulan
+MIN_OVERLAP_CHARS = 20
+MAX_OVERLAP_CHARS = 300
+COMPACT_TURN_CHARS = 200
+# Sisa anggaran lebih kecil dari ini tidak dipakai untuk potongan chunk
+MIN_PARTIAL_CHUNK_TOKENS = 50
+
+PROMPT_TEMPLATE = """
+            ## PERAN DAN TUJUAN
+            Anda adalah "Penyuluh Pertanian Digital," seorang asisten AI ahli. Jawab pertanyaan petani berdasarkan konteks yang diberikan dengan bahasa yang jelas dan praktis.
+
+            ## ATURAN
+            - Jawaban HARUS 100% berdasarkan pada "KONTEKS".
+            - Jangan menyebutkan "berdasarkan konteks". Langsung saja berikan jawabannya.
+            - Jika informasi tidak ada, katakan "Maaf, informasi tersebut tidak ditemukan dalam dokumen saya."
+
+            ---
+            ## RIWAYAT PERCAKAPAN
+            {chat_history}
+            ---
+            ## KONTEKS DARI DOKUMEN PENELITIAN
+            {context}
+            ---
+            ## PERTANYAAN TERBARU DARI PETANI
+            {user_question}
+            ---
+            ## JAWABAN PRAKTIS
+            """
+
+prompt_tokens = REGISTRY.histogram('agrollm_prompt_tokens', "Estimated tokens per generation prompt",
+                                   [250, 500, 1000, 2000, 4000, 8000, 16000])
+prompt_tokens_saved = REGISTRY.histogram('agrollm_prompt_tokens_saved', "Tokens saved by prompt budgeting",
+                                         [0, 100, 250, 500, 1000, 2000, 4000, 8000])
+
+def _truncate(text, max_chars):
+    """Cut text at a word boundary"""
+    text = " ".join(text.split())
+    if len(text) <= max_chars:
+        return text
+    cut = text.rfind(' ', 0, max_chars)
+    return text[:cut if cut > 0 else max_chars] + "…"
+
+def _overlap(left, right):
+    """Length of the longest suffix of left that is a prefix of right"""
+    for size in range(min(len(left), len(right), MAX_OVERLAP_CHARS), MIN_OVERLAP_CHARS - 1, -1):
+        if left.endswith(right[:size]):
+            return size
+    return 0
+
+def merge_chunks(chunks):
+    """Merge runs of consecutive chunks from the same paper and page.
+
+    chunks are ContextChunk in retrieval order. Chunk ids are assigned in
+    splitter order per PDF, so consecutive ids on one page are neighbours
+    in the text. Merged blocks keep the rank of their best member; exact
+    duplicates are dropped. Returns a list of texts in rank order.
+    """
+    rank = {chunk.chunk_id: position for position, chunk in enumerate(chunks)}
+    blocks, seen = [], set()
+    previous = None
+    for chunk in sorted(chunks, key=lambda c: (c.filename, c.page, c.chunk_id)):
+        if chunk.text in seen:
+            continue
+        seen.add(chunk.text)
+        if (previous is not None and previous.filename == chunk.filename
+                and previous.page == chunk.page and chunk.chunk_id == previous.chunk_id + 1):
+            block = blocks[-1]
+            size = _overlap(block[1], chunk.text)
+            block[1] += chunk.text[size:] if size else "\n\n" + chunk.text
+            block[0] = min(block[0], rank[chunk.chunk_id])
+        else:
+            blocks.append([rank[chunk.chunk_id], chunk.text])
+        previous = chunk
+    return [text for _, text in sorted(blocks, key=lambda block: block[0])]
+
+def _format_turn(turn, compact):
+    user, bot = turn.get('user', ''), turn.get('bot', '')
+    if compact:
+        user, bot = _truncate(user, COMPACT_TURN_CHARS), _truncate(bot, COMPACT_TURN_CHARS)
+    return f"Petani: {user}\nAsisten: {bot}\n\n"
+
+def compact_history(history, budget=PROMPT_HISTORY_BUDGET, verbatim_turns=PROMPT_HISTORY_VERBATIM_TURNS):
+    """Format history newest-first into at most budget tokens.
+
+    The last verbatim_turns turns are kept as-is if they fit; older turns
+    (and recent ones that do not fit) are shortened, and the oldest are
+    dropped once the budget is spent.
+    """
+    kept, used = [], 0
+    for age, turn in enumerate(reversed(history)):
+        text = _format_turn(turn, compact=age >= verbatim_turns)
+        if used + estimate_tokens(text) > budget and age < verbatim_turns:
+            text = _format_turn(turn, compact=True)
+        if used + estimate_tokens(text) > budget:
+            break
+        kept.append(text)
+        used += estimate_tokens(text)
+    return "".join(reversed(kept))
+
+def build_prompt(user_question, history, context_chunks, token_budget=PROMPT_TOKEN_BUDGET):
+    """Assemble the generation prompt within token_budget.
+
+    context_chunks are ContextChunk in retrieval order. Returns (prompt,
+    report) where report holds the prompt size and the tokens saved against
+    concatenating every chunk and the full history.
+    """
+    chat_history = compact_history(history)
+    remaining = token_budget - estimate_tokens(
+        PROMPT_TEMPLATE.format(chat_history=chat_history, context="", user_question=user_question))
+
+    context_blocks = []
+    for text in merge_chunks(context_chunks):
+        cost = estimate_tokens(text) + estimate_tokens(CONTEXT_SEPARATOR)
+        if cost > remaining:
+            if remaining >= MIN_PARTIAL_CHUNK_TOKENS:
+                context_blocks.append(_truncate(text, remaining * 4))
+            break
+        context_blocks.append(text)
+        remaining -= cost
+
+    prompt = PROMPT_TEMPLATE.format(chat_history=chat_history, context=CONTEXT_SEPARATOR.join(context_blocks),
+                                    user_question=user_question)
+    naive_tokens = estimate_tokens(PROMPT_TEMPLATE.format(
+        chat_history="".join(_format_turn(turn, compact=False) for turn in history),
+        context=CONTEXT_SEPARATOR.join(chunk.text for chunk in context_chunks),
+        user_question=user_question))
+    report = {'prompt_tokens': estimate_tokens(prompt),
+              'tokens_saved': max(0, naive_tokens - estimate_tokens(prompt))}
+    prompt_tokens.observe(report['prompt_tokens'])
+    prompt_tokens_saved.observe(report['tokens_saved'])
+    return prompt, report
+
+def prompt_stats():
+    return {'prompt_tokens': prompt_tokens.snapshot(), 'tokens_saved': prompt_tokens_saved.snapshot()}
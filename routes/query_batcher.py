@@ -0,0 +1,104 @@
+"""
+Micro-batching of query embedding and FAISS search across concurrent /chat requests.
+
+Questions arriving within max_wait_ms of each other are embedded with one
+backend call and searched with one multi-row faiss search; each caller
+gets back its own row.
+"""
+
+import os
+import time
+import queue
+import threading
+from concurrent.futures import Future, TimeoutError
+import numpy as np
+from .metrics import Histogram
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+QUEUE_TIME_BUCKETS_MS = (0.5, 1, 2, 5, 10, 25, 50, 100, 250)
+
+class QueryBatcher:
+    """Coalesce concurrent queries into batched embed + search calls.
+
+    ``embed_fn(texts)`` must return a float32 array with one row per text;
+    ``search_fn(vectors)`` must return faiss-style (distances, ids).
+    """
+
+    def __init__(self, embed_fn, search_fn, max_batch_size=16, max_wait_ms=5.0):
+        self.embed_fn = embed_fn
+        self.search_fn = search_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.queue_times_ms = Histogram(QUEUE_TIME_BUCKETS_MS)
+        self._queue = queue.Queue()
+        self._thread = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_worker(self):
+        # Thread tidak ikut tersalin saat fork (gunicorn --preload), mulai per proses
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._queue = queue.Queue()
+                self._thread = threading.Thread(target=self._run, name='query-batcher', daemon=True)
+                self._pid = os.getpid()
+                self._thread.start()
+
+    def submit(self, text):
+        """Queue one question; the Future resolves to (embedding, distances_row, ids_row)"""
+        self._ensure_worker()
+        future = Future()
+        self._queue.put((text, future, time.perf_counter()))
+        return future
+
+    def query(self, text, timeout=30):
+        """Embed and search one question; raises TimeoutError if no batch answers in time"""
+        future = self.submit(text)
+        try:
+            return future.result(timeout=timeout)
+        except TimeoutError:
+            # Belum diambil worker: jangan di-embed lagi untuk request yang sudah menyerah
+            future.cancel()
+            raise
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            # Future yang dibatalkan karena timeout dilewati
+            batch = [entry for entry in self._collect() if entry[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            started = time.perf_counter()
+            for _, _, enqueued in batch:
+                self.queue_times_ms.observe((started - enqueued) * 1000)
+            self.batch_sizes.observe(len(batch))
+            try:
+                embeddings = np.asarray(self.embed_fn([text for text, _, _ in batch]), dtype='float32')
+                distances, ids = self.search_fn(embeddings)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            for row, (_, future, _) in enumerate(batch):
+                future.set_result((embeddings[row], distances[row], ids[row]))
+
+    def stats(self):
+        return {
+            'batch_size': self.batch_sizes.snapshot(),
+            'queue_time_ms': self.queue_times_ms.snapshot(),
+        }
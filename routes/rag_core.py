@@ -4,35 +4,88 @@ import re
 import faiss
 import numpy as np
 import google.generativeai as genai
-from langchain.text_splitter import CharacterTextSplitter
 from langchain.schema import Document
 import threading
 import hashlib
+import json
 import pickle
 from functools import lru_cache
-
-# Membuat objek lokal untuk setiap thread
-thread_local = threading.local()
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from .embedding_store import EmbeddingStore, QueryEmbeddingCache
+from .embedding_client import EmbeddingClient, EmbeddingError, create_backend
+from .ann_index import is_ivf
+from .query_batcher import QueryBatcher
+from .lexical_index import LexicalIndex, reciprocal_rank_fusion
+from .chunk_store import ChunkStore
+from .prompt_builder import ContextChunk
+from .metrics import REGISTRY, LATENCY_BUCKETS, span
+from .config import (
+    EMBEDDING_BACKEND, EMBEDDING_BATCH_SIZE, EMBEDDING_MAX_IN_FLIGHT,
+    EMBEDDING_REQUESTS_PER_MINUTE, EMBEDDING_TOKENS_PER_MINUTE, EMBEDDING_MAX_RETRIES,
+    QUERY_BATCH_ENABLED, QUERY_BATCH_MAX_SIZE, QUERY_BATCH_MAX_WAIT_MS,
+    QUERY_EMBED_CACHE_SIZE, QUERY_EMBED_CACHE_TTL,
+)
 
 DOWNLOAD_FOLDER = 'D:/ProjectGemastik/AgroLLM/jurnal_ilmiah'
 CACHE_FOLDER = 'cache'
 
+# --- Artefak indeks berversi (ditulis oleh build_index.py) ---
+INDEX_ROOT = os.path.join(CACHE_FOLDER, 'index')
+CURRENT_POINTER = os.path.join(INDEX_ROOT, 'CURRENT')
+ARTIFACT_FORMAT = 2
+FAISS_INDEX_FILE = 'faiss.index'
+CHUNK_STORE_PREFIX = 'chunks'
+MANIFEST_FILE = 'manifest.json'
+META_FILE = 'meta.json'
+LEXICAL_INDEX_PREFIX = 'bm25'
+
+# --- Cache embedding persisten (bertahan antar restart dan rebuild) ---
+EMBEDDING_STORE_PATH = os.path.join(CACHE_FOLDER, 'embeddings.sqlite3')
+embedding_store = EmbeddingStore(EMBEDDING_STORE_PATH)
+# Pertanyaan pengguna tidak ditulis ke disk: cukup cache terbatas di memori
+query_embedding_cache = QueryEmbeddingCache(QUERY_EMBED_CACHE_SIZE, QUERY_EMBED_CACHE_TTL)
+
+# --- Klien embedding (batch paralel, rate limit, retry) ---
+QUERY_EMBED_RETRIES = 1
+# Artefak sebelum backend bisa dipilih selalu memakai model ini
+LEGACY_EMBEDDING_MODEL = "models/embedding-001"
+embedding_client = EmbeddingClient(
+    create_backend(EMBEDDING_BACKEND),
+    batch_size=EMBEDDING_BATCH_SIZE,
+    max_in_flight=EMBEDDING_MAX_IN_FLIGHT,
+    requests_per_minute=EMBEDDING_REQUESTS_PER_MINUTE,
+    tokens_per_minute=EMBEDDING_TOKENS_PER_MINUTE,
+    max_retries=EMBEDDING_MAX_RETRIES,
+)
+
+# Satu instance RAG per proses, dipakai bersama oleh semua thread request
+_rag_system = None
+_rag_lock = threading.Lock()
+
 # Create cache folder if it doesn't exist
 if not os.path.exists(CACHE_FOLDER):
     os.makedirs(CACHE_FOLDER)
 
-def get_cache_path(filename):
-    """Generate cache file path for embeddings"""
-    return os.path.join(CACHE_FOLDER, f"{filename}.pkl")
+def get_cache_path(filename, file_hash):
+    """Generate cache file path for the extracted pages of one PDF version"""
+    return os.path.join(CACHE_FOLDER, f"{filename}.{file_hash[:16]}.pkl")
+
+def file_sha256(file_path):
+    """Hash file content in blocks so large PDFs are never read whole"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
 
 @lru_cache(maxsize=100)
-def extract_text_from_pdf(file_path):
-    """Extract text from PDF with caching"""
+def extract_text_from_pdf(file_path, file_hash):
+    """Extract text from PDF with caching keyed by path and content hash"""
     original_filename = os.path.basename(file_path)
     paper_title = original_filename
     
     # Check cache first
-    cache_path = get_cache_path(original_filename)
+    cache_path = get_cache_path(original_filename, file_hash)
     if os.path.exists(cache_path):
         try:
             with open(cache_path, 'rb') as f:
@@ -82,100 +135,254 @@ def extract_text_from_pdf(file_path):
         print(f"⚠️ Gagal membaca file {original_filename}: {e}")
         return []
 
-@lru_cache(maxsize=1000)
+def _cached_embeddings(texts, task_type, store, max_retries=None):
+    """Embed texts, calling the backend only for texts missing from store.
+
+    Returns a float32 array whose row i belongs to texts[i]. Each completed
+    batch is added to store immediately. Raises EmbeddingError on failure.
+    """
+    keys = [EmbeddingStore.make_key(embedding_client.model, task_type, text) for text in texts]
+    found = store.get_many(keys)
+
+    # Teks identik cukup di-embed sekali
+    missing = {}
+    for key, text in zip(keys, texts):
+        if key not in found:
+            missing.setdefault(key, text)
+    if missing:
+        missing_keys = list(missing)
+
+        def store_batch(start, vectors):
+            store.put_many(zip(missing_keys[start:start + len(vectors)], vectors))
+
+        vectors = embedding_client.embed(list(missing.values()), task_type,
+                                         on_batch=store_batch, max_retries=max_retries)
+        found.update(zip(missing_keys, vectors))
+    if not keys:
+        return np.zeros((0, 0), dtype='float32')
+    return np.vstack([found[key] for key in keys])
+
 def get_doc_embeddings(texts):
-    """Get document embeddings with caching"""
-    try:
-        result = genai.embed_content(model="models/embedding-001", content=texts, task_type="retrieval_document")
-        return [np.array(emb) for emb in result['embedding']]
-    except Exception:
-        return [None] * len(texts)
+    """Get document embeddings with persistent caching; raises EmbeddingError"""
+    return _cached_embeddings(list(texts), "retrieval_document", embedding_store)
 
-@lru_cache(maxsize=1000)
 def get_query_embedding(text):
-    """Get query embedding with caching"""
+    """Get query embedding with in-memory caching, or None if the API is unavailable"""
     try:
-        result = genai.embed_content(model="models/embedding-001", content=text, task_type="retrieval_query")
-        return np.array(result['embedding'])
-    except Exception:
+        # Jangan menahan request chat terlalu lama dengan retry panjang
+        return _cached_embeddings([text], "retrieval_query", query_embedding_cache,
+                                  max_retries=QUERY_EMBED_RETRIES)[0]
+    except EmbeddingError as e:
+        print(f"⚠️ Gagal membuat embedding query: {e}")
         return None
 
-def initialize_rag_system():
-    """Initialize RAG system with better error handling and caching"""
-    # Menyimpan data pada thread lokal
-    if not hasattr(thread_local, 'faiss_index'):
-        print(f"Menginisialisasi sistem RAG dari folder: {DOWNLOAD_FOLDER}...")
-
-        # Check if we have cached FAISS index
-        faiss_cache_path = os.path.join(CACHE_FOLDER, 'faiss_index.pkl')
-        chunks_cache_path = os.path.join(CACHE_FOLDER, 'doc_chunks.pkl')
-        
-        if os.path.exists(faiss_cache_path) and os.path.exists(chunks_cache_path):
+def get_embedding_cache_stats():
+    """Hit/miss counters of the persistent embedding cache"""
+    return embedding_store.stats()
+
+def get_query_embedding_cache_stats():
+    """Hit/miss counters and size of the in-memory query embedding cache"""
+    return query_embedding_cache.stats()
+
+RETRIEVAL_TOP_K = 5
+# Kandidat per retriever sebelum digabung dengan RRF
+RETRIEVAL_CANDIDATES = 20
+
+def get_query_embeddings(texts):
+    """Embed several questions in one call; raises EmbeddingError"""
+    return _cached_embeddings(list(texts), "retrieval_query", query_embedding_cache,
+                              max_retries=QUERY_EMBED_RETRIES)
+
+def _search_published_index(vectors):
+    return get_rag_system().faiss_index.search(np.ascontiguousarray(vectors, dtype='float32'), RETRIEVAL_CANDIDATES)
+
+# Pertanyaan yang datang bersamaan di-embed dan dicari dalam satu batch
+query_batcher = QueryBatcher(
+    get_query_embeddings,
+    _search_published_index,
+    max_batch_size=QUERY_BATCH_MAX_SIZE,
+    max_wait_ms=QUERY_BATCH_MAX_WAIT_MS,
+) if QUERY_BATCH_ENABLED else None
+
+chat_stage_seconds = REGISTRY.histogram('agrollm_chat_stage_seconds', "Time per /chat stage",
+                                        LATENCY_BUCKETS, labelnames=('stage',))
+rag_init_seconds = REGISTRY.histogram('agrollm_rag_init_seconds', "Time per RAG initialization stage",
+                                      LATENCY_BUCKETS, labelnames=('stage',))
+REGISTRY.register('agrollm_embedding_cache_lookups_total', "Persistent embedding cache lookups",
+                  lambda: {'hit': embedding_store.hits, 'miss': embedding_store.misses},
+                  kind='counter', labelname='result')
+REGISTRY.register('agrollm_query_embedding_cache_lookups_total', "In-memory query embedding cache lookups",
+                  lambda: {'hit': query_embedding_cache.hits, 'miss': query_embedding_cache.misses},
+                  kind='counter', labelname='result')
+REGISTRY.register('agrollm_embedding_api_requests_total', "Embedding API requests by outcome",
+                  lambda: dict(embedding_client.stats), kind='counter', labelname='kind')
+if query_batcher is not None:
+    REGISTRY.register('agrollm_query_batch_size', "Questions per embedding/search batch", query_batcher.batch_sizes)
+    REGISTRY.register('agrollm_query_batch_queue_ms', "Wait before a question joins a batch, in ms",
+                      query_batcher.queue_times_ms)
+
+def embed_and_search(rag, user_question):
+    """Embed the question and search the index.
+
+    Concurrent callers are coalesced by query_batcher when enabled. Returns
+    (query_embedding, chunk_ids), or (None, None) if embedding failed.
+    """
+    if query_batcher is None:
+        with span(chat_stage_seconds, stage='embed'):
+            query_embedding = get_query_embedding(user_question)
+        if query_embedding is None:
+            return None, None
+        with span(chat_stage_seconds, stage='faiss_search'):
+            distances, indices = rag.faiss_index.search(np.array([query_embedding]).astype('float32'), RETRIEVAL_CANDIDATES)
+        return query_embedding, indices[0]
+    try:
+        # Embedding dan pencarian terjadi di worker batcher; waktunya diukur bersama
+        with span(chat_stage_seconds, stage='embed_and_search'):
+            query_embedding, distances, chunk_ids = query_batcher.query(user_question)
+        return query_embedding, chunk_ids
+    except EmbeddingError as e:
+        print(f"⚠️ Gagal membuat embedding query: {e}")
+        return None, None
+    except FuturesTimeoutError:
+        # Worker batcher macet: retrieve() jatuh ke BM25 saja
+        print("⚠️ Embedding query melewati batas waktu batcher")
+        return None, None
+
+def retrieve(rag, user_question):
+    """Hybrid retrieval: fuse vector and BM25 rankings with reciprocal rank fusion.
+
+    Exact terms such as pesticide names, varieties and dosages are often
+    missed by the embedding alone. If the embedding call fails the lexical
+    ranking is used on its own. Returns (query_embedding or None, chunk_ids).
+    """
+    query_embedding, vector_ids = embed_and_search(rag, user_question)
+    rankings = []
+    if vector_ids is not None:
+        rankings.append(vector_ids)
+    if rag.lexical_index is not None:
+        with span(chat_stage_seconds, stage='bm25_search'):
+            rankings.append(rag.lexical_index.search(user_question, RETRIEVAL_CANDIDATES))
+    return query_embedding, reciprocal_rank_fusion(rankings, RETRIEVAL_TOP_K)
+
+def context_from_ids(rag, chunk_ids):
+    """Look up retrieved chunks; returns (context_chunks, sources) for the prompt and the reply"""
+    context_chunks, unique_sources = [], {}
+    for i in chunk_ids:
+        if i != -1:
+            title, filename = rag.chunk_store.source(int(i))
+            context_chunks.append(ContextChunk(int(i), rag.chunk_store.text(int(i)), filename,
+                                               rag.chunk_store.page(int(i))))
+            unique_sources[title] = filename
+    sources = [{"title": title, "filename": filename} for title, filename in unique_sources.items()]
+    return context_chunks, sources
+
+def cancel_generation(response):
+    """Stop a streaming generate_content call whose client went away"""
+    # GenerateContentResponse tidak punya API publik untuk membatalkan; iterator
+    # di dalamnya (stream gRPC atau generator REST) punya cancel()/close()
+    iterator = getattr(response, '_iterator', None)
+    for name in ('cancel', 'close'):
+        method = getattr(iterator, name, None)
+        if callable(method):
             try:
-                print("Loading cached FAISS index...")
-                with open(faiss_cache_path, 'rb') as f:
-                    thread_local.faiss_index = pickle.load(f)
-                with open(chunks_cache_path, 'rb') as f:
-                    thread_local.doc_chunks = pickle.load(f)
-                thread_local.model_gen = genai.GenerativeModel("gemini-2.5-flash")
-                print("✅ Sistem RAG loaded from cache.")
-                return
-            except Exception as e:
-                print(f"Failed to load cache: {e}")
-
-        pdf_files = [os.path.join(DOWNLOAD_FOLDER, f) for f in os.listdir(DOWNLOAD_FOLDER) if f.lower().endswith('.pdf')]
-        if not pdf_files:
-            print("❌ Tidak ada PDF ditemukan.")
+                method()
+            except Exception:
+                pass
             return
 
-        all_documents = []
-        for pdf_file in pdf_files:
-            docs = extract_text_from_pdf(pdf_file)
-            if docs:
-                all_documents.extend(docs)
-                print(f"  -> Berhasil memproses: {docs[0].metadata['title']}")
+def save_faiss_index(faiss_index, path):
+    """Write FAISS index in native format, atomically replacing the old file"""
+    tmp_path = f"{path}.tmp"
+    faiss.write_index(faiss_index, tmp_path)
+    os.replace(tmp_path, path)
+
+def load_faiss_index(path, index_type='flat'):
+    """Open FAISS index memory-mapped and read-only.
+
+    Vectors stay in the OS page cache, so every thread and every gunicorn
+    worker on the host shares one physical copy of the index.
+    """
+    # IVF: inverted lists di-mmap lewat IO_FLAG_MMAP. Lainnya: IO_FLAG_MMAP_IFC
+    # (faiss >= 1.10) memetakan kode flat di tempat.
+    if is_ivf(index_type):
+        mmap_flag = faiss.IO_FLAG_MMAP
+    else:
+        mmap_flag = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP)
+    try:
+        return faiss.read_index(path, mmap_flag | faiss.IO_FLAG_READ_ONLY)
+    except RuntimeError:
+        return faiss.read_index(path, faiss.IO_FLAG_READ_ONLY)
+
+def current_index_dir():
+    """Return the directory of the published index version, or None"""
+    try:
+        with open(CURRENT_POINTER, 'r', encoding='utf-8') as f:
+            version = f.read().strip()
+    except OSError:
+        return None
+    version_dir = os.path.join(INDEX_ROOT, version)
+    return version_dir if os.path.isdir(version_dir) else None
 
-        text_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=100)
-        doc_chunks = text_splitter.split_documents(all_documents)
+class RAGSystem:
+    """Read-only RAG components shared by every request thread"""
 
-        # Process embeddings in batches for better performance
-        batch_size = 10
-        embeddings_list = []
-        for i in range(0, len(doc_chunks), batch_size):
-            batch = doc_chunks[i:i+batch_size]
-            batch_embeddings = get_doc_embeddings(tuple([chunk.page_content for chunk in batch]))
-            embeddings_list.extend(batch_embeddings)
+    def __init__(self, faiss_index, chunk_store, model_gen, version=None, lexical_index=None):
+        self.faiss_index = faiss_index
+        self.chunk_store = chunk_store
+        self.lexical_index = lexical_index
+        self.model_gen = model_gen
+        self.version = version
 
-        valid_embeddings = [emb for emb in embeddings_list if emb is not None]
+def get_rag_system():
+    """Return the process-wide RAG system, or None if it is not initialized"""
+    return _rag_system
 
-        if not valid_embeddings:
-            print("❌ Gagal membuat embedding.")
-            return
+def initialize_rag_system():
+    """Load the published index once per process; safe to call from any thread.
+
+    The web process never builds the index: run ``python build_index.py`` to
+    ingest journals. A new version is picked up when workers restart.
+    """
+    global _rag_system
+    if _rag_system is not None:
+        return _rag_system
 
-        dimension = valid_embeddings[0].shape[0]
-        faiss_index = faiss.IndexFlatL2(dimension)
-        faiss_index.add(np.array(valid_embeddings).astype('float32'))
+    with _rag_lock:
+        # Thread lain mungkin sudah selesai inisialisasi selagi kita menunggu lock
+        if _rag_system is not None:
+            return _rag_system
 
-        model_gen = genai.GenerativeModel("gemini-2.5-flash")
+        version_dir = current_index_dir()
+        if version_dir is None:
+            print("❌ Indeks RAG belum dibangun. Jalankan: python build_index.py")
+            return None
 
-        # Cache the results
         try:
-            with open(faiss_cache_path, 'wb') as f:
-                pickle.dump(faiss_index, f)
-            with open(chunks_cache_path, 'wb') as f:
-                pickle.dump(doc_chunks, f)
+            with open(os.path.join(version_dir, META_FILE), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('format') != ARTIFACT_FORMAT:
+                print(f"❌ Format indeks {meta.get('format')} tidak didukung, bangun ulang indeks.")
+                return None
+            index_model = meta.get('embedding_model', LEGACY_EMBEDDING_MODEL)
+            if index_model != embedding_client.model:
+                print(f"❌ Indeks dibangun dengan {index_model}, "
+                      f"sedangkan backend aktif {embedding_client.model}. Bangun ulang indeks.")
+                return None
+            with span(rag_init_seconds, stage='faiss_index'):
+                faiss_index = load_faiss_index(os.path.join(version_dir, FAISS_INDEX_FILE), meta.get('index_type', 'flat'))
+            with span(rag_init_seconds, stage='chunk_store'):
+                chunk_store = ChunkStore.open(os.path.join(version_dir, CHUNK_STORE_PREFIX))
+            lexical_prefix = os.path.join(version_dir, LEXICAL_INDEX_PREFIX)
+            # Versi lama tanpa indeks BM25 tetap bisa dipakai (vektor saja)
+            with span(rag_init_seconds, stage='bm25_index'):
+                lexical_index = LexicalIndex.load(lexical_prefix) if os.path.exists(f"{lexical_prefix}.npz") else None
         except Exception as e:
-            print(f"Failed to cache: {e}")
-
-        # Menyimpan pada thread lokal
-        thread_local.faiss_index = faiss_index
-        thread_local.doc_chunks = doc_chunks
-        thread_local.model_gen = model_gen
-
-        print("✅ Sistem RAG siap digunakan.")
-    else:
-        # Ambil data dari thread lokal jika sudah ada
-        faiss_index = thread_local.faiss_index
-        doc_chunks = thread_local.doc_chunks
-        model_gen = thread_local.model_gen
+            print(f"Failed to load index {version_dir}: {e}")
+            return None
 
+        version = os.path.basename(version_dir)
+        with span(rag_init_seconds, stage='model'):
+            model_gen = genai.GenerativeModel("gemini-2.5-flash")
+        _rag_system = RAGSystem(faiss_index, chunk_store, model_gen, version, lexical_index)
+        print(f"✅ Sistem RAG siap digunakan (indeks {version}).")
+        return _rag_system
@@ -0,0 +1,255 @@
+"""
+Retention for old complaints.
+
+On PostgreSQL, pengaduan can be range-partitioned by month on created_at
+(migrate_db.py --partition). The rows from before that stay in one
+partition, pengaduan_legacy. A partition whose upper bound is past the
+retention period and whose complaints are all processed is detached and
+dropped (or kept as an archive table) as a whole, with no row-level deletes.
+
+Everything else goes through a chunked deleter: the legacy partition, months
+that still hold unprocessed complaints, and unpartitioned tables or other
+databases. It deletes small batches, each in its own short transaction. It
+uses SKIP LOCKED so it never waits on a request, and pauses between batches.
+It keeps no state; a stopped run resumes from the oldest remaining row.
+
+Both paths subtract the removed rows from the stats counters and release
+their uploads in the same transaction. Files whose last reference is gone are
+deleted after commit, under the same per-filename lock as uploads, unless an
+identical upload has taken them again in the meantime.
+"""
+
+import re
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from sqlalchemy import text, select, delete, tuple_, bindparam
+from sqlalchemy.exc import OperationalError, DBAPIError
+
+from .models import Pengaduan, Upload, User
+from .stats import apply_deltas
+from .media import remove_unused, CONTENT_NAME
+from .config import RETENTION_BATCH_SIZE, RETENTION_BATCH_PAUSE, PARTITION_MONTHS_AHEAD
+
+LEGACY_PARTITION = 'pengaduan_legacy'
+PARTITION_NAME = re.compile(r'^pengaduan_(legacy|\d{4}_\d{2})$')
+UPPER_BOUND = re.compile(r"TO \('([^']+)'\)")
+RELEASE_CHUNK = 1000
+MAX_LOCK_FAILURES = 5
+
+def add_months(value, months):
+    month = value.month - 1 + months
+    return datetime(value.year + month // 12, month % 12 + 1, 1)
+
+def partition_name(month):
+    return f"pengaduan_{month:%Y_%m}"
+
+def is_partitioned(connection):
+    if connection.dialect.name != 'postgresql':
+        return False
+    return connection.execute(text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass('pengaduan')")).first() is not None
+
+def partitions(connection):
+    """Attached partitions as (name, bound expression, upper bound or None)"""
+    rows = connection.execute(text("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass('pengaduan')
+    """))
+    result = []
+    for name, bound in rows:
+        match = UPPER_BOUND.search(bound)
+        result.append((name, bound, datetime.fromisoformat(match.group(1)) if match else None))
+    return result
+
+def ensure_partitions(connection, months_ahead=PARTITION_MONTHS_AHEAD, now=None):
+    """Create monthly partitions up to months_ahead past the current month; returns their names.
+
+    There is no default partition (it would rule out DETACH CONCURRENTLY), so
+    this must run at least every few months, e.g. from the retention cron.
+    """
+    upper_bounds = [upper for _, _, upper in partitions(connection) if upper is not None]
+    month = max([add_months(now or datetime.utcnow(), 0)] + upper_bounds)
+    last = add_months(now or datetime.utcnow(), months_ahead + 1)
+    created = []
+    connection.execute(text("SET LOCAL lock_timeout = '5s'"))
+    while month < last:
+        name, upper = partition_name(month), add_months(month, 1)
+        connection.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF pengaduan "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{upper:%Y-%m-%d}')"))
+        created.append(name)
+        month = upper
+    return created
+
+def _still_referenced(connection, names):
+    """Names among names that a complaint or profile still points at"""
+    complaint, user = Pengaduan.__table__, User.__table__
+    return {name for (name,) in connection.execute(
+        select(complaint.c.file_upload).where(complaint.c.file_upload.in_(names))
+        .union(select(user.c.profile_pic).where(user.c.profile_pic.in_(names))))}
+
+def release_uploads(connection, references):
+    """Drop upload references ({filename: count}); returns filenames no longer used"""
+    upload = Upload.__table__
+    unused = []
+    names = list(references)
+    for start in range(0, len(names), RELEASE_CHUNK):
+        chunk = names[start:start + RELEASE_CHUNK]
+        tracked = {name for (name,) in connection.execute(select(upload.c.filename).where(upload.c.filename.in_(chunk)))}
+        if tracked:
+            connection.execute(
+                upload.update().where(upload.c.filename == bindparam('b_filename'))
+                .values(ref_count=upload.c.ref_count - bindparam('b_refs')),
+                [{'b_filename': name, 'b_refs': references[name]} for name in tracked])
+            unused += [name for (name,) in connection.execute(
+                delete(upload).where(upload.c.filename.in_(tracked), upload.c.ref_count <= 0)
+                .returning(upload.c.filename))]
+        # Nama lama (secure_filename dari klien, tanpa baris upload) bisa dipakai bersama
+        # oleh pengaduan lain atau foto profil: hapus hanya bila tak ada lagi yang merujuknya.
+        # Dipanggil setelah baris dihapus, dalam transaksi yang sama.
+        legacy = [name for name in chunk if name not in tracked and not CONTENT_NAME.match(name)]
+        if legacy:
+            referenced = _still_referenced(connection, legacy)
+            unused += [name for name in legacy if name not in referenced]
+    return unused
+
+def remove_files(engine, folder, filenames):
+    """Delete files released by a committed transaction, unless an upload took them again"""
+    for filename in filenames:
+        with engine.begin() as connection:
+            remove_unused(connection, folder, filename)
+
+def _subtract_stats(connection, rows):
+    counts = Counter((region or '', status or '', category or '') for region, status, category, _ in rows)
+    apply_deltas(connection, Counter({key: -count for key, count in counts.items()}))
+
+def _forget_rows(connection, rows):
+    """Subtract removed (region, status, category, file_upload) rows from stats and uploads"""
+    _subtract_stats(connection, rows)
+    return release_uploads(connection, Counter(filename for _, _, _, filename in rows if filename))
+
+def delete_expired_rows(engine, cutoff, folder, batch_size=RETENTION_BATCH_SIZE, pause=RETENTION_BATCH_PAUSE):
+    """Delete processed complaints created before cutoff in small batches; returns the row count"""
+    table = Pengaduan.__table__
+    deleted, failures = 0, 0
+    while True:
+        try:
+            with engine.begin() as connection:
+                if connection.dialect.name == 'postgresql':
+                    connection.execute(text("SET LOCAL lock_timeout = '2s'"))
+                    connection.execute(text("SET LOCAL statement_timeout = '30s'"))
+                # Baris yang sedang dikunci request dilewati, diambil di run berikutnya
+                batch = (select(table.c.id, table.c.created_at)
+                         .where(table.c.created_at < cutoff, table.c.status == 'processed')
+                         .order_by(table.c.created_at, table.c.id).limit(batch_size)
+                         .with_for_update(skip_locked=True))
+                rows = connection.execute(
+                    delete(table).where(tuple_(table.c.id, table.c.created_at).in_(batch))
+                    .returning(table.c.region, table.c.status, table.c.category, table.c.file_upload)).all()
+                unused = _forget_rows(connection, rows)
+        except OperationalError as e:
+            failures += 1
+            if failures >= MAX_LOCK_FAILURES:
+                print(f"⚠️ Retensi dihentikan setelah {failures} kali gagal: {e}")
+                break
+            time.sleep(pause * 10)
+            continue
+        remove_files(engine, folder, unused)
+        deleted += len(rows)
+        if len(rows) < batch_size:
+            break
+        time.sleep(pause)
+    return deleted
+
+def _has_unprocessed(connection, name):
+    return connection.execute(text(
+        f"SELECT EXISTS (SELECT 1 FROM {name} WHERE status IS DISTINCT FROM 'processed')")).scalar()
+
+def _detach(engine, name):
+    with engine.connect() as connection:
+        if connection.dialect.server_version_info >= (14,):
+            # CONCURRENTLY tidak boleh di dalam transaksi; DML pada pengaduan tetap jalan
+            connection = connection.execution_options(isolation_level='AUTOCOMMIT')
+            try:
+                connection.execute(text(f"ALTER TABLE pengaduan DETACH PARTITION {name} CONCURRENTLY"))
+            except DBAPIError as e:
+                # Detach sebelumnya terputus di tengah jalan
+                if 'FINALIZE' not in str(e):
+                    raise
+                connection.execute(text(f"ALTER TABLE pengaduan DETACH PARTITION {name} FINALIZE"))
+        else:
+            with connection.begin():
+                connection.execute(text("SET LOCAL lock_timeout = '2s'"))
+                connection.execute(text(f"ALTER TABLE pengaduan DETACH PARTITION {name}"))
+
+def _retire(engine, name, archive, bound=None):
+    """Account for and drop (or archive) a detached partition; returns unused files, None if kept.
+
+    bound is the partition's "FOR VALUES ..." clause, used to reattach it.
+    """
+    with engine.begin() as connection:
+        connection.execute(text(f"LOCK TABLE {name} IN ACCESS EXCLUSIVE MODE"))
+        if _has_unprocessed(connection, name):
+            # Status berubah di antara pemeriksaan dan detach: pasang kembali
+            if bound is not None:
+                connection.execute(text(f"ALTER TABLE pengaduan ATTACH PARTITION {name} {bound}"))
+            else:
+                print(f"⚠️ {name} terlepas tetapi masih berisi pengaduan yang belum diproses")
+            return None
+        rows = connection.execute(text(
+            f"SELECT region, status, category, file_upload FROM {name}")).all()
+        if archive:
+            # Baris arsip tetap mereferensikan file lampirannya
+            _subtract_stats(connection, rows)
+            connection.execute(text(f"ALTER TABLE {name} RENAME TO {name.replace('pengaduan_', 'pengaduan_archive_', 1)}"))
+            return []
+        unused = _forget_rows(connection, rows)
+        connection.execute(text(f"DROP TABLE {name}"))
+        return unused
+
+def _detached_leftovers(connection):
+    """Partitions detached by an interrupted run but not yet dropped"""
+    return [name for (name,) in connection.execute(text("""
+        SELECT c.relname FROM pg_class c
+        WHERE c.relkind = 'r' AND c.relname ~ '^pengaduan_(legacy|[0-9]{4}_[0-9]{2})$'
+          AND NOT c.relispartition
+    """))]
+
+def drop_expired_partitions(engine, cutoff, folder, archive=False):
+    """Retire every partition entirely before cutoff and fully processed; returns their names"""
+    with engine.connect() as connection:
+        if not is_partitioned(connection):
+            return []
+        candidates = [(name, bound) for name, bound, upper in partitions(connection)
+                      if upper is not None and upper <= cutoff and PARTITION_NAME.match(name)]
+        leftovers = _detached_leftovers(connection)
+
+    retired = []
+    for name in leftovers:
+        unused = _retire(engine, name, archive)
+        if unused is not None:
+            retired.append(name)
+            remove_files(engine, folder, unused)
+    for name, bound in candidates:
+        with engine.connect() as connection:
+            if _has_unprocessed(connection, name):
+                continue  # baris processed di dalamnya ditangani delete_expired_rows
+        _detach(engine, name)
+        unused = _retire(engine, name, archive, bound)
+        if unused is not None:
+            retired.append(name)
+            remove_files(engine, folder, unused)
+    return retired
+
+def run_retention(engine, folder, days, archive=False):
+    """Apply retention: whole partitions first, then the remaining rows in batches"""
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    created = []
+    with engine.begin() as connection:
+        if is_partitioned(connection):
+            created = ensure_partitions(connection)
+    retired = drop_expired_partitions(engine, cutoff, folder, archive)
+    deleted = delete_expired_rows(engine, cutoff, folder)
+    return {'partitions_created': created, 'partitions_retired': retired, 'rows_deleted': deleted}
@@ -1,21 +1,40 @@
 from flask import request, render_template, redirect, url_for, jsonify, session, flash
 from werkzeug.security import generate_password_hash, check_password_hash
-from .models import db, User, Pengaduan
-from .rag_core import initialize_rag_system
+from .models import db, User, Pengaduan, PengaduanStats, UserStats
+from . import stats  # memasang listener sesi yang menjaga tabel statistik
+from .pagination import keyset_page, page_size
 from datetime import datetime
 import os
 from flask import request, render_template, redirect, url_for, jsonify, session, flash, send_from_directory
 from werkzeug.security import generate_password_hash, check_password_hash
-from .rag_core import *
+from . import warmup  # rag_core (faiss, fitz, genai, langchain) dimuat di thread warm-up
 import traceback
 from datetime import datetime
-from flask import make_response
+from flask import make_response, Response, stream_with_context
 from werkzeug.utils import secure_filename
-from flask_caching import Cache
+from .app_cache import cache
+from .semantic_cache import SemanticCache
+from .prompt_builder import build_prompt, prompt_stats
+from .metrics import REGISTRY, span, instrument_app
+from .media import MediaProcessor, UploadTooLarge, stage_upload
+from .export import EXPORT_FORMATS, FILTER_COLUMNS, export_query, parse_date, stream_export
+from .ingest import BatchError, ingest, parse_batch
+from .search import search_complaints, DEFAULT_LIMIT as SEARCH_DEFAULT_LIMIT
+from sqlalchemy.exc import IntegrityError
+from .config import (
+    SEMANTIC_CACHE_ENABLED, SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_TTL,
+    SEMANTIC_CACHE_CAPACITY, SEMANTIC_CACHE_HISTORY_TURNS, METRICS_TOKEN, UPLOAD_MAX_BYTES,
+    INGEST_MAX_ITEMS, INGEST_MAX_BYTES,
+)
 import hashlib
+import json
+import time
+from sqlalchemy import func
+
+DASHBOARD_CACHE_TIMEOUT = 60
 
 # --- Konfigurasi Folder Upload ---
-UPLOAD_FOLDER = 'D:/ProjectGemastik/AgroLLM/uploads'  # folder uploads di root, bukan di static/
+from .config import UPLOAD_FOLDER  # folder uploads di root, bukan di static/
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
 # --- Fungsi untuk memeriksa apakah file yang diupload diperbolehkan ---
@@ -27,8 +46,82 @@ if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
 
 def register_routes(app):
-    # Initialize cache
-    cache = Cache(app)
+    # Cache bersama dari app_cache.py; di-init di sini bila app belum melakukannya (mis. benchmark_rag.py)
+    if cache not in app.extensions.get('cache', {}):
+        cache.init_app(app)
+    semantic_cache = SemanticCache(
+        threshold=SEMANTIC_CACHE_THRESHOLD,
+        ttl=SEMANTIC_CACHE_TTL,
+        capacity=SEMANTIC_CACHE_CAPACITY,
+        history_turns=SEMANTIC_CACHE_HISTORY_TURNS,
+    ) if SEMANTIC_CACHE_ENABLED else None
+
+    instrument_app(app)
+    # Tolak body yang jelas terlalu besar sebelum dibaca; sisa ruang untuk field form
+    app.config.setdefault('MAX_CONTENT_LENGTH', UPLOAD_MAX_BYTES + 1024 * 1024)
+    media = MediaProcessor(UPLOAD_FOLDER)
+    chat_cache_lookups = REGISTRY.counter('agrollm_chat_cache_total', "/chat answers by cache outcome",
+                                          labelnames=('result',))
+    upload_bytes = REGISTRY.counter('agrollm_upload_bytes_total', "Bytes of uploaded files", labelnames=('kind',))
+    export_rows = REGISTRY.counter('agrollm_export_rows_total', "Complaint rows exported", labelnames=('format',))
+    @app.before_request
+    def _start_warmup():
+        # Worker hasil fork (gunicorn --preload) memulai warm-up sendiri; no-op setelah siap
+        warmup.start(app)
+
+    if semantic_cache is not None:
+        REGISTRY.register('agrollm_semantic_cache_entries', "Answers held by the semantic cache",
+                          lambda: semantic_cache.stats()['entries'], kind='gauge')
+
+    def _dashboard_cache_key(region):
+        return f"admin_dashboard:{region}"
+
+    def _invalidate_region(region):
+        """Drop cached dashboard data after a write that touches region"""
+        cache.delete(_dashboard_cache_key(region))
+        cache.delete('superadmin_monitoring')
+
+    def _complaint_row(complaint):
+        # Dict kolom, bukan instance ORM: aman di-pickle ke cache dan dipakai template
+        return {column.name: getattr(complaint, column.name) for column in Pengaduan.__table__.columns}
+
+    def _complaints_page(query, cursor=None, per_page=10):
+        """Keyset page of a filtered Pengaduan query; a bad cursor falls back to page one"""
+        try:
+            return keyset_page(query, Pengaduan, cursor, per_page)
+        except ValueError:
+            return keyset_page(query, Pengaduan, None, per_page)
+
+    def _region_dashboard_data(region):
+        """First page of complaints and per-status counts of one region, in two small queries"""
+        page = _complaints_page(Pengaduan.query.filter_by(region=region))
+        # SUM di PostgreSQL mengembalikan numeric (Decimal)
+        status_counts = {status: int(count) for status, count in
+                         db.session.query(PengaduanStats.status, func.sum(PengaduanStats.count))
+                         .filter(PengaduanStats.region == region)
+                         .group_by(PengaduanStats.status)}
+        return {
+            'complaints': [_complaint_row(c) for c in page.items],
+            'next_cursor': page.next_cursor,
+            'total_complaints': sum(status_counts.values()),
+            'pending_complaints': status_counts.get('pending', 0),
+            'processed_complaints': status_counts.get('processed', 0),
+        }
+
+    def _store_image(kind, file):
+        """Save an uploaded image and reference it; returns (filename, upload to process).
+
+        The upload is None when identical content was already stored. Resizing
+        is queued by _process_upload once the caller has committed.
+        """
+        filename, size, tmp_path = stage_upload(file, UPLOAD_FOLDER, file.filename.rsplit('.', 1)[1].lower())
+        upload_bytes.labels(kind=kind).inc(size)
+        upload, created = media.acquire(filename, kind, size, tmp_path)
+        return filename, upload if created else None
+
+    def _process_upload(upload):
+        if upload is not None:
+            media.submit(app, upload.id)
 
     @app.route('/')
     def home():
@@ -92,7 +185,6 @@ def register_routes(app):
         return redirect(url_for('login'))
 
     @app.route('/admin/dashboard')
-    @cache.cached(timeout=60)  # Cache for 1 minute
     def admin_dashboard():
         if not session.get('is_admin'):
             return redirect(url_for('login'))
@@ -103,42 +195,48 @@ def register_routes(app):
 
         # Ambil data wilayah admin Pemda yang login
         admin_region = session.get('admin_region')
-        
-        # Optimize database queries with eager loading
-        complaints = Pengaduan.query.filter_by(region=admin_region).order_by(Pengaduan.created_at.desc()).limit(10).all()
-        
-        # Get counts efficiently
-        total_complaints = Pengaduan.query.filter_by(region=admin_region).count()
-        pending_complaints = Pengaduan.query.filter_by(region=admin_region, status='pending').count()
-        processed_complaints = Pengaduan.query.filter_by(region=admin_region, status='processed').count()
-        
-        return render_template('admin_dashboard.html', 
-                             complaints=complaints,
-                             total_complaints=total_complaints,
-                             pending_complaints=pending_complaints,
-                             processed_complaints=processed_complaints)
+
+        # Cache per wilayah; dihapus saat pengaduan di wilayah ini berubah
+        cache_key = _dashboard_cache_key(admin_region)
+        data = cache.get(cache_key)
+        if data is None:
+            data = _region_dashboard_data(admin_region)
+            cache.set(cache_key, data, timeout=DASHBOARD_CACHE_TIMEOUT)
+
+        # Halaman berikutnya tidak di-cache; biayanya sama dengan halaman pertama
+        cursor = request.args.get('cursor')
+        if cursor:
+            page = _complaints_page(Pengaduan.query.filter_by(region=admin_region), cursor)
+            data = dict(data, complaints=[_complaint_row(c) for c in page.items], next_cursor=page.next_cursor)
+
+        return render_template('admin_dashboard.html', **data)
 
     @app.route('/superadmin/monitoring')
-    @cache.cached(timeout=60)  # Cache for 1 minute
+    # Tanpa 'unless', redirect untuk pengguna non-superadmin ikut ter-cache
+    @cache.cached(timeout=DASHBOARD_CACHE_TIMEOUT, key_prefix='superadmin_monitoring',
+                  unless=lambda: session.get('user_role') != 'superadmin' or 'cursor' in request.args)
     def superadmin_monitoring():
         if not session.get('is_admin') or session.get('user_role') != 'superadmin':
             return redirect(url_for('login'))
 
         # Optimize database queries
-        complaints = Pengaduan.query.order_by(Pengaduan.created_at.desc()).limit(20).all()
+        page = _complaints_page(Pengaduan.query, request.args.get('cursor'), per_page=20)
         
-        # Get statistics efficiently
-        total_complaints = Pengaduan.query.count()
-        pending_complaints = Pengaduan.query.filter_by(status='pending').count()
-        processed_complaints = Pengaduan.query.filter_by(status='processed').count()
-        
-        # Get user statistics
-        total_users = User.query.count()
-        total_petani = User.query.filter_by(role='petani').count()
-        total_admin = User.query.filter_by(role='admin').count()
+        # Statistik dari tabel counter: jumlah baris tidak bergantung pada ukuran tabel
+        status_counts = {status: int(count) for status, count in
+                         db.session.query(PengaduanStats.status, func.sum(PengaduanStats.count))
+                         .group_by(PengaduanStats.status)}
+        role_counts = dict(db.session.query(UserStats.role, UserStats.count).all())
+        total_complaints = sum(status_counts.values())
+        pending_complaints = status_counts.get('pending', 0)
+        processed_complaints = status_counts.get('processed', 0)
+        total_users = sum(role_counts.values())
+        total_petani = role_counts.get('petani', 0)
+        total_admin = role_counts.get('admin', 0)
         
         return render_template('superadmin_monitoring.html',
-                             complaints=complaints,
+                             complaints=page.items,
+                             next_cursor=page.next_cursor,
                              total_complaints=total_complaints,
                              pending_complaints=pending_complaints,
                              processed_complaints=processed_complaints,
@@ -184,8 +282,7 @@ def register_routes(app):
         db.session.commit()
         
         # Clear cache for dashboard
-        cache.delete_memoized(admin_dashboard)
-        cache.delete_memoized(superadmin_monitoring)
+        _invalidate_region(complaint.region)
         
         flash('Status pengaduan berhasil diperbarui.', 'success')
         return redirect(url_for('admin_dashboard'))
@@ -200,15 +297,15 @@ def register_routes(app):
             data = request.form
             
             # Handle file upload more efficiently
-            file_upload = None
+            file_upload, upload = None, None
             if 'file_upload' in request.files:
                 file = request.files['file_upload']
                 if file and allowed_file(file.filename):
-                    # Store file path instead of binary data for better performance
-                    filename = secure_filename(file.filename)
-                    file_path = os.path.join(UPLOAD_FOLDER, filename)
-                    file.save(file_path)
-                    file_upload = filename  # Store filename instead of binary data
+                    try:
+                        file_upload, upload = _store_image('complaint', file)
+                    except UploadTooLarge:
+                        flash(f'Ukuran file maksimal {UPLOAD_MAX_BYTES // (1024 * 1024)} MB.', 'error')
+                        return redirect(url_for('form_pengaduan'))
             
             complaint = Pengaduan(
                 user_id=user.id,
@@ -230,6 +327,8 @@ def register_routes(app):
             
             db.session.add(complaint)
             db.session.commit()
+            _process_upload(upload)
+            _invalidate_region(complaint.region)
             
             flash('Pengaduan berhasil dikirim.', 'success')
             return redirect(url_for('riwayat_pengaduan'))
@@ -241,98 +340,366 @@ def register_routes(app):
         if 'user_id' not in session:
             return redirect(url_for('login'))
         
-        # Optimize query with pagination
-        page = request.args.get('page', 1, type=int)
-        per_page = 10
-        
-        complaints = Pengaduan.query.filter_by(user_id=session['user_id'])\
-                                   .order_by(Pengaduan.created_at.desc())\
-                                   .paginate(page=page, per_page=per_page, error_out=False)
+        # Keyset pagination lewat idx_pengaduan_user_created, tanpa OFFSET dan COUNT
+        page = _complaints_page(Pengaduan.query.filter_by(user_id=session['user_id']),
+                                request.args.get('cursor'))
         
-        return render_template('riwayat_pengaduan.html', complaints=complaints)
+        return render_template('riwayat_pengaduan.html', complaints=page.items, next_cursor=page.next_cursor)
+
+    def _complaint_json(complaint):
+        return _complaint_json_row(_complaint_row(complaint))
+
+    def _complaint_json_row(row):
+        return {name: value.isoformat() if hasattr(value, 'isoformat') else value for name, value in row.items()}
+
+    @app.route('/api/pengaduan')
+    def api_pengaduan():
+        """Complaints visible to the session user, newest first, one keyset page per call"""
+        if session.get('is_admin') and session.get('user_role') == 'superadmin':
+            query = Pengaduan.query
+            if request.args.get('region'):
+                query = query.filter_by(region=request.args['region'])
+        elif session.get('is_admin'):
+            query = Pengaduan.query.filter_by(region=session.get('admin_region'))
+        elif 'user_id' in session:
+            query = Pengaduan.query.filter_by(user_id=session['user_id'])
+        else:
+            return jsonify({'error': 'Silakan login terlebih dahulu.'}), 401
+
+        try:
+            page = keyset_page(query, Pengaduan, request.args.get('cursor'), page_size(request.args.get('limit')))
+        except ValueError:
+            return jsonify({'error': 'Cursor tidak valid.'}), 400
+        return jsonify({'items': [_complaint_json(c) for c in page.items], 'next_cursor': page.next_cursor})
+
+    def _search(args):
+        """Run a search scoped like /api/pengaduan; returns None when not logged in"""
+        filters = {name: args[name] for name in FILTER_COLUMNS if args.get(name)}
+        if session.get('is_admin') and session.get('user_role') == 'superadmin':
+            pass
+        elif session.get('is_admin'):
+            filters['region'] = session.get('admin_region')
+        elif 'user_id' in session:
+            filters['user_id'] = session['user_id']
+        else:
+            return None
+        return search_complaints(args.get('q', ''), filters, page_size(args.get('limit'), SEARCH_DEFAULT_LIMIT))
+
+    @app.route('/api/pengaduan/search')
+    def api_search_pengaduan():
+        """Ranked full-text search over complaint descriptions with highlighted snippets"""
+        if not request.args.get('q', '').strip():
+            return jsonify({'error': 'Parameter q wajib diisi.'}), 400
+        results = _search(request.args)
+        if results is None:
+            return jsonify({'error': 'Silakan login terlebih dahulu.'}), 401
+        return jsonify({'items': [_complaint_json_row(row) for row in results]})
+
+    @app.route('/admin/search')
+    def admin_search():
+        if not session.get('is_admin'):
+            return redirect(url_for('login'))
+        query = request.args.get('q', '').strip()
+        results = _search(request.args) if query else []
+        return render_template('admin_search.html', q=query, results=results)
+
+    @app.route('/api/pengaduan/batch', methods=['POST'])
+    def ingest_pengaduan():
+        """Sync many complaints in one request; see routes/ingest.py for the format"""
+        if 'user_id' not in session:
+            return jsonify({'error': 'Silakan login terlebih dahulu.'}), 401
+        # Batch berisi banyak lampiran: batas body khusus untuk endpoint ini
+        request.max_content_length = INGEST_MAX_BYTES
+        request.max_form_memory_size = INGEST_MAX_ITEMS * 16 * 1024
+
+        try:
+            if request.mimetype == 'multipart/form-data':
+                items = parse_batch(request.form.get('items', ''), INGEST_MAX_ITEMS)
+            else:
+                items = parse_batch(request.get_data(as_text=True), INGEST_MAX_ITEMS)
+        except BatchError as e:
+            return jsonify({'error': str(e)}), 400
+
+        new_uploads, stored = [], {}
+
+        def store_attachment(file):
+            # Satu lampiran bisa dipakai beberapa item: simpan sekali, tambah referensi
+            if file.name in stored:
+                media.retain(stored[file.name])
+                return stored[file.name]
+            if not allowed_file(file.filename):
+                raise ValueError(f"Jenis file '{file.filename}' tidak diizinkan.")
+            try:
+                filename, upload = _store_image('complaint', file)
+            except UploadTooLarge:
+                raise ValueError(f"Ukuran file maksimal {UPLOAD_MAX_BYTES // (1024 * 1024)} MB.")
+            new_uploads.append(upload)
+            stored[file.name] = filename
+            return filename
+
+        def discard_batch():
+            """Roll back and delete the files this batch placed that no row references"""
+            db.session.rollback()
+            # File yang baru ditaruh batch ini kehilangan barisnya: hapus; file lama tetap
+            for filename in stored.values():
+                try:
+                    media.collect(filename)
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"⚠️ Gagal membersihkan lampiran {filename}: {e}")
+
+        try:
+            results, regions = ingest(session['user_id'], items, request.files, store_attachment)
+            db.session.commit()
+        except IntegrityError:
+            # Kunci yang sama sedang disinkronkan oleh request lain
+            discard_batch()
+            return jsonify({'error': 'Batch sedang diproses, silakan ulangi.'}), 409
+        except Exception:
+            # Timeout, koneksi putus, atau gagal menyimpan lampiran di tengah batch
+            discard_batch()
+            raise
+
+        for upload in new_uploads:
+            _process_upload(upload)
+        for region in regions:
+            _invalidate_region(region)
+        return jsonify({
+            'results': results,
+            'created': sum(result['status'] == 'created' for result in results),
+            'duplicate': sum(result['status'] == 'duplicate' for result in results),
+            'invalid': sum(result['status'] == 'invalid' for result in results),
+        })
+
+    @app.route('/admin/export')
+    def export_pengaduan():
+        """Stream complaints as CSV or NDJSON, filtered by region, status, category and date"""
+        if not session.get('is_admin'):
+            return redirect(url_for('login'))
+
+        fmt = request.args.get('format', 'csv')
+        if fmt not in EXPORT_FORMATS:
+            return jsonify({'error': 'Format harus csv atau ndjson.'}), 400
+        filters = {name: request.args[name] for name in FILTER_COLUMNS if request.args.get(name)}
+        # Admin Pemda hanya boleh mengekspor wilayahnya sendiri
+        if session.get('user_role') != 'superadmin':
+            filters['region'] = session.get('admin_region')
+        try:
+            date_from, date_to = parse_date(request.args.get('from')), parse_date(request.args.get('to'))
+        except ValueError:
+            return jsonify({'error': 'Tanggal harus berformat YYYY-MM-DD.'}), 400
+
+        compress = 'gzip' in request.headers.get('Accept-Encoding', '')
+        counter = export_rows.labels(format=fmt)
+        body = stream_export(export_query(filters, date_from, date_to), fmt, compress, on_rows=counter.inc)
+        filename = f"pengaduan_{filters.get('region', 'semua')}_{datetime.now():%Y%m%d}.{fmt}"
+        response = Response(stream_with_context(body), mimetype=EXPORT_FORMATS[fmt])
+        response.headers['Content-Disposition'] = f'attachment; filename="{secure_filename(filename)}"'
+        response.headers['Vary'] = 'Accept-Encoding'
+        response.headers['X-Accel-Buffering'] = 'no'
+        if compress:
+            response.headers['Content-Encoding'] = 'gzip'
+        return response
+
+    def _chat_cache_key(user_question, history):
+        return hashlib.md5(f"{user_question}_{str(history)}".encode()).hexdigest()
+
+    def _semantic_lookup(cache_key, query_embedding, history):
+        """Reuse the answer of a near-duplicate question, if any"""
+        if semantic_cache is None or query_embedding is None:
+            return None
+        from .rag_core import chat_stage_seconds
+        with span(chat_stage_seconds, stage='semantic_cache'):
+            result = semantic_cache.lookup(query_embedding, history)
+        if result is not None:
+            chat_cache_lookups.labels(result='semantic_hit').inc()
+            cache.set(cache_key, result, timeout=300)
+        return result
+
+    def _cache_answer(cache_key, query_embedding, history, result):
+        # Cache the response for 5 minutes
+        cache.set(cache_key, result, timeout=300)
+        if semantic_cache is not None and query_embedding is not None:
+            semantic_cache.store(query_embedding, history, result)
+
+    def _not_ready():
+        """Immediate answer while the RAG system is loading, or after loading failed"""
+        if warmup.has_failed():
+            # Tidak ada gunanya langsung mencoba lagi: indeks belum dibangun atau gagal dimuat
+            return jsonify({'reply': "Sistem belum siap digunakan. Silakan coba lagi nanti."})
+        response = jsonify({'reply': "Asisten sedang disiapkan. Silakan coba lagi dalam beberapa detik.",
+                            'warming_up': True})
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+        return response
+
+    @app.route('/healthz')
+    def healthz():
+        """Liveness: the process serves requests (no database or RAG check)"""
+        return jsonify({'status': 'ok'})
+
+    @app.route('/readyz')
+    def readyz():
+        """Readiness: 200 once the RAG index is loaded, 503 while warming up or after a failure"""
+        state = warmup.status()
+        return jsonify(state), 200 if state['status'] == 'ready' else 503
 
     @app.route('/chat', methods=['POST'])
     def chat():
-        if not hasattr(thread_local, 'faiss_index'):
-            initialize_rag_system()
-            if not hasattr(thread_local, 'faiss_index'):
-                return jsonify({'reply': "Sistem belum siap digunakan. Silakan coba lagi nanti."})
+        rag = warmup.rag_system()
+        if rag is None:
+            return _not_ready()
+        from .rag_core import retrieve, context_from_ids, chat_stage_seconds
 
         try:
             data = request.get_json()
             user_question = data['message']
             history = data.get('history', [])
             
-            # Create cache key for this query
-            cache_key = hashlib.md5(f"{user_question}_{str(history)}".encode()).hexdigest()
-            
             # Check cache first
-            cached_response = cache.get(cache_key)
+            cache_key = _chat_cache_key(user_question, history)
+            with span(chat_stage_seconds, stage='cache_lookup'):
+                cached_response = cache.get(cache_key)
             if cached_response:
+                chat_cache_lookups.labels(result='exact_hit').inc()
                 return jsonify(cached_response)
             
-            query_embedding = get_query_embedding(user_question)
-
-            if query_embedding is None:
+            query_embedding, chunk_ids = retrieve(rag, user_question)
+            if not chunk_ids:
                 return jsonify({'reply': "Sistem belum siap digunakan. Silakan coba lagi nanti."})
 
-            faiss_index = thread_local.faiss_index
-            doc_chunks = thread_local.doc_chunks
-            model_gen = thread_local.model_gen
-
-            distances, indices = faiss_index.search(np.array([query_embedding]).astype('float32'), 5)
-            context_chunks, unique_sources = [], {}
-
-            for i in indices[0]:
-                if i != -1:
-                    chunk = doc_chunks[i]
-                    context_chunks.append(chunk.page_content)
-                    title = chunk.metadata['title']
-                    filename = chunk.metadata['filename']
-                    unique_sources[title] = filename
-
-            context = "\n\n---\n\n".join(context_chunks)
-            chat_history = "".join([f"Petani: {turn['user']}\nAsisten: {turn['bot']}\n\n" for turn in history])
-
-            prompt = f"""
-            ## PERAN DAN TUJUAN
-            Anda adalah "Penyuluh Pertanian Digital," seorang asisten AI ahli. Jawab pertanyaan petani berdasarkan konteks yang diberikan dengan bahasa yang jelas dan praktis.
-
-            ## ATURAN
-            - Jawaban HARUS 100% berdasarkan pada "KONTEKS".
-            - Jangan menyebutkan "berdasarkan konteks". Langsung saja berikan jawabannya.
-            - Jika informasi tidak ada, katakan "Maaf, informasi tersebut tidak ditemukan dalam dokumen saya."
-
-            ---
-            ## RIWAYAT PERCAKAPAN
-            {chat_history}
-            ---
-            ## KONTEKS DARI DOKUMEN PENELITIAN
-            {context}
-            ---
-            ## PERTANYAAN TERBARU DARI PETANI
-            {user_question}
-            ---
-            ## JAWABAN PRAKTIS
-            """
-
-            response = model_gen.generate_content(prompt)
-            result = {'reply': response.text, 'sources': [{"title": k, "filename": v} for k, v in unique_sources.items()]}
-            
-            # Cache the response for 5 minutes
-            cache.set(cache_key, result, timeout=300)
+            similar_response = _semantic_lookup(cache_key, query_embedding, history)
+            if similar_response:
+                return jsonify(similar_response)
+            chat_cache_lookups.labels(result='miss').inc()
+
+            with span(chat_stage_seconds, stage='context'):
+                context_chunks, sources = context_from_ids(rag, chunk_ids)
+            with span(chat_stage_seconds, stage='prompt_build'):
+                prompt, _ = build_prompt(user_question, history, context_chunks)
+            with span(chat_stage_seconds, stage='generate'):
+                response = rag.model_gen.generate_content(prompt)
+            result = {'reply': response.text, 'sources': sources}
+            _cache_answer(cache_key, query_embedding, history, result)
             
             return jsonify(result)
         except Exception:
             print(traceback.format_exc())
             return jsonify({'reply': "Terjadi error di server. Silakan coba lagi."}), 500
 
+    def _sse(event, data):
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+    @app.route('/chat/stream', methods=['POST'])
+    def chat_stream():
+        """Server-Sent Events variant of /chat: sources first, then answer tokens as they arrive"""
+        rag = warmup.rag_system()
+        if rag is None:
+            return _not_ready()
+        from .rag_core import retrieve, context_from_ids, cancel_generation, chat_stage_seconds
+
+        try:
+            data = request.get_json()
+            user_question = data['message']
+            history = data.get('history', [])
+
+            cache_key = _chat_cache_key(user_question, history)
+            with span(chat_stage_seconds, stage='cache_lookup'):
+                cached_response = cache.get(cache_key)
+            if cached_response:
+                chat_cache_lookups.labels(result='exact_hit').inc()
+            else:
+                query_embedding, chunk_ids = retrieve(rag, user_question)
+                if not chunk_ids:
+                    return jsonify({'reply': "Sistem belum siap digunakan. Silakan coba lagi nanti."})
+                cached_response = _semantic_lookup(cache_key, query_embedding, history)
+            if not cached_response:
+                chat_cache_lookups.labels(result='miss').inc()
+                with span(chat_stage_seconds, stage='context'):
+                    context_chunks, sources = context_from_ids(rag, chunk_ids)
+                with span(chat_stage_seconds, stage='prompt_build'):
+                    prompt, _ = build_prompt(user_question, history, context_chunks)
+        except Exception:
+            print(traceback.format_exc())
+            return jsonify({'reply': "Terjadi error di server. Silakan coba lagi."}), 500
+
+        def generate():
+            if cached_response:
+                yield _sse('sources', cached_response['sources'])
+                yield _sse('token', {'text': cached_response['reply']})
+                yield _sse('done', {})
+                return
+
+            yield _sse('sources', sources)
+            response, parts, completed = None, [], False
+            started = time.perf_counter()
+            try:
+                response = rag.model_gen.generate_content(prompt, stream=True)
+                for chunk in response:
+                    try:
+                        text = chunk.text
+                    except ValueError:
+                        # Chunk tanpa teks (mis. hanya metadata keamanan)
+                        continue
+                    if text:
+                        if not parts:
+                            chat_stage_seconds.labels(stage='first_token').observe(time.perf_counter() - started)
+                        parts.append(text)
+                        yield _sse('token', {'text': text})
+                completed = True
+                chat_stage_seconds.labels(stage='generate').observe(time.perf_counter() - started)
+            except Exception:
+                print(traceback.format_exc())
+                yield _sse('error', {'reply': "Terjadi error di server. Silakan coba lagi."})
+                return
+            finally:
+                # Klien terputus (GeneratorExit) atau error: hentikan generasi di sisi model
+                if not completed and response is not None:
+                    cancel_generation(response)
+
+            result = {'reply': "".join(parts), 'sources': sources}
+            _cache_answer(cache_key, query_embedding, history, result)
+            yield _sse('done', {})
+
+        return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    @app.route('/metrics')
+    def metrics():
+        """Prometheus text exposition of this worker's metrics; disabled unless METRICS_TOKEN is set"""
+        if not METRICS_TOKEN:
+            # Aplikasi publik: jangan buka latensi dan penghitung internal tanpa konfigurasi
+            return Response("Not Found\n", status=404, mimetype='text/plain')
+        if request.headers.get('Authorization') != f"Bearer {METRICS_TOKEN}":
+            return Response("Unauthorized\n", status=401, mimetype='text/plain')
+        return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+    @app.route('/superadmin/rag-stats')
+    def rag_stats():
+        if not session.get('is_admin') or session.get('user_role') != 'superadmin':
+            return redirect(url_for('login'))
+        embedding_cache = query_embedding_cache = batcher = None
+        # Sebelum warm-up selesai rag_core belum dimuat; jangan muat di request ini
+        if warmup.is_ready():
+            from .rag_core import get_embedding_cache_stats, get_query_embedding_cache_stats, query_batcher
+            embedding_cache = get_embedding_cache_stats()
+            query_embedding_cache = get_query_embedding_cache_stats()
+            batcher = query_batcher.stats() if query_batcher is not None else None
+        return jsonify({
+            'semantic_cache': semantic_cache.stats() if semantic_cache is not None else None,
+            'embedding_cache': embedding_cache,
+            'query_embedding_cache': query_embedding_cache,
+            'query_batcher': batcher,
+            'prompt': prompt_stats(),
+            'warmup': warmup.status(),
+        })
+
     @app.route('/file/<int:complaint_id>')
     def display_file(complaint_id):
         complaint = Pengaduan.query.get(complaint_id)
         if complaint and complaint.file_upload:
-            # Serve file from filesystem instead of database
-            return send_from_directory(UPLOAD_FOLDER, complaint.file_upload)
+            # Serve file from filesystem instead of database; ?size=thumb untuk daftar
+            return media.send(complaint.file_upload, request.args.get('size'))
         return "File tidak ditemukan", 404
 
     @app.route('/pengaduan/<int:complaint_id>/delete', methods=['POST'])
@@ -345,17 +712,17 @@ def register_routes(app):
 
         # Pastikan pengguna hanya bisa menghapus pengaduan mereka sendiri
         if complaint and complaint.user_id == user.id:
-            # Delete file if exists
+            # Delete file and its variants once no other complaint or profile uses it
             if complaint.file_upload:
-                try:
-                    file_path = os.path.join(UPLOAD_FOLDER, complaint.file_upload)
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
-                except:
-                    pass
+                media.release(complaint.file_upload)
             
+            region = complaint.region
+            file_upload = complaint.file_upload
             db.session.delete(complaint)
             db.session.commit()
+            if file_upload:
+                media.collect(file_upload)
+            _invalidate_region(region)
             flash('Pengaduan berhasil dihapus.', 'success')
         else:
             flash('Anda tidak memiliki izin untuk menghapus pengaduan ini.', 'error')
@@ -371,19 +738,28 @@ def register_routes(app):
         
         if request.method == 'POST':
             # Handle profile photo upload
+            upload, old_pic = None, None
             if 'profile_pic' in request.files:
                 file = request.files['profile_pic']
                 if file and allowed_file(file.filename):
-                    filename = secure_filename(file.filename)
-                    file_path = os.path.join(UPLOAD_FOLDER, filename)
-                    file.save(file_path)
-                    user.profile_pic = filename
+                    try:
+                        profile_pic, upload = _store_image('profile', file)
+                    except UploadTooLarge:
+                        flash(f'Ukuran foto maksimal {UPLOAD_MAX_BYTES // (1024 * 1024)} MB.', 'error')
+                        return redirect(url_for('profil'))
+                    if user.profile_pic:
+                        old_pic = user.profile_pic
+                        media.release(old_pic)
+                    user.profile_pic = profile_pic
             
             # Update other fields
             user.name = request.form['name']
             user.phone = request.form['phone']
             
             db.session.commit()
+            _process_upload(upload)
+            if old_pic:
+                media.collect(old_pic)
             session['user_name'] = user.name
             flash('Profil berhasil diperbarui.', 'success')
             return redirect(url_for('profil'))
@@ -392,7 +768,7 @@ def register_routes(app):
 
     @app.route('/uploads/<filename>')
     def uploaded_file(filename):
-        return send_from_directory(UPLOAD_FOLDER, filename)
+        return media.send(filename, request.args.get('size'))
 
     @app.route('/profil/delete_photo', methods=['POST'])
     def delete_photo():
@@ -401,14 +777,11 @@ def register_routes(app):
         
         user = User.query.get(session['user_id'])
         if user.profile_pic:
-            try:
-                file_path = os.path.join(UPLOAD_FOLDER, user.profile_pic)
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-            except:
-                pass
+            profile_pic = user.profile_pic
+            media.release(profile_pic)
             user.profile_pic = None
             db.session.commit()
+            media.collect(profile_pic)
             flash('Foto profil berhasil dihapus.', 'success')
         
         return redirect(url_for('profil'))
@@ -0,0 +1,93 @@
+"""
+Full-text search over complaints.
+
+On PostgreSQL, migrate_db.py adds a stored generated column
+pengaduan.search_vector (category weighted A, problem_description B,
+actions_taken C) with a GIN index. The column is not part of the model, so
+ORM inserts never touch it. The query runs in two steps: the GIN index finds
+the matches, which are ranked and limited in an inner query, and only those
+rows get a ts_headline snippet, which is the expensive part.
+
+Other databases (SQLite in development) fall back to LIKE over the same
+columns without ranking.
+"""
+
+from markupsafe import Markup, escape
+from sqlalchemy import select, func, cast, column, or_, literal, text as sql_text
+from sqlalchemy.dialects.postgresql import REGCONFIG
+
+from .models import db, Pengaduan
+
+# Snowball 'indonesian' tersedia sejak PostgreSQL 12; selain itu 'simple'
+PREFERRED_TS_CONFIG = 'indonesian'
+FALLBACK_TS_CONFIG = 'simple'
+SEARCH_COLUMNS = ('id', 'name', 'region', 'status', 'category', 'severity', 'created_at')
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+# Penanda yang tidak mungkin ada di input, diganti <mark> setelah teks di-escape
+START_SEL, STOP_SEL = '\x02', '\x03'
+HEADLINE_OPTIONS = f"StartSel={START_SEL}, StopSel={STOP_SEL}, MaxWords=25, MinWords=8, MaxFragments=2"
+
+_ts_config = None
+
+def ts_config(connection):
+    """Text search configuration used by both the column and the queries"""
+    global _ts_config
+    if _ts_config is None:
+        found = connection.execute(sql_text("SELECT 1 FROM pg_ts_config WHERE cfgname = :name"),
+                                   {'name': PREFERRED_TS_CONFIG}).first()
+        _ts_config = PREFERRED_TS_CONFIG if found else FALLBACK_TS_CONFIG
+    return _ts_config
+
+def search_vector_sql(config):
+    """Generation expression of pengaduan.search_vector"""
+    return (f"setweight(to_tsvector('{config}', coalesce(category, '')), 'A') || "
+            f"setweight(to_tsvector('{config}', coalesce(problem_description, '')), 'B') || "
+            f"setweight(to_tsvector('{config}', coalesce(actions_taken, '')), 'C')")
+
+def _highlight(snippet):
+    """Escape a snippet and turn the headline markers into <mark>"""
+    return Markup(str(escape(snippet)).replace(START_SEL, '<mark>').replace(STOP_SEL, '</mark>'))
+
+def _filtered(query, table, filters):
+    for name, value in filters.items():
+        query = query.where(table.c[name] == value)
+    return query
+
+def search_complaints(text, filters=None, limit=DEFAULT_LIMIT):
+    """Best matches for text as dicts with SEARCH_COLUMNS, rank and a highlighted snippet.
+
+    text uses web search syntax ("pupuk langka", -banjir, wereng OR hama).
+    filters maps Pengaduan columns (region, status, category, user_id) to values.
+    """
+    table = Pengaduan.__table__
+    filters = filters or {}
+    limit = max(1, min(limit, MAX_LIMIT))
+    connection = db.session.connection()
+    if connection.dialect.name != 'postgresql':
+        return _search_like(table, text, filters, limit)
+
+    config = cast(literal(ts_config(connection)), REGCONFIG)
+    query = func.websearch_to_tsquery(config, text)
+    vector = column('search_vector')
+    rank = func.ts_rank_cd(vector, query).label('rank')
+    ranked = _filtered(
+        select(*[table.c[name] for name in SEARCH_COLUMNS], table.c.problem_description, rank)
+        .select_from(table).where(vector.op('@@')(query)), table, filters
+    ).order_by(rank.desc(), table.c.created_at.desc()).limit(limit).subquery()
+
+    rows = connection.execute(
+        select(*[ranked.c[name] for name in SEARCH_COLUMNS], ranked.c.rank,
+               func.ts_headline(config, ranked.c.problem_description, query, HEADLINE_OPTIONS).label('snippet'))
+        .order_by(ranked.c.rank.desc(), ranked.c.created_at.desc()))
+    return [dict(row._mapping, snippet=_highlight(row.snippet)) for row in rows]
+
+def _search_like(table, text, filters, limit):
+    pattern = f"%{text.strip()}%"
+    rows = db.session.execute(_filtered(
+        select(*[table.c[name] for name in SEARCH_COLUMNS], table.c.problem_description)
+        .where(or_(table.c.problem_description.ilike(pattern), table.c.actions_taken.ilike(pattern),
+                   table.c.category.ilike(pattern))), table, filters
+    ).order_by(table.c.created_at.desc()).limit(limit))
+    return [dict({name: row._mapping[name] for name in SEARCH_COLUMNS}, rank=None,
+                 snippet=escape(row.problem_description[:200])) for row in rows]
@@ -0,0 +1,112 @@
+"""
+Semantic response cache for /chat.
+
+Answers are stored under the question's embedding. A new question whose
+cosine similarity to a cached one reaches the threshold, and whose recent
+history matches, reuses the cached answer instead of calling the LLM.
+"""
+
+import time
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+
+class SemanticCache:
+    """Small in-process vector index of answered questions with TTL and LRU eviction"""
+
+    def __init__(self, threshold=0.92, ttl=3600, capacity=2000, history_turns=2, candidates=8):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.capacity = capacity
+        self.history_turns = history_turns
+        self.candidates = candidates
+        self.hits = 0
+        self.misses = 0
+        self._index = None
+        self._entries = OrderedDict()  # id -> (history_key, expires_at, result)
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def history_key(self, history):
+        """Fingerprint of the last history_turns turns; older turns do not affect reuse"""
+        recent = history[-self.history_turns:] if self.history_turns else []
+        normalized = [[str(turn.get('user', '')).strip().lower(), str(turn.get('bot', '')).strip()]
+                      for turn in recent]
+        return hashlib.sha1(json.dumps(normalized).encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def _normalize(embedding):
+        # faiss diimpor saat dipakai agar startup aplikasi tidak menunggunya
+        import faiss
+        vector = np.asarray(embedding, dtype='float32').reshape(1, -1).copy()
+        faiss.normalize_L2(vector)
+        return vector
+
+    def _remove(self, entry_ids):
+        for entry_id in entry_ids:
+            self._entries.pop(entry_id, None)
+        if entry_ids:
+            self._index.remove_ids(np.array(entry_ids, dtype='int64'))
+
+    def lookup(self, query_embedding, history):
+        """Return the cached result for a near-duplicate question, or None"""
+        history_key = self.history_key(history)
+        vector = self._normalize(query_embedding)
+        with self._lock:
+            if self._index is None or self._index.ntotal == 0 or self._index.d != vector.shape[1]:
+                self.misses += 1
+                return None
+            similarities, ids = self._index.search(vector, min(self.candidates, self._index.ntotal))
+            now = time.time()
+            expired = []
+            result = None
+            for similarity, entry_id in zip(similarities[0], ids[0]):
+                if entry_id == -1 or similarity < self.threshold:
+                    break
+                entry_key, expires_at, cached = self._entries[int(entry_id)]
+                if expires_at <= now:
+                    expired.append(int(entry_id))
+                elif entry_key == history_key:
+                    self._entries.move_to_end(int(entry_id))
+                    result = cached
+                    break
+            self._remove(expired)
+            if result is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return result
+
+    def store(self, query_embedding, history, result):
+        """Cache an answer under the question's embedding"""
+        vector = self._normalize(query_embedding)
+        with self._lock:
+            if self._index is None or self._index.d != vector.shape[1]:
+                import faiss
+                self._index = faiss.IndexIDMap2(faiss.IndexFlatIP(vector.shape[1]))
+                self._entries.clear()
+            now = time.time()
+            evict = [entry_id for entry_id, (_, expires_at, _) in self._entries.items() if expires_at <= now]
+            overflow = len(self._entries) - len(evict) + 1 - self.capacity
+            if overflow > 0:
+                # OrderedDict diurutkan dari yang paling lama tidak dipakai (LRU)
+                expired = set(evict)
+                live = [entry_id for entry_id in self._entries if entry_id not in expired]
+                evict.extend(live[:overflow])
+            self._remove(evict)
+
+            entry_id = self._next_id
+            self._next_id += 1
+            self._index.add_with_ids(vector, np.array([entry_id], dtype='int64'))
+            self._entries[entry_id] = (self.history_key(history), now + self.ttl, result)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'entries': len(self._entries),
+        }
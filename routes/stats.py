@@ -0,0 +1,135 @@
+"""
+Incrementally maintained counters for the monitoring pages.
+
+pengaduan_stats and user_stats are updated in the same transaction as the
+rows they count: after every ORM flush the net change per key is applied
+with an atomic upsert, so a rollback undoes both. Writes that bypass the
+ORM session (raw SQL, bulk inserts, retention deletes) must apply deltas
+themselves with apply_deltas() or be followed by reconcile_stats().
+"""
+
+from collections import Counter
+from sqlalchemy import event, inspect, select, func, delete
+from sqlalchemy.orm import Session
+from .models import User, Pengaduan, PengaduanStats, UserStats, dialect_insert
+
+def _value(obj, name, committed=False):
+    """Attribute value, or its value before this flush if committed is set"""
+    if committed:
+        history = inspect(obj).attrs[name].history
+        if history.deleted:
+            return history.deleted[0]
+    value = getattr(obj, name)
+    if value is None:
+        # Default kolom baru terisi saat INSERT
+        default = obj.__table__.c[name].default
+        value = default.arg if default is not None and not callable(default.arg) else None
+    return value if value is not None else ''
+
+def pengaduan_key(obj, committed=False):
+    return tuple(_value(obj, name, committed) for name in ('region', 'status', 'category'))
+
+def user_key(obj, committed=False):
+    return _value(obj, 'role', committed)
+
+def _changed(obj, names):
+    state = inspect(obj)
+    return any(state.attrs[name].history.has_changes() for name in names)
+
+def collect_deltas(session):
+    """Net count change per stats key for the objects of the current flush"""
+    complaints, users = Counter(), Counter()
+    for obj in session.new:
+        if isinstance(obj, Pengaduan):
+            complaints[pengaduan_key(obj)] += 1
+        elif isinstance(obj, User):
+            users[user_key(obj)] += 1
+    for obj in session.deleted:
+        if isinstance(obj, Pengaduan):
+            complaints[pengaduan_key(obj, committed=True)] -= 1
+        elif isinstance(obj, User):
+            users[user_key(obj, committed=True)] -= 1
+    for obj in session.dirty:
+        if isinstance(obj, Pengaduan) and _changed(obj, ('region', 'status', 'category')):
+            complaints[pengaduan_key(obj, committed=True)] -= 1
+            complaints[pengaduan_key(obj)] += 1
+        elif isinstance(obj, User) and _changed(obj, ('role',)):
+            users[user_key(obj, committed=True)] -= 1
+            users[user_key(obj)] += 1
+    return complaints, users
+
+def apply_deltas(connection, complaints=None, users=None):
+    """Add count deltas with one upsert per key, in a stable order to avoid deadlocks"""
+    insert = dialect_insert(connection.dialect.name)
+    for (region, status, category), delta in sorted((complaints or {}).items()):
+        if delta:
+            stmt = insert(PengaduanStats.__table__).values(region=region, status=status, category=category, count=delta)
+            connection.execute(stmt.on_conflict_do_update(
+                index_elements=['region', 'status', 'category'],
+                set_={'count': PengaduanStats.__table__.c.count + stmt.excluded.count}))
+    for role, delta in sorted((users or {}).items()):
+        if delta:
+            stmt = insert(UserStats.__table__).values(role=role, count=delta)
+            connection.execute(stmt.on_conflict_do_update(
+                index_elements=['role'],
+                set_={'count': UserStats.__table__.c.count + stmt.excluded.count}))
+
+def _load_old_value(target, value, oldvalue, initiator):
+    return value
+
+# active_history: nilai lama dimuat sebelum di-set meskipun atribut sudah expired
+# (setelah commit), supaya delta bisa mengurangi kunci yang lama
+for _attribute in (Pengaduan.region, Pengaduan.status, Pengaduan.category, User.role):
+    event.listen(_attribute, 'set', _load_old_value, active_history=True, retval=True)
+
+@event.listens_for(Session, 'before_flush')
+def _collect_stats_deltas(session, flush_context, instances):
+    # Dihitung sebelum flush: objek yang dihapus masih bisa dibaca atributnya
+    session.info['stats_deltas'] = collect_deltas(session)
+
+@event.listens_for(Session, 'after_flush')
+def _apply_stats_deltas(session, flush_context):
+    complaints, users = session.info.pop('stats_deltas', (None, None))
+    if complaints and any(complaints.values()) or users and any(users.values()):
+        apply_deltas(session.connection(), complaints, users)
+
+def _repair(connection, table, key_columns, actual):
+    stored = {tuple(row[:-1]): row[-1] for row in connection.execute(
+        select(*[table.c[name] for name in key_columns], table.c.count))}
+    repaired = 0
+    for key in sorted(set(stored) | set(actual)):
+        count = actual.get(key, 0)
+        if stored.get(key) == count:
+            continue
+        repaired += 1
+        condition = [table.c[name] == value for name, value in zip(key_columns, key)]
+        if count == 0:
+            connection.execute(delete(table).where(*condition))
+        elif key in stored:
+            connection.execute(table.update().where(*condition).values(count=count))
+        else:
+            connection.execute(table.insert().values(**dict(zip(key_columns, key)), count=count))
+    return repaired
+
+def reconcile_stats(connection):
+    """Recount both tables from scratch and fix rows that drifted.
+
+    Run inside a transaction. On PostgreSQL the stats tables are locked
+    first: writers that already bumped a counter are waited for, writers
+    that come later block until the recount commits and then apply their
+    delta on top. Returns the number of repaired rows.
+    """
+    if connection.dialect.name == 'postgresql':
+        connection.exec_driver_sql(
+            "LOCK TABLE pengaduan_stats, user_stats IN SHARE ROW EXCLUSIVE MODE")
+    pengaduan, user = Pengaduan.__table__, User.__table__
+    complaints = {
+        (region or '', status or '', category or ''): count
+        for region, status, category, count in connection.execute(
+            select(pengaduan.c.region, pengaduan.c.status, pengaduan.c.category, func.count())
+            .group_by(pengaduan.c.region, pengaduan.c.status, pengaduan.c.category))
+    }
+    users = {(role or '',): count for role, count in connection.execute(
+        select(user.c.role, func.count()).group_by(user.c.role))}
+    return (_repair(connection, PengaduanStats.__table__, ('region', 'status', 'category'), complaints)
+            + _repair(connection, UserStats.__table__, ('role',), users))
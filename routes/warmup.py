@@ -0,0 +1,91 @@
+"""
+Background warm-up of the RAG system.
+
+rag_core pulls in faiss, fitz, google.generativeai and langchain, and
+loading the published index maps several files; none of that is needed to
+serve the login page or the dashboards. start() runs the import, the
+index load and db.create_all() in one daemon thread per process while
+requests are already being served. /readyz reports when it has finished,
+and /chat answers "warming up" until then.
+
+A failed warm-up (no index built yet, unreachable database) is retried by
+the next start() call after WARMUP_RETRY_SECONDS. Workers forked from a
+preloaded master start their own thread unless the master was already
+ready.
+"""
+
+import os
+import time
+import threading
+
+from .config import WARMUP_RETRY_SECONDS
+
+_lock = threading.Lock()
+_thread = None
+_pid = None
+_state = {'status': 'pending', 'error': None, 'started_at': None, 'finished_at': None}
+
+def _run(app):
+    started = time.time()
+    _state.update(status='warming_up', error=None, started_at=started, finished_at=None)
+    error = None
+    with app.app_context():
+        from .models import db
+        try:
+            db.create_all()
+        except Exception as e:
+            # Tabel bisa saja sudah dibuat migrate_db.py; RAG tetap dimuat
+            print("⚠️ Gagal membuat tabel:", e)
+        try:
+            from .rag_core import initialize_rag_system
+            if initialize_rag_system() is None:
+                error = "Indeks RAG belum tersedia"
+        except Exception as e:
+            print("⚠️ Gagal inisialisasi RAG system:", e)
+            error = str(e)
+    _state.update(status='failed' if error else 'ready', error=error, finished_at=time.time())
+    if not error:
+        print(f"✅ Warm-up selesai dalam {time.time() - started:.1f} detik.")
+
+def start(app):
+    """Start warm-up in this process unless it is ready, running, or failed only recently"""
+    global _thread, _pid
+    if _state['status'] == 'ready':
+        return
+    with _lock:
+        running = _thread is not None and _pid == os.getpid() and _thread.is_alive()
+        if _state['status'] == 'ready' or running:
+            return
+        finished_at = _state['finished_at']
+        if _state['status'] == 'failed' and finished_at and time.time() - finished_at < WARMUP_RETRY_SECONDS:
+            return
+        _thread = threading.Thread(target=_run, args=(app,), name='rag-warmup', daemon=True)
+        _pid = os.getpid()
+        _thread.start()
+
+def mark_ready(rag):
+    """Install an already loaded RAG system (benchmark_rag.py) instead of warming up"""
+    from . import rag_core
+    rag_core._rag_system = rag
+    _state.update(status='ready', error=None, finished_at=time.time())
+
+def is_ready():
+    return _state['status'] == 'ready'
+
+def has_failed():
+    return _state['status'] == 'failed'
+
+def rag_system():
+    """The loaded RAG system, or None while warming up"""
+    if not is_ready():
+        return None
+    from .rag_core import get_rag_system
+    return get_rag_system()
+
+def status():
+    """Warm-up state for /readyz"""
+    state = dict(_state)
+    if state['status'] == 'ready':
+        rag = rag_system()
+        state['index_version'] = rag.version if rag is not None else None
+    return state
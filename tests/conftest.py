@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+
+# Config dibaca saat import: folder upload sementara, bukan path produksi
+os.environ.setdefault('UPLOAD_FOLDER', tempfile.mkdtemp(prefix='agrollm_uploads_'))
+os.environ.setdefault('EMBEDDING_BACKEND', 'local')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,19 @@
+from routes import rag_core
+from routes.embedding_store import EmbeddingStore, QueryEmbeddingCache
+
+def test_query_embeddings_stay_out_of_the_persistent_store(tmp_path, monkeypatch):
+    store = EmbeddingStore(str(tmp_path / 'embeddings.sqlite3'))
+    queries = QueryEmbeddingCache(maxsize=2, ttl=60)
+    monkeypatch.setattr(rag_core, 'embedding_store', store)
+    monkeypatch.setattr(rag_core, 'query_embedding_cache', queries)
+
+    rag_core.get_doc_embeddings(['wereng batang coklat menyerang padi'])
+    rag_core.get_query_embeddings(['apa itu wereng?', 'cara mengatasi wereng?'])
+    assert rag_core.get_query_embedding('apa itu wereng?') is not None
+    assert store.count() == 1
+    assert queries.stats()['hits'] == 1
+
+    # Pertanyaan baru menggeser yang paling lama tidak dipakai
+    rag_core.get_query_embeddings(['pupuk untuk padi?'])
+    assert queries.count() == 2
+    assert store.count() == 1
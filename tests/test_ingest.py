@@ -0,0 +1,104 @@
+import io
+import os
+import json
+from datetime import date
+
+import pytest
+from flask import Flask
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+import routes.routes as routes_module
+from routes import warmup
+from routes.media import MediaProcessor
+from routes.models import db, User, Upload
+
+TEMPLATES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'templates')
+
+def _item(key, attachment):
+    return {'idempotency_key': key, 'attachment': attachment, 'name': 'Budi', 'email': 'b@x.id',
+            'phone': '0812', 'address': 'Jl. Sawah', 'region': 'Bantul', 'category': 'hama',
+            'problem_description': 'wereng', 'severity': 'sedang', 'actions_taken': 'semprot',
+            'follow_up_request': 'kunjungan', 'incident_date': '2024-05-01', 'data_consent': True,
+            'data_accuracy': True}
+
+def _batch(items, files):
+    data = {'items': '\n'.join(json.dumps(item) for item in items)}
+    data.update({name: (io.BytesIO(content), f"{name}.jpg") for name, content in files.items()})
+    return data
+
+def _stored_files(folder):
+    return sorted(os.path.relpath(os.path.join(root, name), folder)
+                  for root, _, names in os.walk(folder) for name in names)
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    folder = tmp_path / 'uploads'
+    folder.mkdir()
+    monkeypatch.setattr(routes_module, 'UPLOAD_FOLDER', str(folder))
+    monkeypatch.setattr(warmup, 'start', lambda app: None)
+    monkeypatch.setattr(MediaProcessor, 'submit', lambda self, app, upload_id: None)
+    app = Flask(__name__, template_folder=TEMPLATES)
+    app.config.update(SECRET_KEY='test', SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'test.db'}",
+                      CACHE_TYPE='NullCache')
+    db.init_app(app)
+    with app.app_context():
+        routes_module.register_routes(app)
+        db.create_all()
+        user = User(name='Budi', dob=date(1990, 1, 1), gender='L', email='b@x.id', phone='0812',
+                    password='x', role='petani')
+        db.session.add(user)
+        db.session.commit()
+        app.config['TEST_USER_ID'] = user.id
+    app.config['TEST_UPLOAD_FOLDER'] = str(folder)
+    return app
+
+def test_conflict_leaves_upload_folder_unchanged(app, monkeypatch):
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s['user_id'] = app.config['TEST_USER_ID']
+    folder = app.config['TEST_UPLOAD_FOLDER']
+
+    response = client.post('/api/pengaduan/batch', data=_batch([_item('k1', 'a')], {'a': b'existing'}),
+                           content_type='multipart/form-data')
+    assert response.status_code == 200 and response.get_json()['created'] == 1
+    before = _stored_files(folder)
+
+    real_ingest = routes_module.ingest
+    def conflicting_ingest(*args):
+        real_ingest(*args)
+        raise IntegrityError('INSERT INTO ingest_key', {}, Exception('duplicate key'))
+    monkeypatch.setattr(routes_module, 'ingest', conflicting_ingest)
+
+    # Satu lampiran sudah tersimpan (harus tetap ada), satu baru (harus hilang)
+    response = client.post('/api/pengaduan/batch',
+                           data=_batch([_item('k2', 'a'), _item('k3', 'b')], {'a': b'existing', 'b': b'new'}),
+                           content_type='multipart/form-data')
+    assert response.status_code == 409
+    assert _stored_files(folder) == before
+    with app.app_context():
+        assert [(u.ref_count) for u in Upload.query.all()] == [1]
+
+def test_unexpected_error_leaves_upload_folder_unchanged(app, monkeypatch):
+    client = app.test_client()
+    with client.session_transaction() as s:
+        s['user_id'] = app.config['TEST_USER_ID']
+    folder = app.config['TEST_UPLOAD_FOLDER']
+
+    response = client.post('/api/pengaduan/batch', data=_batch([_item('k1', 'a')], {'a': b'existing'}),
+                           content_type='multipart/form-data')
+    assert response.status_code == 200
+    before = _stored_files(folder)
+
+    real_ingest = routes_module.ingest
+    def failing_ingest(*args):
+        real_ingest(*args)
+        raise OperationalError('COMMIT', {}, Exception('canceling statement due to statement timeout'))
+    monkeypatch.setattr(routes_module, 'ingest', failing_ingest)
+
+    response = client.post('/api/pengaduan/batch',
+                           data=_batch([_item('k2', 'a'), _item('k3', 'b')], {'a': b'existing', 'b': b'new'}),
+                           content_type='multipart/form-data')
+    assert response.status_code == 500
+    assert _stored_files(folder) == before
+    with app.app_context():
+        assert [(u.ref_count) for u in Upload.query.all()] == [1]
@@ -0,0 +1,35 @@
+import io
+
+from flask import Flask
+from PIL import Image
+
+from routes.media import MediaProcessor, stage_upload, process_image
+from routes.models import db
+
+class _Upload:
+    def __init__(self, data):
+        self.stream = io.BytesIO(data)
+
+def test_original_stays_available_after_processing(tmp_path):
+    app = Flask(__name__)
+    app.config.update(SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'test.db'}")
+    db.init_app(app)
+    photo = io.BytesIO()
+    Image.new('RGB', (2000, 1500), 'green').save(photo, 'PNG')
+    folder = str(tmp_path)
+    media = MediaProcessor(folder)
+
+    with app.test_request_context():
+        db.create_all()
+        filename, size, staged = stage_upload(_Upload(photo.getvalue()), folder, 'png')
+        upload, created = media.acquire(filename, 'complaint', size, staged)
+        upload.width, upload.height = process_image(folder, filename)
+        upload.status = 'ready'
+        db.session.commit()
+
+        responses = {size: media.send(filename, size) for size in (None, 'thumb', 'original')}
+        for response in responses.values():
+            response.direct_passthrough = False
+        assert responses[None].mimetype == responses['thumb'].mimetype == 'image/webp'
+        assert responses['original'].mimetype == 'image/png'
+        assert responses['original'].get_data() == photo.getvalue()
@@ -0,0 +1,50 @@
+from flask import Flask
+
+import routes.routes as routes_module
+from routes import warmup
+from routes.models import db
+
+def _client(monkeypatch, token):
+    monkeypatch.setattr(routes_module, 'METRICS_TOKEN', token)
+    monkeypatch.setattr(warmup, 'start', lambda app: None)
+    app = Flask(__name__)
+    app.config.update(SECRET_KEY='test', SQLALCHEMY_DATABASE_URI='sqlite://', CACHE_TYPE='NullCache')
+    db.init_app(app)
+    routes_module.register_routes(app)
+    return app.test_client()
+
+def test_metrics_disabled_without_token(monkeypatch):
+    assert _client(monkeypatch, '').get('/metrics').status_code == 404
+
+def test_metrics_require_bearer_token(monkeypatch):
+    client = _client(monkeypatch, 'rahasia')
+    assert client.get('/metrics').status_code == 401
+    response = client.get('/metrics', headers={'Authorization': 'Bearer rahasia'})
+    assert response.status_code == 200 and b'agrollm_' in response.data
+
+def test_streamed_response_measured_until_body_is_sent():
+    import time
+    from flask import Response, stream_with_context
+    from sqlalchemy import text
+    from routes.metrics import instrument_app, request_seconds, sql_queries
+
+    app = Flask(__name__)
+    app.config.update(SQLALCHEMY_DATABASE_URI='sqlite://')
+    db.init_app(app)
+    instrument_app(app)
+
+    @app.route('/stream-test')
+    def stream_test():
+        def body():
+            for _ in range(3):
+                time.sleep(0.05)
+                db.session.execute(text('SELECT 1'))
+                yield 'x'
+        return Response(stream_with_context(body()))
+
+    response = app.test_client().get('/stream-test', buffered=False)
+    assert response.get_data() == b'xxx'
+    response.close()
+    latency = request_seconds.labels(endpoint='stream_test').snapshot()
+    assert latency['count'] == 1 and latency['sum'] >= 0.15
+    assert sql_queries.labels(endpoint='stream_test').snapshot()['sum'] == 3
@@ -0,0 +1,29 @@
+import threading
+from concurrent.futures import TimeoutError
+
+import numpy as np
+import pytest
+
+from routes.query_batcher import QueryBatcher
+
+def test_timed_out_query_is_cancelled_and_skipped():
+    release = threading.Event()
+    embedded = []
+
+    def embed(texts):
+        embedded.append(list(texts))
+        release.wait(5)
+        return np.ones((len(texts), 2), dtype='float32')
+
+    def search(vectors):
+        return np.zeros((len(vectors), 1)), np.zeros((len(vectors), 1), dtype='int64')
+
+    batcher = QueryBatcher(embed, search, max_batch_size=1, max_wait_ms=0)
+    first = batcher.submit('pertama')
+    # Worker masih sibuk dengan 'pertama': 'kedua' menunggu lalu menyerah
+    with pytest.raises(TimeoutError):
+        batcher.query('kedua', timeout=0.05)
+    release.set()
+    assert first.result(timeout=5)[2].tolist() == [0]
+    assert batcher.query('ketiga', timeout=5)[2].tolist() == [0]
+    assert ['kedua'] not in embedded
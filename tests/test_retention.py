@@ -0,0 +1,39 @@
+import os
+from datetime import date, datetime, timedelta
+
+from flask import Flask
+
+from routes.models import db, User, Pengaduan
+from routes.retention import run_retention
+
+def _complaint(user, filename, created_at):
+    return Pengaduan(user_id=user.id, name='Budi', email='b@x.id', phone='0812', address='Jl. Sawah',
+                     region='Bantul', category='hama', problem_description='wereng', severity='sedang',
+                     incident_date=date(2024, 5, 1), actions_taken='semprot', follow_up_request='kunjungan',
+                     data_consent=True, data_accuracy=True, status='processed', file_upload=filename,
+                     created_at=created_at)
+
+def test_shared_legacy_file_survives_retention(tmp_path):
+    app = Flask(__name__)
+    app.config.update(SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'test.db'}")
+    db.init_app(app)
+    folder = tmp_path / 'uploads'
+    folder.mkdir()
+    for name in ('image.jpg', 'only.jpg', 'avatar.jpg'):
+        (folder / name).write_bytes(b'x')
+
+    old, recent = datetime.utcnow() - timedelta(days=400), datetime.utcnow()
+    with app.app_context():
+        db.create_all()
+        user = User(name='Budi', dob=date(1990, 1, 1), gender='L', email='b@x.id', phone='0812',
+                    password='x', role='petani', profile_pic='avatar.jpg')
+        db.session.add(user)
+        db.session.commit()
+        # Nama lama dari secure_filename: sama untuk pengaduan dan foto profil yang berbeda
+        db.session.add_all([_complaint(user, 'image.jpg', old), _complaint(user, 'image.jpg', recent),
+                            _complaint(user, 'only.jpg', old), _complaint(user, 'avatar.jpg', old)])
+        db.session.commit()
+
+        assert run_retention(db.engine, str(folder), 365)['rows_deleted'] == 3
+
+    assert sorted(os.listdir(folder)) == ['avatar.jpg', 'image.jpg']